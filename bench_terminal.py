@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""Headless benchmarks for the mops terminal hot paths.
+
+Runs MopsTerminal under the offscreen Qt platform against generated
+fixtures and prints the results as JSON:
+
+    python bench_terminal.py --output bench.json
+    python bench_terminal.py --baseline bench.json      # exit 1 on regression
+
+Every benchmark is repeated and reported as median/min. With --baseline,
+medians are compared and anything worse by more than --threshold (default
+15%) is flagged as a regression.
+"""
+import os
+import sys
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import argparse
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+
+from PyQt5.QtCore import QT_VERSION_STR
+from PyQt5.QtWidgets import QApplication
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import mops_terminal  # noqa: E402
+
+# unit -> whether a bigger number is better
+UNITS = {"s": False, "lines/s": True, "MB/s": True}
+BENCHMARKS = []
+
+
+def benchmark(name, unit="s", repeat=5):
+    """Register ``fn(ctx) -> measurement``; ``fn`` times its own critical section."""
+    def register(fn):
+        BENCHMARKS.append((name, unit, repeat, fn))
+        return fn
+    return register
+
+
+class BenchTerminal(mops_terminal.MopsTerminal):
+    """MopsTerminal without the modal startup dialog or state in the user's home."""
+
+    def show_startup_dialog(self):
+        pass
+
+
+def isolate_home(root):
+    for attr, name in (("SESSION_FILE", "session"), ("FAVORITES_DB", "favorites.db"),
+                       ("CACHE_CONFIG", "cache.json"), ("SESSION_LOG_DIR", "logs"),
+                       ("FIND_INDEX", "find_index")):
+        setattr(BenchTerminal, attr, os.path.join(root, name))
+    # Served sessions create their own engines
+    mops_terminal.TerminalEngine.CACHE_CONFIG = BenchTerminal.CACHE_CONFIG
+    mops_terminal.TerminalEngine.FIND_INDEX = BenchTerminal.FIND_INDEX
+
+
+def settle(term):
+    """Stop typing animations and empty the output so runs do not affect each other."""
+    for timer in list(term._anim_timers):
+        timer.stop()
+    term._anim_timers.clear()
+    QApplication.processEvents()
+    term.output.clear()
+
+
+# ---------------- fixtures ----------------
+def make_tree(root, depth=3, fanout=5, files=20):
+    """A directory tree of small text files; returns the number of files written."""
+    count = 0
+    for i in range(files):
+        with open(os.path.join(root, f"file_{i:03d}.txt"), "w") as f:
+            f.write("".join(f"line {n} of {root} needle\n" if n % 7 == 0 else f"line {n}\n" for n in range(40)))
+        count += 1
+    if depth:
+        for i in range(fanout):
+            sub = os.path.join(root, f"dir_{i}")
+            os.makedirs(sub, exist_ok=True)
+            count += make_tree(sub, depth - 1, fanout, files)
+    return count
+
+
+def make_flat_dir(root, n):
+    os.makedirs(root, exist_ok=True)
+    for i in range(n):
+        open(os.path.join(root, f"entry_{i:05d}.dat"), "w").close()
+
+
+def make_archives(root, src):
+    zip_path = os.path.join(root, "fixture.zip")
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as z:
+        for dirpath, _, names in os.walk(src):
+            for name in names:
+                full = os.path.join(dirpath, name)
+                z.write(full, os.path.relpath(full, src))
+    tar_path = os.path.join(root, "fixture.tar.gz")
+    with tarfile.open(tar_path, "w:gz") as t:
+        t.add(src, arcname="tree")
+    return zip_path, tar_path
+
+
+# ---------------- benchmarks ----------------
+@benchmark("startup.time_to_first_prompt", repeat=3)
+def bench_startup(ctx):
+    """Fresh interpreter: imports, window construction and first event-loop pass."""
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--startup-probe", ctx["home"]],
+                         capture_output=True, text=True, timeout=120)
+    elapsed = time.perf_counter() - start
+    if "ready" not in out.stdout:
+        raise RuntimeError(f"startup probe failed: {out.stderr.strip()[-400:]}")
+    return elapsed
+
+
+def _append_rate(term, colors, lines=5000):
+    settle(term)
+    text = "The quick brown fox jumps over the lazy dog 0123456789\n"
+    start = time.perf_counter()
+    for i in range(lines):
+        term.append_text(text, color=colors[i % len(colors)], animate=False)
+    QApplication.processEvents()
+    return lines / (time.perf_counter() - start)
+
+
+@benchmark("append_text.plain", unit="lines/s")
+def bench_append_plain(ctx):
+    return _append_rate(ctx["term"], ["default"])
+
+
+@benchmark("append_text.colored", unit="lines/s")
+def bench_append_colored(ctx):
+    return _append_rate(ctx["term"], ["cyan", "green", "red", "yellow", "white", "gray"])
+
+
+@benchmark("handle_command.builtin_dispatch", repeat=7)
+def bench_dispatch(ctx):
+    """Mean latency of handle_command for builtins that do not start a process."""
+    term = ctx["term"]
+    settle(term)
+    commands = ["pwd", "jobs", "cache", "session", "record", "calc mode", "fav"] * 10
+    start = time.perf_counter()
+    for cmd in commands:
+        term.input.setText(cmd)
+        term.handle_command()
+    elapsed = time.perf_counter() - start
+    settle(term)
+    return elapsed / len(commands)
+
+
+@benchmark("update_completer_model.5000_entries")
+def bench_completer(ctx):
+    term = ctx["term"]
+    term.current_dir = ctx["flat"]
+    start = time.perf_counter()
+    term.update_completer_model()
+    elapsed = time.perf_counter() - start
+    term.current_dir = ctx["home"]
+    return elapsed
+
+
+def _timed_builtin(term, cwd, call):
+    settle(term)
+    term.current_dir = cwd
+    start = time.perf_counter()
+    call()
+    elapsed = time.perf_counter() - start
+    settle(term)
+    return elapsed
+
+
+@benchmark("list_dir.5000_entries", repeat=3)
+def bench_list_dir(ctx):
+    return _timed_builtin(ctx["term"], ctx["flat"], ctx["term"].engine.list_dir)
+
+
+@benchmark("print_tree.generated", repeat=3)
+def bench_print_tree(ctx):
+    return _timed_builtin(ctx["term"], ctx["tree"], lambda: ctx["term"].engine.print_tree(ctx["tree"]))
+
+
+@benchmark("search_files.generated", repeat=3)
+def bench_search(ctx):
+    return _timed_builtin(ctx["term"], ctx["tree"], lambda: ctx["term"].engine.search_files("needle"))
+
+
+def _extract(ctx, archive):
+    target = tempfile.mkdtemp(dir=ctx["home"])
+    try:
+        return _timed_builtin(ctx["term"], target, lambda: ctx["term"].engine.extract_archive(archive))
+    finally:
+        shutil.rmtree(target, ignore_errors=True)
+
+
+@benchmark("extract_archive.zip", repeat=3)
+def bench_extract_zip(ctx):
+    return _extract(ctx, ctx["zip"])
+
+
+@benchmark("extract_archive.tar_gz", repeat=3)
+def bench_extract_tar(ctx):
+    return _extract(ctx, ctx["tar"])
+
+
+@benchmark("serve.fanout_4_clients", unit="MB/s", repeat=3)
+def bench_serve_fanout(ctx):
+    """Process output delivered through a headless session to four attached clients."""
+    spec = "localhost:0" if os.name == "nt" else os.path.join(ctx["home"], "serve.sock")
+    server = mops_terminal.EngineServer(spec).start()
+    received, finished, clients = [0] * 4, [threading.Event() for _ in range(4)], []
+
+    def counter(i):
+        def on_message(message):
+            if message.get("stream") == "stdout":
+                received[i] += len(message["text"])
+            elif message.get("stream") == "exit":
+                finished[i].set()
+        return on_message
+
+    try:
+        for i in range(4):
+            clients.append(mops_terminal.EngineClient(server.spec, token=server.token, on_message=counter(i)))
+        time.sleep(0.2)
+        start = time.perf_counter()
+        clients[0].execute(f'"{sys.executable}" -c "import sys; sys.stdout.write((\'x\' * 99 + \'\\n\') * 200000)"')
+        # The sessions run on this thread's event loop
+        deadline = time.monotonic() + 120
+        while not all(event.is_set() for event in finished):
+            if time.monotonic() > deadline:
+                raise RuntimeError("fanout benchmark timed out")
+            QApplication.processEvents()
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+    finally:
+        for client in clients:
+            client.close()
+        server.close()
+    return sum(received) / elapsed / 1e6
+
+
+# ---------------- runner ----------------
+def run_benchmarks(only=None, quick=False):
+    home = tempfile.mkdtemp(prefix="mops-bench-")
+    isolate_home(home)
+    app = QApplication.instance() or QApplication(sys.argv)
+    tree = os.path.join(home, "tree")
+    os.makedirs(tree)
+    ctx = {"home": home, "tree": tree, "flat": os.path.join(home, "flat")}
+    ctx["tree_files"] = make_tree(tree)
+    make_flat_dir(ctx["flat"], 5000)
+    ctx["zip"], ctx["tar"] = make_archives(home, tree)
+    ctx["term"] = BenchTerminal(restore_session=False)
+    ctx["term"].show()
+    app.processEvents()
+
+    results = {}
+    try:
+        for name, unit, repeat, fn in BENCHMARKS:
+            if only and not any(part in name for part in only):
+                continue
+            samples = [fn(ctx) for _ in range(1 if quick else repeat)]
+            results[name] = {"unit": unit, "median": statistics.median(samples), "min": min(samples),
+                             "max": max(samples), "runs": len(samples)}
+            print(f"{name:42} {results[name]['median']:>14.6g} {unit}", file=sys.stderr)
+    finally:
+        ctx["term"].close()
+        shutil.rmtree(home, ignore_errors=True)
+    return {
+        "meta": {"python": platform.python_version(), "qt": QT_VERSION_STR, "platform": platform.platform(),
+                 "machine": platform.machine(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "tree_files": ctx["tree_files"]},
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Return (report rows, regressed names) comparing medians to a saved run."""
+    rows, regressed = [], []
+    for name, result in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base or not base["median"]:
+            rows.append((name, result["median"], None, None, "new"))
+            continue
+        change = (result["median"] - base["median"]) / base["median"]
+        worse = -change if UNITS.get(result["unit"]) else change
+        verdict = "REGRESSION" if worse > threshold else "improved" if worse < -threshold else "ok"
+        if verdict == "REGRESSION":
+            regressed.append(name)
+        rows.append((name, result["median"], base["median"], change, verdict))
+    return rows, regressed
+
+
+def startup_probe(home):
+    """Child side of the time-to-first-prompt benchmark."""
+    isolate_home(home)
+    app = QApplication(sys.argv)
+    term = BenchTerminal(restore_session=False)
+    term.show()
+    app.processEvents()
+    print("ready", flush=True)
+    term.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless mops terminal benchmarks.")
+    parser.add_argument("--output", help="write the JSON results to this file (default: stdout)")
+    parser.add_argument("--baseline", help="compare against a previous --output file")
+    parser.add_argument("--threshold", type=float, default=0.15, help="relative slowdown counted as a regression")
+    parser.add_argument("--only", action="append", help="run benchmarks whose name contains this (repeatable)")
+    parser.add_argument("--quick", action="store_true", help="one run per benchmark")
+    parser.add_argument("--startup-probe", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.startup_probe:
+        startup_probe(args.startup_probe)
+        return 0
+
+    current = run_benchmarks(args.only, args.quick)
+    payload = json.dumps(current, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload + "\n")
+    elif not args.baseline:
+        print(payload)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows, regressed = compare(current, baseline, args.threshold)
+        print(f"\n{'benchmark':42} {'current':>12} {'baseline':>12} {'change':>8}")
+        for name, now, base, change, verdict in rows:
+            base_text = f"{base:12.6g}" if base is not None else f"{'-':>12}"
+            change_text = f"{change:+8.1%}" if change is not None else f"{'-':>8}"
+            print(f"{name:42} {now:12.6g} {base_text} {change_text}  {verdict}")
+        if regressed:
+            print(f"\n{len(regressed)} regression(s) beyond {args.threshold:.0%}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,9 +4,35 @@ import subprocess
 import os
 import json
 import time
-from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QTextEdit, QLineEdit, QCompleter, QSplitter, QPushButton, QLabel, QDialog, QMenu, QAction, QStyle, QSizePolicy, QFrame, QGraphicsDropShadowEffect, QScrollBar
-from PyQt5.QtGui import QFont, QColor, QTextCursor, QTextCharFormat, QPainter, QBrush, QPen, QPixmap
-from PyQt5.QtCore import Qt, QSize, QTimer, QStringListModel, QObject, QEvent, QPropertyAnimation, QRect, pyqtSignal, pyqtProperty, QEasingCurve
+import signal
+import socket
+import stat
+import errno
+import hmac
+import shutil
+import shlex
+import threading
+import collections
+import csv
+import re
+import mmap
+import array
+import itertools
+import operator
+import bisect
+import queue
+import struct
+import zlib
+import hashlib
+import ast
+import functools
+import math
+import multiprocessing
+import traceback
+import concurrent.futures
+from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QTextEdit, QLineEdit, QCompleter, QSplitter, QPushButton, QLabel, QDialog, QMenu, QAction, QStyle, QSizePolicy, QFrame, QGraphicsDropShadowEffect, QScrollBar, QTableView, QHeaderView, QAbstractItemView, QComboBox, QPlainTextEdit, QCheckBox, QShortcut
+from PyQt5.QtGui import QFont, QColor, QTextCursor, QTextCharFormat, QPainter, QBrush, QPen, QPixmap, QKeySequence
+from PyQt5.QtCore import Qt, QSize, QTimer, QStringListModel, QObject, QEvent, QPropertyAnimation, QRect, pyqtSignal, pyqtProperty, QEasingCurve, QAbstractTableModel, QModelIndex, QCoreApplication
 
 
 class InputKeyFilter(QObject):
@@ -114,12 +140,6202 @@ class LeverToggle(QWidget):
     offset = pyqtProperty(float, fget=getOffset, fset=setOffset)
 
 
+class ProcessJob:
+    """A shell command running in a child process, read on background threads.
+
+    Reader threads only queue output; the owner drains it on the GUI thread,
+    so no Qt object is ever touched from a worker thread.
+    """
+
+    def __init__(self, job_id, cmd, cwd, args=None, shell=True, buffer_lines=5000):
+        self.id = job_id
+        self.cmd = cmd
+        self.cwd = cwd
+        self.args = args if args is not None else cmd
+        self.shell = shell
+        self.status = "queued"
+        self.process = None
+        self.returncode = None
+        self.start_time = None
+        self.end_time = None
+        self.background = True
+        self.listed = True
+        self.sink = None
+        self.on_finished = None
+        # Output kept per job so 'fg' can replay what happened while detached
+        self.buffer = collections.deque(maxlen=buffer_lines)
+        self.total_chunks = 0
+        self.seen_chunks = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._exited = False
+        self._cpu = 0.0
+        # perf_counter stamps for 'perf' (set by the reader/waiter threads)
+        self.perf = None
+        self.first_output_at = None
+        self.last_output_at = None
+        self.exit_at = None
+
+    def start(self):
+        kwargs = {}
+        if os.name == "nt":
+            kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs["start_new_session"] = True
+        self.process = subprocess.Popen(self.args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                        text=True, errors="replace", shell=self.shell, cwd=self.cwd, **kwargs)
+        self.status = "running"
+        self.start_time = time.time()
+        readers = [threading.Thread(target=self._read, args=(self.process.stdout, "stdout"), daemon=True),
+                   threading.Thread(target=self._read, args=(self.process.stderr, "stderr"), daemon=True)]
+        for t in readers:
+            t.start()
+        threading.Thread(target=self._wait, args=(readers,), daemon=True).start()
+
+    def _read(self, stream, name):
+        try:
+            for line in iter(stream.readline, ""):
+                now = time.perf_counter()
+                if self.first_output_at is None:
+                    self.first_output_at = now
+                self.last_output_at = now
+                with self._lock:
+                    self._pending.append((name, line))
+        except (OSError, ValueError):
+            pass
+        finally:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    def _wait(self, readers):
+        for t in readers:
+            t.join()
+        self.returncode = self.process.wait()
+        self.exit_at = time.perf_counter()
+        self.end_time = time.time()
+        self._exited = True
+
+    def drain(self):
+        """Return and clear the (stream, text) chunks read since the last call."""
+        with self._lock:
+            chunks, self._pending = self._pending, []
+        return chunks
+
+    @property
+    def done(self):
+        """True once the process exited and all of its output was drained."""
+        if not self._exited:
+            return False
+        with self._lock:
+            return not self._pending
+
+    def runtime(self):
+        if self.start_time is None:
+            return 0.0
+        return (self.end_time or time.time()) - self.start_time
+
+    def cpu_seconds(self):
+        """CPU time used by the child (user + system), sampled while it is alive."""
+        if self.process is None or self._exited:
+            return self._cpu
+        try:
+            if sys.platform.startswith("linux"):
+                with open(f"/proc/{self.process.pid}/stat") as fh:
+                    fields = fh.read().rsplit(")", 1)[1].split()
+                # utime, stime, cutime, cstime (fields 14-17 of proc(5))
+                self._cpu = sum(int(x) for x in fields[11:15]) / os.sysconf("SC_CLK_TCK")
+            elif os.name == "nt":
+                import ctypes
+                times = [ctypes.c_ulonglong() for _ in range(4)]
+                if ctypes.windll.kernel32.GetProcessTimes(int(self.process._handle), *[ctypes.byref(t) for t in times]):
+                    self._cpu = (times[2].value + times[3].value) / 1e7
+        except Exception:
+            pass
+        return self._cpu
+
+    def kill(self):
+        """Terminate the whole process tree, escalating to a hard kill."""
+        if self.process is None or self.process.poll() is not None:
+            return False
+        self.cpu_seconds()
+        pid = self.process.pid
+        if os.name == "nt":
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            try:
+                os.killpg(pid, signal.SIGTERM)
+            except OSError:
+                self.process.terminate()
+
+            def escalate():
+                try:
+                    self.process.wait(timeout=3)
+                except subprocess.TimeoutExpired:
+                    try:
+                        os.killpg(pid, signal.SIGKILL)
+                    except OSError:
+                        self.process.kill()
+            threading.Thread(target=escalate, daemon=True).start()
+        self.status = "killed"
+        return True
+
+
+class FollowJob(ProcessJob):
+    """Streams lines appended to one or more files, like ``tail -f``.
+
+    Every file is multiplexed on one watcher thread that wakes on inotify
+    events for the files' directories on Linux and polls elsewhere. Only the
+    bytes past the last read offset are read; a shrinking file is re-read
+    from the top and a new inode at the same path (log rotation) is followed.
+    """
+
+    def __init__(self, job_id, cmd, cwd, paths, backlog=10, interval=0.5):
+        super().__init__(job_id, cmd, cwd, shell=False)
+        self.paths = list(paths)
+        self.backlog = backlog
+        self.interval = interval
+        self.notify = None
+        self._stop = threading.Event()
+        self._files = {}
+
+    def start(self):
+        self.status = "running"
+        self.start_time = time.time()
+        for path in self.paths:
+            self._files[path] = {"ino": None, "offset": 0, "partial": b""}
+            self._prime(path)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _emit(self, path, data):
+        prefix = f"[{os.path.basename(path)}] " if len(self.paths) > 1 else ""
+        state = self._files[path]
+        lines = (state["partial"] + data).split(b"\n")
+        state["partial"] = lines.pop()
+        if lines:
+            with self._lock:
+                self._pending.extend(("stdout", prefix + line.rstrip(b"\r").decode("utf-8", errors="replace") + "\n")
+                                     for line in lines)
+
+    def _prime(self, path):
+        """Show the last ``backlog`` lines and start following from the end."""
+        state = self._files[path]
+        try:
+            st = os.stat(path)
+            with open(path, "rb") as fh:
+                fh.seek(max(0, st.st_size - 64 * 1024))
+                tail = fh.read()
+        except OSError as e:
+            with self._lock:
+                self._pending.append(("stderr", f"follow: {e}\n"))
+            return
+        state["ino"], state["offset"] = st.st_ino, st.st_size
+        if self.backlog > 0:
+            lines = tail.split(b"\n")
+            keep = lines[-self.backlog - 1:] if tail.endswith(b"\n") else lines[-self.backlog:]
+            self._emit(path, b"\n".join(keep))
+
+    def _check(self, path):
+        state = self._files[path]
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        if st.st_ino != state["ino"] or st.st_size < state["offset"]:
+            # rotated or truncated: start over at the top of the (new) file
+            state["ino"], state["offset"], state["partial"] = st.st_ino, 0, b""
+        if st.st_size <= state["offset"]:
+            return
+        # Open per read so the writer can still rename or delete the file (Windows)
+        with open(path, "rb") as fh:
+            fh.seek(state["offset"])
+            while True:
+                data = fh.read(1024 * 1024)
+                if not data:
+                    break
+                state["offset"] += len(data)
+                self._emit(path, data)
+
+    def _inotify(self):
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            # IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+            mask = 0x002 | 0x008 | 0x040 | 0x080 | 0x100 | 0x200
+            for directory in {os.path.dirname(os.path.abspath(p)) for p in self.paths}:
+                libc.inotify_add_watch(fd, directory.encode(), mask)
+            return fd
+        except (OSError, AttributeError):
+            return None
+
+    def _run(self):
+        import select
+        fd = self._inotify()
+        self.notify = "inotify" if fd is not None else "polling"
+        try:
+            while not self._stop.is_set():
+                for path in self.paths:
+                    try:
+                        self._check(path)
+                    except OSError:
+                        continue
+                if fd is None:
+                    self._stop.wait(self.interval)
+                elif select.select([fd], [], [], self.interval)[0]:
+                    try:
+                        while os.read(fd, 65536):
+                            pass
+                    except BlockingIOError:
+                        pass
+        finally:
+            if fd is not None:
+                os.close(fd)
+            self.returncode = 0
+            self.end_time = time.time()
+            self._exited = True
+
+    def cpu_seconds(self):
+        return 0.0
+
+    def kill(self):
+        if self._exited or self._stop.is_set():
+            return False
+        self._stop.set()
+        self.status = "killed"
+        return True
+
+
+def _human_size(n):
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if abs(n) < 1024 or unit == "TB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+class ThreadJob(ProcessJob):
+    """A built-in job whose work runs on a Python thread instead of a child process.
+
+    Subclasses implement ``_work`` (returning the exit code) and poll
+    ``_stop`` so ``kill`` can cancel them; text passed to ``_say`` is pumped to
+    the job's sink like process output.
+    """
+
+    def __init__(self, job_id, cmd, cwd):
+        super().__init__(job_id, cmd, cwd, shell=False)
+        self._stop = threading.Event()
+
+    def start(self):
+        self.status = "running"
+        self.start_time = time.time()
+        threading.Thread(target=self._main, daemon=True).start()
+
+    def _main(self):
+        code = 1
+        try:
+            code = self._work()
+        except Exception as e:
+            self._say(f"{self.cmd.split()[0]}: {e}\n", "stderr")
+        finally:
+            self.returncode = 1 if self._stop.is_set() else code
+            self.end_time = time.time()
+            self._exited = True
+
+    def _work(self):
+        raise NotImplementedError
+
+    def _say(self, text, stream="stdout"):
+        with self._lock:
+            self._pending.append((stream, text))
+
+    def cpu_seconds(self):
+        return 0.0
+
+    def kill(self):
+        if self._exited or self._stop.is_set():
+            return False
+        self._stop.set()
+        self.status = "killed"
+        return True
+
+
+class CopyJob(ThreadJob):
+    """Built-in recursive copy/move that runs as a job on worker threads.
+
+    The source is walked with scandir, then files are copied on a thread
+    pool, using ``copy_file_range``/``sendfile`` where the OS has them. A
+    destination file whose size and mtime already match is skipped, so
+    rerunning an interrupted copy resumes it. Progress lines are emitted at
+    most once per ``report_interval``; ``kill`` cancels between chunks.
+
+    Targets follow ``cp -r``: a source goes inside an existing destination
+    directory, otherwise it becomes the destination. A directory source
+    written with a trailing separator (``src/``) copies its contents into
+    the destination instead, as rsync does. Targets are fixed when the job
+    is created, before anything exists at the destination.
+    """
+
+    CHUNK = 8 * 1024 * 1024
+
+    def __init__(self, job_id, cmd, cwd, sources, dest, move=False, workers=8, report_interval=1.0):
+        super().__init__(job_id, cmd, cwd)
+        self.sources = sources
+        self.dest = dest
+        self.move = move
+        self.workers = workers
+        self.report_interval = report_interval
+        self.total_bytes = self.done_bytes = 0
+        self.files_total = self.files_done = self.files_skipped = 0
+        self.errors = 0
+        self.skipped = []
+        self._progress_lock = threading.Lock()
+        self.targets = {src: self._target(src) for src in sources}
+
+    def _target(self, src):
+        if src.endswith(("/", os.sep)) and os.path.isdir(src):
+            return self.dest
+        if os.path.isdir(self.dest) or len(self.sources) > 1:
+            return os.path.join(self.dest, os.path.basename(os.path.normpath(src)))
+        return self.dest
+
+    def target_for(self, src):
+        return self.targets[src]
+
+    def resume_command(self):
+        """The command that continues this job onto the same target files."""
+        name = "move" if self.move else "copy"
+        sources = []
+        for src in self.sources:
+            if os.path.isdir(src) and self.targets[src] == self.dest and not src.endswith(("/", os.sep)):
+                # dest exists now, so a plain rerun would nest src inside it
+                src = os.path.join(src, "")
+            sources.append(src)
+        quote = shlex.quote if os.name != "nt" else (lambda s: f'"{s}"' if " " in s else s)
+        return " ".join([name, f"-j {self.workers}", *map(quote, sources), quote(self.dest)])
+
+    def _skip(self, path, why):
+        self.skipped.append(path)
+        self._say(f"{'move' if self.move else 'copy'}: skipped {path} ({why})\n", "stderr")
+
+    def _plan(self):
+        """Return (directories to create, [(src, dst, size, mtime_ns)]) for every file to copy."""
+        dirs, files = [], []
+        for src in self.sources:
+            root = self.target_for(src)
+            if not os.path.isdir(src):
+                st = os.stat(src)
+                if stat.S_ISREG(st.st_mode):
+                    files.append((src, root, st.st_size, st.st_mtime_ns))
+                else:
+                    self._skip(src, "not a regular file")
+                continue
+            stack = [(src, root)]
+            while stack and not self._stop.is_set():
+                src_dir, dst_dir = stack.pop()
+                dirs.append((src_dir, dst_dir))
+                try:
+                    with os.scandir(src_dir) as it:
+                        for entry in it:
+                            dst = os.path.join(dst_dir, entry.name)
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append((entry.path, dst))
+                            elif entry.is_file():
+                                st = entry.stat()
+                                files.append((entry.path, dst, st.st_size, st.st_mtime_ns))
+                            elif entry.is_symlink():
+                                self._skip(entry.path, "symbolic link to a directory or missing target, not followed")
+                            else:
+                                self._skip(entry.path, "not a regular file")
+                except OSError as e:
+                    self.errors += 1
+                    self._say(f"copy: {e}\n", "stderr")
+        return dirs, files
+
+    @staticmethod
+    def _up_to_date(dst, size, mtime_ns):
+        try:
+            st = os.stat(dst)
+        except OSError:
+            return False
+        # Whole seconds: FAT and some network shares round mtimes
+        return st.st_size == size and st.st_mtime_ns // 1000000000 == mtime_ns // 1000000000
+
+    def _advance(self, n):
+        with self._progress_lock:
+            self.done_bytes += n
+
+    def _copy_file(self, src, dst, size):
+        if self._stop.is_set():
+            return
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            copied = self._copy_zero(fsrc.fileno(), fdst.fileno(), size)
+            if copied < size:
+                fsrc.seek(copied)
+                fdst.seek(copied)
+                buf = bytearray(1024 * 1024)
+                view = memoryview(buf)
+                while not self._stop.is_set():
+                    n = fsrc.readinto(buf)
+                    if not n:
+                        break
+                    fdst.write(view[:n])
+                    self._advance(n)
+        if self._stop.is_set():
+            # Leave no half-written file that could look complete
+            os.remove(dst)
+            return
+        shutil.copystat(src, dst)
+        with self._progress_lock:
+            self.files_done += 1
+
+    def _copy_zero(self, fd_in, fd_out, size):
+        """Kernel-side copy; returns how many bytes it managed (0 if unsupported)."""
+        copied = 0
+        copy_range = getattr(os, "copy_file_range", None)
+        sendfile = getattr(os, "sendfile", None) if sys.platform.startswith("linux") else None
+        while copied < size and not self._stop.is_set() and (copy_range or sendfile):
+            try:
+                if copy_range:
+                    n = copy_range(fd_in, fd_out, min(self.CHUNK, size - copied), copied, copied)
+                else:
+                    n = sendfile(fd_out, fd_in, copied, min(self.CHUNK, size - copied))
+            except OSError:
+                # e.g. EXDEV/ENOSYS/EINVAL: try the next method from the current offset.
+                # copy_file_range leaves fd_out's position alone; sendfile writes there.
+                if copy_range:
+                    copy_range = None
+                    os.lseek(fd_out, copied, os.SEEK_SET)
+                    continue
+                break
+            if n == 0:
+                break
+            copied += n
+            self._advance(n)
+        return copied
+
+    def _report(self, final=False):
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        rate = self.done_bytes / elapsed
+        left = self.total_bytes - self.done_bytes
+        eta = f"  ETA {int(left / rate) // 60}:{int(left / rate) % 60:02d}" if rate > 0 and left > 0 and not final else ""
+        pct = 100.0 * self.done_bytes / self.total_bytes if self.total_bytes else 100.0
+        skipped = f", {self.files_skipped} up to date" if self.files_skipped else ""
+        self._say(f"{'move' if self.move else 'copy'}: {_human_size(self.done_bytes)} / {_human_size(self.total_bytes)} "
+                  f"({pct:.0f}%)  {self.files_done}/{self.files_total - self.files_skipped} files{skipped}  "
+                  f"{_human_size(rate)}/s{eta}\n")
+
+    def _work(self):
+        import concurrent.futures
+        if self.move and self._try_rename():
+            return 0
+        dirs, files = self._plan()
+        for _, dst_dir in dirs:
+            os.makedirs(dst_dir, exist_ok=True)
+        todo = []
+        for src, dst, size, mtime_ns in files:
+            if self._up_to_date(dst, size, mtime_ns):
+                self.files_skipped += 1
+            else:
+                todo.append((src, dst, size))
+        self.files_total = len(files)
+        self.total_bytes = sum(size for _, _, size in todo)
+        # Big files first so they are not the long tail at the end
+        todo.sort(key=lambda item: item[2], reverse=True)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self._copy_file, *item): item for item in todo}
+            last = time.time()
+            pending = set(futures)
+            while pending:
+                finished, pending = concurrent.futures.wait(pending, timeout=0.2)
+                for future in finished:
+                    if future.exception() is not None:
+                        self.errors += 1
+                        self._say(f"copy: {futures[future][0]}: {future.exception()}\n", "stderr")
+                if self._stop.is_set():
+                    for future in pending:
+                        future.cancel()
+                if time.time() - last >= self.report_interval:
+                    last = time.time()
+                    self._report()
+        if self._stop.is_set():
+            self._say(f"Cancelled after {_human_size(self.done_bytes)}; resume with: {self.resume_command()}\n", "stderr")
+            return 1
+        self._report(final=True)
+        if self.move and not self.errors:
+            # Skipped entries stay behind, and so do the directories holding them
+            self._remove_sources(files, dirs)
+            if self.skipped:
+                self._say(f"move: {len(self.skipped)} skipped item(s) left in place\n", "stderr")
+        return 1 if self.errors or (self.move and self.skipped) else 0
+
+    def _try_rename(self):
+        """Same-filesystem move: a rename per source, no data copied."""
+        targets = [(src, self.target_for(src)) for src in self.sources]
+        if any(os.path.exists(dst) for _, dst in targets):
+            return False
+        try:
+            for src, dst in targets:
+                os.rename(src, dst)
+        except OSError:
+            return False
+        self._say(f"move: renamed {len(targets)} item(s)\n")
+        return True
+
+    def _remove_sources(self, files, dirs):
+        for src, _, _, _ in files:
+            os.remove(src)
+        # Deepest directories first
+        for src_dir, _ in sorted(dirs, key=lambda d: d[0].count(os.sep), reverse=True):
+            try:
+                os.rmdir(src_dir)
+            except OSError:
+                pass
+
+
+class DuJob(ThreadJob):
+    """Directory sizes from a parallel scandir walk, run as a job.
+
+    Each directory is scanned on a worker thread and its subdirectories are
+    queued as they are found; a progress line with the running total is
+    emitted every ``report_interval``. ``cache`` maps a directory to
+    ``(mtime_ns, file bytes, file count, subdirectory names)``, so a directory
+    whose listing has not changed since the last run is not scanned again.
+    A file that grows in place leaves its directory's mtime alone, which is
+    what ``du --fresh`` (an empty cache) is for.
+    """
+
+    CACHE_LIMIT = 500000
+
+    def __init__(self, job_id, cmd, cwd, root, depth=1, top=20, cache=None, workers=16, report_interval=1.0):
+        super().__init__(job_id, cmd, cwd)
+        self.root = root
+        self.depth = depth
+        self.top = top
+        self.cache = cache if cache is not None else {}
+        self.workers = workers
+        self.report_interval = report_interval
+        self.sizes = collections.Counter()
+        self.files = self.dirs = self.cached = self.unreadable = 0
+
+    def _scan(self, path):
+        """Return (file bytes, file count, subdirectory names, from cache) for one directory."""
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1], cached[2], cached[3], True
+        size = count = 0
+        subdirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    else:
+                        size += entry.stat(follow_symlinks=False).st_size
+                        count += 1
+                except OSError:
+                    pass
+        if len(self.cache) >= self.CACHE_LIMIT:
+            self.cache.clear()
+        self.cache[path] = (mtime, size, count, subdirs)
+        return size, count, subdirs, False
+
+    def _add(self, rel, size, count, cached):
+        # Charge the bytes to the directory and every ancestor down to --depth
+        for k in range(min(len(rel), self.depth) + 1):
+            self.sizes[rel[:k]] += size
+        self.files += count
+        self.dirs += 1
+        self.cached += cached
+
+    def _work(self):
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = {pool.submit(self._scan, self.root): ()}
+            last = time.time()
+            while pending and not self._stop.is_set():
+                finished, _ = concurrent.futures.wait(pending, timeout=0.2, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    rel = pending.pop(future)
+                    try:
+                        size, count, subdirs, cached = future.result()
+                    except OSError:
+                        self.unreadable += 1
+                        continue
+                    self._add(rel, size, count, cached)
+                    for name in subdirs:
+                        pending[pool.submit(self._scan, os.path.join(self.root, *rel, name))] = rel + (name,)
+                if time.time() - last >= self.report_interval:
+                    last = time.time()
+                    self._say(f"du: {_human_size(self.sizes[()])} so far, {self.files:,} files in {self.dirs:,} directories\n")
+            for future in pending:
+                future.cancel()
+        if self._stop.is_set():
+            self._say(f"du: cancelled at {_human_size(self.sizes[()])}\n", "stderr")
+            return 1
+        self._say(self._summary())
+        return 0
+
+    def _summary(self):
+        total = self.sizes[()]
+        entries = sorted(((size, rel) for rel, size in self.sizes.items() if rel), reverse=True)[:self.top]
+        lines = [f"{_human_size(size):>10}  {100.0 * size / total if total else 0:5.1f}%  {os.path.join(*rel)}"
+                 for size, rel in entries]
+        lines.append(f"{_human_size(total):>10}  100.0%  {self.root}")
+        notes = [f"{self.files:,} files, {self.dirs:,} directories in {time.time() - self.start_time:.2f}s"]
+        if self.cached:
+            notes.append(f"{self.cached:,} directories unchanged since the last run")
+        if self.unreadable:
+            notes.append(f"{self.unreadable:,} could not be read")
+        lines.append(f"({'; '.join(notes)})")
+        return "\n".join(lines) + "\n"
+
+
+class HashJob(ThreadJob):
+    """Checksums files on a thread pool, or verifies them against a checksum file.
+
+    Files are read in 1 MB chunks into a reused buffer; both the reads and
+    ``hashlib`` updates release the GIL, so workers hash in parallel. Lines
+    use the ``sha256sum`` format (``<hex>  <path>``) and are streamed as
+    files finish. With ``manifest`` set, the sorted results are also written
+    to that file with paths relative to it, ready for ``--check``.
+    """
+
+    ALGOS = ("sha256", "sha1", "md5", "blake2b")
+    BY_LENGTH = {32: "md5", 40: "sha1", 64: "sha256", 128: "blake2b"}
+    BUFFER = 1024 * 1024
+
+    def __init__(self, job_id, cmd, cwd, paths=(), algo="sha256", check=None, manifest=None, workers=8, report_interval=1.0):
+        super().__init__(job_id, cmd, cwd)
+        self.paths = paths
+        self.algo = algo
+        self.check = check
+        self.manifest = manifest
+        self.workers = workers
+        self.report_interval = report_interval
+        self.total_bytes = self.done_bytes = 0
+        self.failed = self.missing = self.ok = 0
+        self._progress_lock = threading.Lock()
+
+    def _inputs(self):
+        """Return [(full path, display path, size)] for every file under ``paths``.
+
+        A directory or file that cannot be read is reported and counted as missing.
+        """
+        base = os.path.dirname(self.manifest) if self.manifest else self.cwd
+        files = []
+        for path in self.paths:
+            if not os.path.isdir(path):
+                try:
+                    files.append((path, self._display(path, base), os.path.getsize(path)))
+                except OSError as e:
+                    self._unreadable(path, base, e)
+                continue
+            stack = [path]
+            while stack and not self._stop.is_set():
+                current = stack.pop()
+                try:
+                    with os.scandir(current) as it:
+                        for entry in it:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.is_file() and entry.path != self.manifest:
+                                files.append((entry.path, self._display(entry.path, base), entry.stat().st_size))
+                except OSError as e:
+                    self._unreadable(current, base, e)
+        return files
+
+    @staticmethod
+    def _display(path, base):
+        try:
+            return os.path.relpath(path, base)
+        except ValueError:
+            # Another drive on Windows has no relative path
+            return path
+
+    def _unreadable(self, path, base, error):
+        self.missing += 1
+        self._say(f"{self._display(path, base)}: FAILED open or read ({error.strerror})\n", "stderr")
+
+    def _read_checksums(self):
+        """Parse ``<hex>  path``/``<hex> *path`` or BSD ``ALGO (path) = <hex>`` lines."""
+        base = os.path.dirname(os.path.abspath(self.check))
+        entries = []
+        with open(self.check, "r", encoding="utf-8", errors="surrogateescape") as f:
+            for line in f:
+                line = line.rstrip("\r\n")
+                bsd = re.match(r"^(\w+) \((.*)\) = ([0-9a-fA-F]+)$", line)
+                if bsd:
+                    algo, name, digest = bsd.group(1).lower().replace("-", ""), bsd.group(2), bsd.group(3)
+                else:
+                    gnu = re.match(r"^([0-9a-fA-F]+) [ *](.*)$", line)
+                    if not gnu:
+                        continue
+                    digest, name = gnu.groups()
+                    algo = self.algo or self.BY_LENGTH.get(len(digest))
+                if algo not in self.ALGOS:
+                    continue
+                full = os.path.join(base, *name.split("/"))
+                try:
+                    size = os.path.getsize(full)
+                except OSError:
+                    size = -1
+                entries.append((full, name, size, algo, digest.lower()))
+        return entries
+
+    def _digest(self, path, algo):
+        h = hashlib.new(algo)
+        buf = bytearray(self.BUFFER)
+        view = memoryview(buf)
+        with open(path, "rb", buffering=0) as f:
+            while not self._stop.is_set():
+                n = f.readinto(buf)
+                if not n:
+                    break
+                h.update(view[:n])
+                with self._progress_lock:
+                    self.done_bytes += n
+        return h.hexdigest()
+
+    def _work(self):
+        import concurrent.futures
+        if self.check:
+            work = self._read_checksums()
+            if not work:
+                self._say(f"hash: no checksum lines found in {self.check}\n", "stderr")
+                return 1
+        else:
+            work = [(full, name, size, self.algo, None) for full, name, size in self._inputs()]
+        self.total_bytes = sum(item[2] for item in work if item[2] > 0)
+        # Largest first so one big file does not finish alone at the end
+        work.sort(key=lambda item: item[2], reverse=True)
+        results = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self._digest, item[0], item[3]): item for item in work if item[2] >= 0}
+            for item in work:
+                if item[2] < 0:
+                    self.missing += 1
+                    self._say(f"{item[1]}: FAILED open or read\n", "stderr")
+            pending = set(futures)
+            last = time.time()
+            while pending:
+                finished, pending = concurrent.futures.wait(pending, timeout=0.2)
+                if finished:
+                    last = time.time()
+                for future in finished:
+                    full, name, _, algo, expected = futures[future]
+                    try:
+                        digest = future.result()
+                    except OSError as e:
+                        self.missing += 1
+                        self._say(f"{name}: FAILED open or read ({e.strerror})\n", "stderr")
+                        continue
+                    if self._stop.is_set():
+                        continue
+                    if expected is None:
+                        results.append((name, digest))
+                        self._say(f"{digest}  {name}\n")
+                    elif digest == expected:
+                        self.ok += 1
+                        self._say(f"{name}: OK\n")
+                    else:
+                        self.failed += 1
+                        self._say(f"{name}: FAILED\n", "stderr")
+                if self._stop.is_set():
+                    for future in pending:
+                        future.cancel()
+                elif time.time() - last >= self.report_interval:
+                    last = time.time()
+                    self._say(f"hash: {_human_size(self.done_bytes)} / {_human_size(self.total_bytes)} read\n")
+        if self._stop.is_set():
+            self._say("hash: cancelled\n", "stderr")
+            return 1
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        rate = f"{_human_size(self.done_bytes)} in {elapsed:.2f}s ({self.done_bytes / elapsed / 1e6:.0f} MB/s)"
+        if self.check:
+            self._say(f"{self.ok} OK, {self.failed} FAILED, {self.missing} missing; {rate}\n",
+                      "stderr" if self.failed or self.missing else "stdout")
+            return 1 if self.failed or self.missing else 0
+        if self.manifest:
+            with open(self.manifest, "w", encoding="utf-8", errors="surrogateescape", newline="\n") as f:
+                f.writelines(f"{digest}  {name.replace(os.sep, '/')}\n" for name, digest in sorted(results))
+            self._say(f"Wrote {len(results)} checksums to {self.manifest}\n")
+        unreadable = f", {self.missing} unreadable" if self.missing else ""
+        self._say(f"{self.algo}: {len(results)} files{unreadable}, {rate}\n", "stderr" if self.missing else "stdout")
+        return 1 if self.missing else 0
+
+
+class ZipWriter:
+    """Minimal streaming ZIP writer for members compressed elsewhere.
+
+    ``zipfile`` insists on compressing data itself, one member at a time;
+    this writer takes raw deflate data (or stored bytes) with its CRC and
+    sizes already known, so members can be compressed in parallel and
+    appended in any order. ZIP64 records are used only when a size, offset
+    or the entry count needs them.
+    """
+
+    LIMIT = 0xFFFFFFFF
+
+    def __init__(self, fileobj):
+        self.fp = fileobj
+        self.entries = []
+
+    @staticmethod
+    def _dos_time(mtime):
+        t = time.localtime(mtime)
+        year = min(max(t.tm_year, 1980), 2107)
+        return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+    def add(self, name, data, crc, size, method, mtime, mode, is_dir=False):
+        """Append one member; ``data`` is a file object positioned at its (compressed) bytes."""
+        encoded = name.encode("utf-8")
+        offset = self.fp.tell()
+        csize = 0 if data is None else data.seek(0, os.SEEK_END)
+        zip64 = size >= self.LIMIT or csize >= self.LIMIT
+        extra = struct.pack("<HHQQ", 1, 16, size, csize) if zip64 else b""
+        dos_time, dos_date = self._dos_time(mtime)
+        self.fp.write(struct.pack("<IHHHHHIIIHH", 0x04034B50, 45 if zip64 else 20, 0x800, method, dos_time, dos_date,
+                                  crc, self.LIMIT if zip64 else csize, self.LIMIT if zip64 else size,
+                                  len(encoded), len(extra)) + encoded + extra)
+        if data is not None:
+            data.seek(0)
+            shutil.copyfileobj(data, self.fp, 1024 * 1024)
+        attr = ((mode & 0xFFFF) << 16) | (0x10 if is_dir else 0)
+        self.entries.append((encoded, crc, size, csize, method, dos_time, dos_date, offset, attr))
+
+    def close(self):
+        start = self.fp.tell()
+        for encoded, crc, size, csize, method, dos_time, dos_date, offset, attr in self.entries:
+            big = [v for v in (size, csize, offset) if v >= self.LIMIT]
+            # ZIP64 extra holds, in order, whichever of the three overflowed
+            extra = struct.pack(f"<HH{len(big)}Q", 1, 8 * len(big), *big) if big else b""
+            self.fp.write(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014B50, (3 << 8) | 45, 45 if big else 20, 0x800, method,
+                                      dos_time, dos_date, crc, min(csize, self.LIMIT), min(size, self.LIMIT),
+                                      len(encoded), len(extra), 0, 0, 0, attr, min(offset, self.LIMIT)) + encoded + extra)
+        end = self.fp.tell()
+        count, cd_size = len(self.entries), end - start
+        if count >= 0xFFFF or start >= self.LIMIT or cd_size >= self.LIMIT:
+            self.fp.write(struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, count, count, cd_size, start))
+            self.fp.write(struct.pack("<IIQI", 0x07064B50, 0, end, 1))
+        self.fp.write(struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                                  min(cd_size, self.LIMIT), min(start, self.LIMIT), 0))
+
+
+class CompressJob(ThreadJob):
+    """Creates a .zip, .tar.gz or .tar archive using every core.
+
+    For zip, each member is deflated on a worker thread into a spooled
+    temporary file and appended by ``ZipWriter`` as soon as it is ready. For
+    tar.gz, the tar stream is cut into ``BLOCK``-sized pieces that are
+    gzip-compressed independently and written in order; the concatenated
+    gzip members are a valid .tar.gz for any gzip reader. zlib releases the
+    GIL, so throughput scales with the number of workers. Files are always
+    read in chunks, never whole.
+    """
+
+    BLOCK = 4 * 1024 * 1024
+    CHUNK = 1024 * 1024
+    SPOOL = 4 * 1024 * 1024
+
+    class Cancelled(Exception):
+        pass
+
+    def __init__(self, job_id, cmd, cwd, output, inputs, level=6, workers=4, report_interval=1.0):
+        super().__init__(job_id, cmd, cwd)
+        self.output = output
+        self.inputs = inputs
+        self.level = level
+        self.workers = workers
+        self.report_interval = report_interval
+        self.kind = "zip" if output.lower().endswith(".zip") else "tar" if output.lower().endswith(".tar") else "tar.gz"
+        self.total_bytes = self.done_bytes = self.written = 0
+        self.members = 0
+        self._progress_lock = threading.Lock()
+        self._last_report = 0.0
+
+    def _members(self):
+        """Return [(path, archive name, is_dir, stat)] for the inputs, parents before children."""
+        members = []
+        for path in self.inputs:
+            base = os.path.dirname(os.path.normpath(path))
+            stack = [path]
+            while stack:
+                current = stack.pop()
+                st = os.stat(current, follow_symlinks=False)
+                name = os.path.relpath(current, base).replace(os.sep, "/")
+                if os.path.isdir(current) and not os.path.islink(current):
+                    members.append((current, name + "/", True, st))
+                    with os.scandir(current) as it:
+                        stack.extend(sorted((e.path for e in it), reverse=True))
+                elif os.path.isfile(current) and os.path.abspath(current) != os.path.abspath(self.output):
+                    members.append((current, name, False, st))
+        return members
+
+    def _advance(self, n):
+        with self._progress_lock:
+            self.done_bytes += n
+        now = time.time()
+        if now - self._last_report >= self.report_interval:
+            self._last_report = now
+            elapsed = max(now - self.start_time, 1e-6)
+            rate = self.done_bytes / elapsed
+            left = (self.total_bytes - self.done_bytes) / rate if rate else 0
+            pct = 100.0 * self.done_bytes / self.total_bytes if self.total_bytes else 100.0
+            self._say(f"compress: {_human_size(self.done_bytes)} / {_human_size(self.total_bytes)} ({pct:.0f}%)  "
+                      f"{_human_size(rate)}/s  ETA {int(left) // 60}:{int(left) % 60:02d}\n")
+
+    def _work(self):
+        members = self._members()
+        # Links are stored, not followed, so only regular files are read
+        self.total_bytes = sum(st.st_size for _, _, is_dir, st in members if not is_dir and stat.S_ISREG(st.st_mode))
+        self._last_report = time.time()
+        part = self.output + ".part"
+        try:
+            with open(part, "wb") as out:
+                if self.kind == "zip":
+                    self._write_zip(out, members)
+                else:
+                    self._write_tar(out, members)
+                self.written = out.tell()
+            if self._stop.is_set():
+                raise self.Cancelled()
+            os.replace(part, self.output)
+        except self.Cancelled:
+            self._say(f"compress: cancelled; removed the partial {os.path.basename(self.output)}\n", "stderr")
+            return 1
+        finally:
+            if os.path.exists(part):
+                os.remove(part)
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        ratio = 100.0 * self.written / self.total_bytes if self.total_bytes else 100.0
+        self._say(f"Wrote {self.output}: {self.members} entries, {_human_size(self.total_bytes)} -> "
+                  f"{_human_size(self.written)} ({ratio:.0f}%) in {elapsed:.2f}s "
+                  f"({self.total_bytes / elapsed / 1e6:.0f} MB/s, {self.workers} threads)\n")
+        return 0
+
+    # ---- zip ----
+    @staticmethod
+    def _link(path):
+        """Store a symlink the Info-ZIP way: its target as the member's data."""
+        import tempfile
+        import zipfile
+        target = os.fsencode(os.readlink(path))
+        spool = tempfile.SpooledTemporaryFile()
+        spool.write(target)
+        return spool, zlib.crc32(target), len(target), zipfile.ZIP_STORED
+
+    def _deflate(self, path):
+        """Compress one file into a spool; falls back to storing if deflate does not help."""
+        import tempfile
+        import zipfile
+        for method in (zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED):
+            spool = tempfile.SpooledTemporaryFile(max_size=self.SPOOL)
+            comp = zlib.compressobj(self.level, zlib.DEFLATED, -15) if method == zipfile.ZIP_DEFLATED else None
+            crc = size = 0
+            with open(path, "rb") as f:
+                while True:
+                    if self._stop.is_set():
+                        spool.close()
+                        raise self.Cancelled()
+                    chunk = f.read(self.CHUNK)
+                    if not chunk:
+                        break
+                    crc = zlib.crc32(chunk, crc)
+                    size += len(chunk)
+                    spool.write(comp.compress(chunk) if comp else chunk)
+                    if comp:
+                        self._advance(len(chunk))
+            if comp:
+                spool.write(comp.flush())
+                if spool.tell() < size or size == 0:
+                    return spool, crc, size, method
+                spool.close()
+        return spool, crc, size, method
+
+    def _write_zip(self, out, members):
+        import concurrent.futures
+        import zipfile
+        writer = ZipWriter(out)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {}
+            for path, name, is_dir, st in members:
+                if is_dir:
+                    writer.add(name, None, 0, 0, zipfile.ZIP_STORED, st.st_mtime, st.st_mode, is_dir=True)
+                    self.members += 1
+                elif stat.S_ISLNK(st.st_mode):
+                    futures[pool.submit(self._link, path)] = (name, st)
+                else:
+                    futures[pool.submit(self._deflate, path)] = (name, st)
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    name, st = futures[future]
+                    spool, crc, size, method = future.result()
+                    with spool:
+                        writer.add(name, spool, crc, size, method, st.st_mtime, st.st_mode)
+                    self.members += 1
+            except self.Cancelled:
+                for future in futures:
+                    future.cancel()
+                raise
+        writer.close()
+
+    # ---- tar / tar.gz ----
+    def _write_tar(self, out, members):
+        import concurrent.futures
+        import gzip
+        import tarfile
+        job = self
+        blocks = collections.deque()
+
+        class BlockSink:
+            """File object handed to tarfile: cuts the stream into blocks for the pool."""
+            def __init__(self):
+                self.buffer = bytearray()
+
+            def write(self, data):
+                if job._stop.is_set():
+                    raise job.Cancelled()
+                if job.kind == "tar":
+                    out.write(data)
+                    return len(data)
+                self.buffer += data
+                if len(self.buffer) >= job.BLOCK:
+                    self.flush_block()
+                return len(data)
+
+            def flush_block(self):
+                if self.buffer:
+                    blocks.append(pool.submit(gzip.compress, bytes(self.buffer), job.level, mtime=0))
+                    self.buffer = bytearray()
+                # Keep a bounded number of blocks in flight, written in stream order
+                while blocks and (len(blocks) > 2 * job.workers or blocks[0].done()):
+                    out.write(blocks.popleft().result())
+
+        class Reader:
+            """Wraps a member's file so tarfile's reads count towards progress."""
+            def __init__(self, f):
+                self.f = f
+
+            def read(self, n=-1):
+                data = self.f.read(n)
+                job._advance(len(data))
+                return data
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            sink = BlockSink()
+            try:
+                with tarfile.open(fileobj=sink, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+                    for path, name, is_dir, st in members:
+                        info = tar.gettarinfo(path, arcname=name.rstrip("/"))
+                        if is_dir:
+                            tar.addfile(info)
+                        else:
+                            with open(path, "rb") as f:
+                                tar.addfile(info, Reader(f))
+                        self.members += 1
+                sink.flush_block()
+                while blocks:
+                    out.write(blocks.popleft().result())
+            except self.Cancelled:
+                for future in blocks:
+                    future.cancel()
+                raise
+
+
+class JobManager(QObject):
+    """Schedules ProcessJobs and pumps their output back on the GUI thread.
+
+    Background jobs beyond ``max_running`` wait in a FIFO queue; foreground
+    jobs always start immediately.
+    """
+
+    def __init__(self, parent=None, max_running=4, interval=25, keep_finished=100):
+        super().__init__(parent)
+        self.jobs = collections.OrderedDict()
+        self.max_running = max_running
+        self.keep_finished = keep_finished
+        self._next_id = 1
+        self._queue = collections.deque()
+        self._active = []
+        self._timer = QTimer(self)
+        self._timer.setInterval(interval)
+        self._timer.timeout.connect(self._pump)
+
+    def submit(self, cmd, cwd, args=None, shell=True, sink=None, on_finished=None, background=True, listed=True):
+        job = ProcessJob(self.next_id(), cmd, cwd, args=args, shell=shell)
+        return self.add(job, sink=sink, on_finished=on_finished, background=background, listed=listed)
+
+    def next_id(self):
+        job_id = self._next_id
+        self._next_id += 1
+        return job_id
+
+    def add(self, job, sink=None, on_finished=None, background=True, listed=True):
+        """Schedule an already constructed job (a ProcessJob or subclass)."""
+        job.sink = sink
+        job.on_finished = on_finished
+        job.background = background
+        job.listed = listed
+        self.jobs[job.id] = job
+        if background and self.running_background() >= self.max_running:
+            self._queue.append(job)
+        else:
+            self._start(job)
+        self._prune()
+        return job
+
+    def running_background(self):
+        return sum(1 for j in self._active if j.background)
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def attach(self, job_id, sink):
+        """Route a job's output to ``sink``, replaying what it missed while detached."""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        missed = min(job.total_chunks - job.seen_chunks, len(job.buffer))
+        if missed and sink:
+            sink(job, list(job.buffer)[-missed:])
+        job.seen_chunks = job.total_chunks
+        job.sink = sink
+        job.background = False
+        if job in self._queue:
+            self._queue.remove(job)
+            self._start(job)
+        return job
+
+    def detach(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job.sink = None
+            job.background = True
+        return job
+
+    def kill(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if job.status == "queued":
+            try:
+                self._queue.remove(job)
+            except ValueError:
+                pass
+            job.status = "killed"
+            self._finish(job)
+            return job
+        job.kill()
+        return job
+
+    def kill_all(self):
+        for job in list(self._queue):
+            job.status = "killed"
+        self._queue.clear()
+        for job in list(self._active):
+            job.kill()
+
+    def _start(self, job):
+        try:
+            job.start()
+        except Exception as e:
+            job.status = "failed"
+            job.returncode = -1
+            job.buffer.append(("stderr", f"{e}\n"))
+            job.total_chunks += 1
+            if job.sink:
+                job.sink(job, [("stderr", f"{e}\n")])
+                job.seen_chunks = job.total_chunks
+            self._finish(job)
+            return
+        self._active.append(job)
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def _pump(self):
+        for job in list(self._active):
+            chunks = job.drain()
+            if chunks:
+                job.buffer.extend(chunks)
+                job.total_chunks += len(chunks)
+                if job.sink:
+                    job.sink(job, chunks)
+                    job.seen_chunks = job.total_chunks
+            if job.done:
+                self._active.remove(job)
+                if job.status == "running":
+                    job.status = "done"
+                if not job.listed:
+                    self.jobs.pop(job.id, None)
+                self._finish(job)
+        while self._queue and self.running_background() < self.max_running:
+            self._start(self._queue.popleft())
+        if not self._active:
+            self._timer.stop()
+
+    def _finish(self, job):
+        if job.on_finished:
+            try:
+                job.on_finished(job)
+            except Exception:
+                pass
+
+    def _prune(self):
+        finished = [j for j in self.jobs.values() if j.status in ("done", "killed", "failed")]
+        for job in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self.jobs[job.id]
+
+
+class ParallelRun:
+    """Fans a command template out over many arguments on a bounded worker pool.
+
+    Each argument, quoted for the shell, replaces ``{}`` in the template (or
+    is appended). Output is
+    either grouped per job and printed when it finishes, or streamed with a
+    ``[arg]`` tag; both keep every job's own lines in order.
+    """
+
+    def __init__(self, terminal, template, items, jobs, tag=False):
+        self.terminal = terminal
+        self.template = template
+        self.items = list(items)
+        self.jobs = max(1, jobs)
+        self.tag = tag
+        self.pending = collections.deque(enumerate(self.items))
+        self.results = {}
+        self.running = 0
+        self.start_time = time.time()
+        self._filling = False
+        self._done = False
+
+    def command_for(self, item):
+        # Quoted so an argument with spaces or shell characters stays one argument
+        quoted = subprocess.list2cmdline([item]) if os.name == "nt" else shlex.quote(item)
+        if "{}" in self.template:
+            return self.template.replace("{}", quoted)
+        return f"{self.template} {quoted}"
+
+    def start(self):
+        self._fill()
+
+    def _fill(self):
+        # A job that fails to spawn finishes inside submit(); don't recurse then
+        if self._filling:
+            return
+        self._filling = True
+        term = self.terminal
+        while self.pending and self.running < self.jobs:
+            index, item = self.pending.popleft()
+            cmd = self.command_for(item)
+            args, shell = term._shell_args(cmd)
+            output = []
+            if self.tag:
+                sink = lambda job, chunks, item=item: term._job_sink(job, [(st, f"[{item}] {tx}") for st, tx in chunks])
+            else:
+                sink = lambda job, chunks, out=output: out.extend(chunks)
+            self.running += 1
+            term.job_manager.submit(cmd, term.current_dir, args=args, shell=shell, sink=sink, background=False,
+                                    on_finished=lambda job, i=index, it=item, out=output: self._finished(job, i, it, out))
+        self._filling = False
+        if not self.pending and self.running == 0 and not self._done:
+            self._done = True
+            self._summary()
+
+    def _finished(self, job, index, item, output):
+        self.running -= 1
+        code = job.returncode if job.returncode is not None else -1
+        self.results[index] = (item, code, job.runtime())
+        if not self.tag:
+            color = "green" if code == 0 else "red"
+            self.terminal.append_text(f"── {item} (exit {code}, {job.runtime():.2f}s) ──\n", color=color, animate=False)
+            if output:
+                self.terminal._job_sink(job, output)
+        self._fill()
+
+    def _summary(self):
+        term = self.terminal
+        width = max([len(it) for it in self.items] + [3])
+        term.append_text(f"\n{'ARG':{width}}  {'EXIT':>4}  {'TIME':>8}\n", color="cyan", animate=False)
+        failed = 0
+        for index in range(len(self.items)):
+            item, code, duration = self.results[index]
+            failed += code != 0
+            term.append_text(f"{item:{width}}  {code:>4}  {duration:>7.2f}s\n", color="white" if code == 0 else "red", animate=False)
+        color = "green" if not failed else "yellow"
+        term.append_text(f"{len(self.items)} jobs, {failed} failed, {time.time() - self.start_time:.2f}s wall time\n",
+                         color=color, animate=False)
+
+
+class WatchSession(QObject):
+    """Re-runs a command on an interval and redraws only the lines that changed.
+
+    The target pane keeps one text block per output line; each run is diffed
+    against the previous one, changed blocks are rewritten and highlighted,
+    and untouched blocks are left alone. The timer stops while the window is
+    hidden or minimized.
+    """
+
+    def __init__(self, terminal, cmd, interval, pane):
+        super().__init__(terminal)
+        self.terminal = terminal
+        self.cmd = cmd
+        self.interval = interval
+        self.pane = pane
+        self.rows = []
+        self.highlighted = set()
+        self.job = None
+        self.runs = 0
+        self._stopped = False
+        self._timer = QTimer(self)
+        self._timer.setInterval(int(interval * 1000))
+        self._timer.timeout.connect(self.run_once)
+        pane.setUndoRedoEnabled(False)
+        pane.clear()
+        terminal.installEventFilter(self)
+
+    def start(self):
+        self.run_once()
+        self._update_paused()
+
+    def stop(self):
+        self._stopped = True
+        self._timer.stop()
+        self.terminal.removeEventFilter(self)
+        if self.job is not None:
+            self.terminal.job_manager.kill(self.job.id)
+            self.job = None
+
+    def eventFilter(self, obj, event):
+        if event.type() in (QEvent.Hide, QEvent.Show, QEvent.WindowStateChange):
+            self._update_paused()
+        return False
+
+    def _update_paused(self):
+        hidden = not self.terminal.isVisible() or self.terminal.isMinimized()
+        if hidden:
+            self._timer.stop()
+        elif not self._timer.isActive():
+            self._timer.start()
+
+    def run_once(self):
+        if self.job is not None:
+            return
+        lines = []
+        args, shell = self.terminal._shell_args(self.cmd)
+        job = self.terminal.job_manager.submit(
+            self.cmd, self.terminal.current_dir, args=args, shell=shell, background=False, listed=False,
+            sink=lambda job, chunks: lines.extend(text for _, text in chunks),
+            on_finished=lambda job: self._finished(job, lines))
+        # A command that fails to spawn has already finished inside submit()
+        if job.status == "running":
+            self.job = job
+
+    def _finished(self, job, lines):
+        self.job = None
+        if self._stopped:
+            return
+        self.runs += 1
+        text = "".join(lines).splitlines()
+        header = f"Every {self.interval:g}s: {self.cmd}    {time.strftime('%H:%M:%S')}  (exit {job.returncode})"
+        self.render([header, ""] + text)
+
+    def render(self, rows):
+        colors = self.terminal.COLORS
+        doc = self.pane.document()
+        cursor = QTextCursor(doc)
+        cursor.beginEditBlock()
+        changed = set()
+        for i, text in enumerate(rows):
+            old = self.rows[i] if i < len(self.rows) else None
+            is_changed = i >= 2 and self.runs > 1 and old != text
+            if old == text and i not in self.highlighted:
+                continue
+            fmt = QTextCharFormat()
+            if i == 0:
+                fmt.setForeground(QColor(colors["gray"]))
+            elif is_changed:
+                fmt.setForeground(QColor(colors["yellow"]))
+                fmt.setBackground(QColor("#2a2a12"))
+                changed.add(i)
+            else:
+                fmt.setForeground(QColor(colors[self.terminal._line_color(text)]))
+            if i < doc.blockCount():
+                block = doc.findBlockByNumber(i)
+                cursor.setPosition(block.position())
+                cursor.setPosition(block.position() + block.length() - 1, QTextCursor.KeepAnchor)
+            else:
+                cursor.movePosition(QTextCursor.End)
+                cursor.insertBlock()
+            cursor.setCharFormat(fmt)
+            cursor.insertText(text, fmt)
+        if doc.blockCount() > len(rows):
+            last = doc.findBlockByNumber(len(rows) - 1)
+            cursor.setPosition(last.position() + last.length() - 1)
+            cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+            cursor.removeSelectedText()
+        cursor.endEditBlock()
+        self.rows = rows
+        self.highlighted = changed
+
+
+class ProcessSampler:
+    """Incremental process sampler: /proc on Linux, Win32 APIs on Windows.
+
+    Per-pid state (name, command line, last CPU counters and, on Windows, an
+    open process handle) is kept between samples, so each tick only re-reads
+    the counters that change and converts them into CPU% deltas.
+    """
+
+    def __init__(self):
+        self._state = {}
+        self._last = None
+        self.linux = sys.platform.startswith("linux")
+        self.supported = self.linux or os.name == "nt"
+        if self.linux:
+            self._clk = os.sysconf("SC_CLK_TCK")
+            self._page = os.sysconf("SC_PAGE_SIZE")
+        self._win = None
+
+    def sample(self):
+        """Return a list of (pid, name, cpu_percent, rss_bytes, threads, cmdline) rows."""
+        now = time.monotonic()
+        elapsed = now - self._last if self._last is not None else None
+        self._last = now
+        if self.linux:
+            return self._sample_linux(elapsed)
+        if os.name == "nt":
+            return self._sample_windows(elapsed)
+        return []
+
+    def _sample_linux(self, elapsed):
+        rows = []
+        seen = set()
+        for entry in os.scandir("/proc"):
+            if not entry.name.isdigit():
+                continue
+            pid = int(entry.name)
+            try:
+                with open(f"/proc/{pid}/stat", "rb") as fh:
+                    raw = fh.read()
+            except OSError:
+                continue
+            rpar = raw.rfind(b")")
+            fields = raw[rpar + 2:].split()
+            state = self._state.get(pid)
+            # starttime distinguishes a reused pid from the process we saw before
+            if state is None or state["start"] != fields[19]:
+                name = raw[raw.find(b"(") + 1:rpar].decode(errors="replace")
+                try:
+                    with open(f"/proc/{pid}/cmdline", "rb") as fh:
+                        cmdline = fh.read().replace(b"\0", b" ").decode(errors="replace").strip()
+                except OSError:
+                    cmdline = ""
+                state = self._state[pid] = {"start": fields[19], "name": name, "cmdline": cmdline or f"[{name}]", "cpu": None}
+            ticks = int(fields[11]) + int(fields[12])
+            cpu = 0.0
+            if state["cpu"] is not None and elapsed:
+                cpu = (ticks - state["cpu"]) / self._clk / elapsed * 100.0
+            state["cpu"] = ticks
+            seen.add(pid)
+            rows.append((pid, state["name"], cpu, int(fields[21]) * self._page, int(fields[17]), state["cmdline"]))
+        for pid in set(self._state) - seen:
+            del self._state[pid]
+        return rows
+
+    def _win_api(self):
+        if self._win is None:
+            import ctypes
+            from ctypes import wintypes
+
+            class PROCESSENTRY32W(ctypes.Structure):
+                _fields_ = [("dwSize", wintypes.DWORD), ("cntUsage", wintypes.DWORD), ("th32ProcessID", wintypes.DWORD),
+                            ("th32DefaultHeapID", ctypes.c_size_t), ("th32ModuleID", wintypes.DWORD),
+                            ("cntThreads", wintypes.DWORD), ("th32ParentProcessID", wintypes.DWORD),
+                            ("pcPriClassBase", wintypes.LONG), ("dwFlags", wintypes.DWORD), ("szExeFile", wintypes.WCHAR * 260)]
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                    (name, ctypes.c_size_t) for name in ("PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                                                         "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage",
+                                                         "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+            kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+            kernel32.CreateToolhelp32Snapshot.restype = wintypes.HANDLE
+            kernel32.OpenProcess.restype = wintypes.HANDLE
+            self._win = (ctypes, kernel32, PROCESSENTRY32W, PROCESS_MEMORY_COUNTERS)
+        return self._win
+
+    def _sample_windows(self, elapsed):
+        ctypes, kernel32, PROCESSENTRY32W, PROCESS_MEMORY_COUNTERS = self._win_api()
+        snapshot = kernel32.CreateToolhelp32Snapshot(0x2, 0)  # TH32CS_SNAPPROCESS
+        if not snapshot or snapshot == ctypes.c_void_p(-1).value:
+            return []
+        rows = []
+        seen = set()
+        entry = PROCESSENTRY32W()
+        entry.dwSize = ctypes.sizeof(entry)
+        times = [ctypes.c_ulonglong() for _ in range(4)]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        try:
+            ok = kernel32.Process32FirstW(snapshot, ctypes.byref(entry))
+            while ok:
+                pid, name = entry.th32ProcessID, entry.szExeFile
+                state = self._state.get(pid)
+                # A signalled handle means the pid now belongs to a new process
+                if state is not None and (state["name"] != name or
+                                          (state["handle"] and kernel32.WaitForSingleObject(state["handle"], 0) == 0)):
+                    if state["handle"]:
+                        kernel32.CloseHandle(state["handle"])
+                    state = None
+                if state is None:
+                    # PROCESS_QUERY_LIMITED_INFORMATION | PROCESS_VM_READ | SYNCHRONIZE
+                    handle = kernel32.OpenProcess(0x1000 | 0x0010 | 0x00100000, False, pid)
+                    state = self._state[pid] = {"name": name, "handle": handle, "cpu": None}
+                cpu, rss = 0.0, 0
+                handle = state["handle"]
+                if handle and kernel32.GetProcessTimes(handle, *[ctypes.byref(t) for t in times]):
+                    busy = times[2].value + times[3].value
+                    if state["cpu"] is not None and elapsed:
+                        cpu = (busy - state["cpu"]) / 1e7 / elapsed * 100.0
+                    state["cpu"] = busy
+                if handle and kernel32.K32GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+                    rss = counters.WorkingSetSize
+                seen.add(pid)
+                rows.append((pid, name, cpu, rss, entry.cntThreads, name))
+                ok = kernel32.Process32NextW(snapshot, ctypes.byref(entry))
+        finally:
+            kernel32.CloseHandle(snapshot)
+        for pid in set(self._state) - seen:
+            handle = self._state.pop(pid)["handle"]
+            if handle:
+                kernel32.CloseHandle(handle)
+        return rows
+
+    def close(self):
+        if self._win is not None:
+            for state in self._state.values():
+                if state.get("handle"):
+                    self._win[1].CloseHandle(state["handle"])
+        self._state.clear()
+
+    @staticmethod
+    def kill(pid):
+        if os.name == "nt":
+            result = subprocess.run(["taskkill", "/F", "/T", "/PID", str(pid)], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            if result.returncode != 0:
+                raise OSError(result.stdout.strip())
+        else:
+            os.kill(pid, signal.SIGTERM)
+
+
+class ProcessTableModel(QAbstractTableModel):
+    """Sorted, filtered view over the latest process sample.
+
+    Qt only asks for the cells it paints, so only visible rows are formatted.
+    """
+    HEADERS = ("PID", "NAME", "CPU %", "MEMORY", "THREADS", "COMMAND")
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._all = []
+        self.rows = []
+        self.sort_column = 2
+        self.sort_order = Qt.DescendingOrder
+        self.filter_text = ""
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        col = index.column()
+        if role == Qt.DisplayRole:
+            if col == 2:
+                return f"{row[2]:.1f}"
+            if col == 3:
+                return f"{row[3] / (1024 * 1024):.1f} MB"
+            return str(row[col])
+        if role == Qt.TextAlignmentRole and col in (0, 2, 3, 4):
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        if role == Qt.ForegroundRole and col == 2 and row[2] >= 50:
+            return QColor(MopsTerminal.COLORS["red"])
+        return None
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_column = column
+        self.sort_order = order
+        self._apply()
+
+    def set_rows(self, rows):
+        self._all = rows
+        self._apply()
+
+    def set_filter(self, text):
+        self.filter_text = text.strip().lower()
+        self._apply()
+
+    def _apply(self):
+        self.layoutAboutToBeChanged.emit()
+        # Persistent indexes (the view's selection) follow their PID, not the row number
+        persistent = self.persistentIndexList()
+        pids = [self.rows[i.row()][0] if i.row() < len(self.rows) else None for i in persistent]
+        rows = self._all
+        needle = self.filter_text
+        if needle:
+            rows = [r for r in rows if needle == str(r[0]) or needle in r[1].lower() or needle in r[5].lower()]
+        col = self.sort_column
+        key = (lambda r: r[col].lower()) if col in (1, 5) else (lambda r: r[col])
+        self.rows = sorted(rows, key=key, reverse=self.sort_order == Qt.DescendingOrder)
+        where = {r[0]: n for n, r in enumerate(self.rows)}
+        self.changePersistentIndexList(persistent, [self.index(where[pid], i.column()) if pid in where else QModelIndex()
+                                                    for pid, i in zip(pids, persistent)])
+        self.layoutChanged.emit()
+
+    def row_of(self, pid):
+        return next((n for n, r in enumerate(self.rows) if r[0] == pid), None)
+
+
+class TopWindow(QDialog):
+    """Live process table with filtering and kill-by-pid, sampled on a timer."""
+
+    def __init__(self, parent=None, interval=2.0, filter_text=""):
+        super().__init__(parent)
+        self.setWindowTitle("top")
+        self.resize(900, 560)
+        self.setAttribute(Qt.WA_DeleteOnClose)
+        self.sampler = ProcessSampler()
+        self.model = ProcessTableModel(self)
+
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+        bar = QHBoxLayout()
+        self.filter_input = QLineEdit(filter_text)
+        self.filter_input.setPlaceholderText("filter by name, command or pid")
+        self.filter_input.textChanged.connect(self.model.set_filter)
+        bar.addWidget(self.filter_input, 1)
+        self.kill_button = QPushButton("kill")
+        self.kill_button.clicked.connect(self.kill_selected)
+        bar.addWidget(self.kill_button)
+        layout.addLayout(bar)
+
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSortingEnabled(True)
+        self.table.sortByColumn(2, Qt.DescendingOrder)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.verticalHeader().setVisible(False)
+        self.table.verticalHeader().setDefaultSectionSize(20)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.setStyleSheet("QTableView { background-color: #0a0a0a; gridline-color: #1a1a1a; } "
+                                 "QHeaderView::section { background-color: #0f0f0f; color: #6a6a6a; border: none; padding: 4px; }")
+        layout.addWidget(self.table, 1)
+        self.selected_pid = None
+        self.table.selectionModel().selectionChanged.connect(self._remember_selection)
+
+        self.status = QLabel("")
+        self.status.setStyleSheet("QLabel { color: #6a6a6a; font-size: 11px; }")
+        layout.addWidget(self.status)
+
+        self.model.set_filter(filter_text)
+        self._timer = QTimer(self)
+        self._timer.setInterval(int(interval * 1000))
+        self._timer.timeout.connect(self.refresh)
+        self.refresh()
+
+    def refresh(self):
+        try:
+            rows = self.sampler.sample()
+        except Exception as e:
+            self.status.setText(f"sampling failed: {e}")
+            return
+        self.model.set_rows(rows)
+        total = sum(r[2] for r in rows)
+        self.status.setText(f"{len(rows)} processes, {len(self.model.rows)} shown, total CPU {total:.1f}%")
+
+    def _remember_selection(self):
+        selected = self.table.selectionModel().selectedRows()
+        self.selected_pid = self.model.rows[selected[0].row()][0] if selected else None
+
+    def kill_selected(self):
+        pid = self.selected_pid
+        if pid is None or self.model.row_of(pid) is None:
+            self.status.setText("select a process to kill")
+            return
+        try:
+            self.sampler.kill(pid)
+            self.status.setText(f"sent terminate to pid {pid}")
+        except Exception as e:
+            self.status.setText(f"kill {pid} failed: {e}")
+
+    def keyPressEvent(self, event):
+        if event.key() == Qt.Key_Delete:
+            self.kill_selected()
+            return
+        super().keyPressEvent(event)
+
+    def showEvent(self, event):
+        self._timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self._timer.stop()
+        super().hideEvent(event)
+
+    def closeEvent(self, event):
+        self._timer.stop()
+        self.sampler.close()
+        super().closeEvent(event)
+
+
+class TableData:
+    """Columnar table parsed from delimited or fixed-width command output.
+
+    Values are stored one list per column; ``row`` and ``column`` are the only
+    accessors the table model uses, so a file-backed subclass can serve rows
+    lazily.
+    """
+
+    def __init__(self, header, rows):
+        self.header = list(header) or ["col1"]
+        width = max([len(self.header)] + [len(r) for r in rows])
+        self.header += [f"col{i + 1}" for i in range(len(self.header), width)]
+        self.columns = [[r[c] if c < len(r) else "" for r in rows] for c in range(width)]
+        self.done = True
+
+    def row_count(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def row(self, i):
+        return [col[i] for col in self.columns]
+
+    def column(self, c):
+        return self.columns[c]
+
+    def wait(self):
+        pass
+
+    def close(self):
+        pass
+
+    @classmethod
+    def from_text(cls, text):
+        """Parse tab/comma/semicolon separated, ruler-aligned or whitespace-separated text."""
+        lines = [line.rstrip("\r") for line in text.splitlines() if line.strip()]
+        if not lines:
+            return cls(["(empty)"], [])
+        sample = lines[:50]
+        for delim in ("\t", ",", ";"):
+            counts = {line.count(delim) for line in sample}
+            if len(counts) == 1 and counts.pop() > 0:
+                rows = list(csv.reader(lines, delimiter=delim))
+                return cls(rows[0], rows[1:])
+        # A ruler under the header ('=====' in tasklist, '-----' in PowerShell) gives the column spans
+        for i, line in enumerate(lines[1:10], 1):
+            stripped = line.strip()
+            if len(stripped) > 2 and set(stripped) <= set("=- "):
+                starts = [m.start() for m in re.finditer(r"[=-]+", line)]
+                bounds = list(zip(starts, starts[1:] + [None]))
+                cut = lambda text: [text[a:b].strip() for a, b in bounds]
+                return cls(cut(lines[i - 1]), [cut(l) for l in lines[i + 1:]])
+        # Whitespace separated; the last column keeps its spaces (file names in 'ls -l')
+        counts = collections.Counter(len(line.split()) for line in sample)
+        ncols = max(counts.items(), key=lambda kv: (kv[1], kv[0]))[0]
+        rows = [line.split(None, ncols - 1) for line in lines]
+        return cls([f"col{i + 1}" for i in range(ncols)], rows)
+
+
+class MappedTableData(TableData):
+    """Delimited file served straight from a memory map.
+
+    A row-offset index is built on a background thread (the table fills in as
+    it grows), rows are parsed on demand through a small cache, and a column
+    is only materialized when it is sorted or filtered on. A newline inside a
+    quoted field does not start a row, so a row is always the bytes between
+    two offsets.
+    """
+
+    def __init__(self, path, chunk_size=4 * 1024 * 1024):
+        self.path = path
+        self._fh = open(path, "rb")
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        head = self._mm[:65536].decode("utf-8", errors="replace")
+        try:
+            self.delimiter = csv.Sniffer().sniff(head.split("\n", 1)[0], delimiters=",;\t|").delimiter
+        except csv.Error:
+            self.delimiter = ","
+        first_end = self._header_end()
+        self.header = next(csv.reader([self._line_at(0, first_end)], delimiter=self.delimiter), []) or ["col1"]
+        self.offsets = array.array("Q")
+        self._cache = collections.OrderedDict()
+        self._columns = {}
+        self.done = False
+        self._chunk_size = chunk_size
+        self._thread = threading.Thread(target=self._build_index, args=(first_end + 1,), daemon=True)
+        self._thread.start()
+
+    def _header_end(self):
+        """Offset of the newline that ends the header row (quoted newlines included)."""
+        mm, end, quoted = self._mm, -1, False
+        while True:
+            nl = mm.find(b"\n", end + 1)
+            line_end = len(mm) if nl < 0 else nl
+            quoted ^= mm[end + 1:line_end].count(b'"') % 2 == 1
+            end = line_end
+            if not quoted or nl < 0:
+                return end
+
+    def _build_index(self, pos):
+        mm, size, offsets = self._mm, len(self._mm), self.offsets
+        # quoted: inside a quoted field that spans lines; at_start: pos begins a line
+        quoted, at_start = False, True
+        while pos < size and not self.done:
+            chunk = mm[pos:pos + self._chunk_size]
+            cut = chunk.rfind(b"\n") + 1 if pos + len(chunk) < size else len(chunk)
+            if cut == 0:
+                cut = len(chunk)
+            parts = chunk[:cut].split(b"\n")
+            if quoted or b'"' in chunk[:cut]:
+                # A line starts a row only outside quotes; '""' escapes keep the count even
+                line_start = pos
+                for k, part in enumerate(parts):
+                    if k == len(parts) - 1 and not part:
+                        break
+                    if (at_start or k) and not quoted:
+                        offsets.append(line_start)
+                    if part.count(b'"') % 2:
+                        quoted = not quoted
+                    line_start += len(part) + 1
+            else:
+                # Line k starts after k newlines plus the lengths of the k lines before it
+                starts = map(operator.add, itertools.accumulate(map(len, parts[:-1])), itertools.count(pos + 1))
+                if at_start:
+                    offsets.append(pos)
+                offsets.extend(starts)
+                if offsets and offsets[-1] >= pos + cut:
+                    offsets.pop()
+            at_start = chunk[cut - 1:cut] == b"\n"
+            pos += cut
+        self.done = True
+
+    def _line_at(self, start, end):
+        return self._mm[start:end].rstrip(b"\r").decode("utf-8", errors="replace")
+
+    def _record(self, i):
+        """Text of row ``i``: the bytes up to the next row's offset, which may span lines."""
+        start = self.offsets[i]
+        end = self.offsets[i + 1] - 1 if i + 1 < len(self.offsets) else len(self._mm)
+        return self._mm[start:end].decode("utf-8", errors="replace").rstrip("\r\n")
+
+    def row_count(self):
+        # While indexing, the last row found may still continue past the indexed part
+        n = len(self.offsets)
+        return n if self.done else max(0, n - 1)
+
+    def _parse(self, i):
+        return next(csv.reader([self._record(i)], delimiter=self.delimiter), [])
+
+    def row(self, i):
+        row = self._cache.get(i)
+        if row is None:
+            row = self._parse(i)
+            self._cache[i] = row
+            if len(self._cache) > 4096:
+                self._cache.popitem(last=False)
+        return row
+
+    def _rows(self, batch=4096):
+        """Parse every row in order; blocks without quotes are one row per line."""
+        offsets, n = self.offsets, len(self.offsets)
+        for first in range(0, n, batch):
+            last = min(first + batch, n)
+            end = offsets[last] - 1 if last < n else len(self._mm)
+            block = self._mm[offsets[first]:end]
+            if b'"' in block:
+                # Quoted fields may hold newlines: parse each row's own slice
+                yield from map(self._parse, range(first, last))
+            else:
+                lines = block.decode("utf-8", errors="replace").split("\n")[:last - first]
+                yield from csv.reader(lines, delimiter=self.delimiter)
+
+    def column(self, c):
+        if c not in self._columns:
+            self.wait()
+            self._columns[c] = [r[c] if c < len(r) else "" for r in self._rows()]
+        return self._columns[c]
+
+    def wait(self):
+        self._thread.join()
+
+    def close(self):
+        self.done = True
+        self._thread.join()
+        self._columns.clear()
+        self._cache.clear()
+        self._mm.close()
+        self._fh.close()
+
+
+class LazyTableModel(QAbstractTableModel):
+    """Table model that formats only the rows the view asks for.
+
+    Sorting and filtering compute a permutation of row ids from the columns
+    involved on a worker thread, so a large file never stalls the UI; the
+    view is then told the layout changed instead of being repopulated. A
+    result that a newer sort or filter has superseded is dropped.
+    """
+
+    _computed = pyqtSignal(object)
+
+    def __init__(self, table, parent=None):
+        super().__init__(parent)
+        self.table = table
+        self.view_rows = None
+        self._count = table.row_count()
+        self.sort_column = -1
+        self.sort_order = Qt.AscendingOrder
+        self.filter_text = ""
+        self.filter_column = -1
+        self._keys = (-1, None)
+        self.busy = False
+        self.error = None
+        self._generation = 0
+        self._work_lock = threading.Lock()
+        # Emitted from the worker; delivered queued on the GUI thread
+        self._computed.connect(self._publish)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.view_rows) if self.view_rows is not None else self._count
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.table.header)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.table.header[section] if section < len(self.table.header) else ""
+        return str(section + 1)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        rid = self.view_rows[index.row()] if self.view_rows is not None else index.row()
+        row = self.table.row(rid)
+        return row[index.column()] if index.column() < len(row) else ""
+
+    def refresh_count(self):
+        """Expose rows indexed since the last call (while the file index is still growing)."""
+        count = self.table.row_count()
+        if self.view_rows is None and count > self._count:
+            self.beginInsertRows(QModelIndex(), self._count, count - 1)
+            self._count = count
+            self.endInsertRows()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_column = column
+        self.sort_order = order
+        self._apply()
+
+    def set_filter(self, text, column=-1):
+        self.filter_text = text.strip().lower()
+        self.filter_column = column
+        self._apply()
+
+    @staticmethod
+    def _sort_key(value):
+        match = re.match(r"\s*(-?[\d,]*\.?\d+)", value)
+        if match:
+            try:
+                return (0, float(match.group(1).replace(",", "")), "")
+            except ValueError:
+                pass
+        return (1, 0.0, value.lower())
+
+    def _sort_keys(self, column):
+        """Per-row sort keys: plain floats when the whole column is numeric."""
+        values = self.table.column(column)
+        try:
+            return list(map(float, values))
+        except ValueError:
+            return list(map(self._sort_key, values))
+
+    def _apply(self):
+        self._generation += 1
+        if not self.filter_text and self.sort_column < 0:
+            # Back to file order; nothing to compute
+            self.busy = False
+            if self.view_rows is not None:
+                self._publish((self._generation, self.table.row_count(), None, None))
+            return
+        self.busy = True
+        threading.Thread(target=self._compute, daemon=True,
+                         args=(self._generation, self.filter_text, self.filter_column,
+                               self.sort_column, self.sort_order)).start()
+
+    def _compute(self, generation, needle, filter_column, sort_column, order):
+        """Worker: wait for the index, then filter and sort row ids."""
+        with self._work_lock:
+            if generation != self._generation:
+                return
+            # On failure the current rows stay and the error is shown
+            count, ids, error = self._count, self.view_rows, None
+            try:
+                self.table.wait()
+                count = self.table.row_count()
+                ids = None
+                if needle:
+                    cols = [filter_column] if filter_column >= 0 else range(len(self.table.header))
+                    cols = [self.table.column(c) for c in cols]
+                    ids = [i for i in range(count) if any(needle in col[i].lower() for col in cols)]
+                if 0 <= sort_column < len(self.table.header):
+                    if self._keys[0] != sort_column:
+                        self._keys = (sort_column, self._sort_keys(sort_column))
+                    ids = sorted(range(count) if ids is None else ids, key=self._keys[1].__getitem__,
+                                 reverse=order == Qt.DescendingOrder)
+            except Exception as e:
+                # A sort key that fails to compare, or the table closed meanwhile
+                error = f"{type(e).__name__}: {e}"
+        try:
+            self._computed.emit((generation, count, ids, error))
+        except RuntimeError:
+            pass  # the model is gone
+
+    def _publish(self, result):
+        generation, count, ids, error = result
+        if generation != self._generation:
+            return
+        self.busy = False
+        self.error = error
+        self.layoutAboutToBeChanged.emit()
+        self._count = count
+        self.view_rows = ids
+        self.layoutChanged.emit()
+
+
+class TableWindow(QDialog):
+    """Sortable, filterable table view over a TableData source."""
+
+    def __init__(self, table, title="table", parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(title)
+        self.resize(1000, 600)
+        self.setAttribute(Qt.WA_DeleteOnClose)
+        self.table_data = table
+        self.model = LazyTableModel(table, self)
+
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+        bar = QHBoxLayout()
+        self.filter_input = QLineEdit()
+        self.filter_input.setPlaceholderText("filter (press Enter)")
+        self.filter_input.returnPressed.connect(self.apply_filter)
+        bar.addWidget(self.filter_input, 1)
+        self.column_box = QComboBox()
+        self.column_box.addItem("all columns")
+        self.column_box.addItems(table.header)
+        bar.addWidget(self.column_box)
+        layout.addLayout(bar)
+
+        self.view = QTableView()
+        self.view.setModel(self.model)
+        self.view.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.view.setSortingEnabled(True)
+        self.view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.view.verticalHeader().setDefaultSectionSize(20)
+        self.view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.view.horizontalHeader().setStretchLastSection(True)
+        self.view.setStyleSheet("QTableView { background-color: #0a0a0a; gridline-color: #1a1a1a; } "
+                                "QHeaderView::section { background-color: #0f0f0f; color: #6a6a6a; border: none; padding: 4px; }")
+        layout.addWidget(self.view, 1)
+
+        self.status = QLabel("")
+        self.status.setStyleSheet("QLabel { color: #6a6a6a; font-size: 11px; }")
+        layout.addWidget(self.status)
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(100)
+        self._timer.timeout.connect(self._poll)
+        # Sorting runs on a worker; the status shows it until the layout changes
+        self.view.horizontalHeader().sortIndicatorChanged.connect(lambda *_: self._poll())
+        self.model.layoutChanged.connect(self._poll)
+        self._poll()
+
+    def _poll(self):
+        self.model.refresh_count()
+        state = " (indexing...)" if not self.table_data.done else " (sorting...)" if self.model.busy else ""
+        if self.model.error and not self.model.busy:
+            state = f" (sort/filter failed: {self.model.error})"
+        self.status.setText(f"{self.table_data.row_count():,} rows, {self.model.rowCount():,} shown{state}")
+        if self.table_data.done and not self.model.busy:
+            self._timer.stop()
+        elif not self._timer.isActive():
+            self._timer.start()
+
+    def apply_filter(self):
+        self.model.set_filter(self.filter_input.text(), self.column_box.currentIndex() - 1)
+        self._poll()
+
+    def closeEvent(self, event):
+        self._timer.stop()
+        self.table_data.close()
+        super().closeEvent(event)
+
+
+class SparseLineIndex:
+    """Line index over a memory-mapped file that stores one entry per chunk.
+
+    A background thread walks the file in newline-aligned chunks, recording
+    each chunk's byte offset and the number of the line it starts with, so a
+    multi-gigabyte file costs a few thousand entries. A line's offset is
+    found by bisecting to its chunk and skipping the few lines in between.
+    Both arrays change only under ``_lock``, so readers on the GUI thread
+    always see an offset together with its line number.
+    """
+
+    def __init__(self, path, chunk_size=256 * 1024):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._fh = open(path, "rb")
+        self._mm = None
+        self.size = 0
+        self.chunk_offsets = array.array("Q")
+        self.chunk_lines = array.array("Q")
+        self.total_lines = 0
+        self._indexed_to = 0
+        self._closed = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    @property
+    def done(self):
+        return self._indexed_to >= self.size
+
+    def refresh(self):
+        """Pick up growth (or truncation) of the file; returns True if it changed."""
+        if self._thread is not None and self._thread.is_alive():
+            return False
+        size = os.fstat(self._fh.fileno()).st_size
+        if size == self.size:
+            return False
+        with self._lock:
+            if size < self.size:
+                self.chunk_offsets = array.array("Q")
+                self.chunk_lines = array.array("Q")
+                self.total_lines = 0
+                self._indexed_to = 0
+            elif self.chunk_offsets:
+                # The last chunk may end in a partial line; index it again with the new data
+                self._indexed_to = self.chunk_offsets.pop()
+                self.total_lines = self.chunk_lines.pop()
+        old = self._mm
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.size = size
+        if old is not None:
+            old.close()
+        if self._mm is not None:
+            self._thread = threading.Thread(target=self._build, daemon=True)
+            self._thread.start()
+        return True
+
+    def _build(self):
+        mm, pos, size = self._mm, self._indexed_to, self.size
+        while pos < size and not self._closed:
+            end = min(pos + self.chunk_size, size)
+            if end < size:
+                nl = mm.rfind(b"\n", pos, end)
+                end = nl + 1 if nl >= 0 else end
+            count = mm[pos:end].count(b"\n")
+            if end == size and mm[end - 1:end] != b"\n":
+                count += 1
+            with self._lock:
+                self.chunk_offsets.append(pos)
+                self.chunk_lines.append(self.total_lines)
+                self.total_lines += count
+            pos = end
+            self._indexed_to = pos
+
+    def line_offset(self, n):
+        """Byte offset where line ``n`` (0-based) starts."""
+        with self._lock:
+            k = bisect.bisect_right(self.chunk_lines, n) - 1
+            if k < 0:
+                return 0
+            off, first = self.chunk_offsets[k], self.chunk_lines[k]
+        for _ in range(n - first):
+            nl = self._mm.find(b"\n", off)
+            if nl < 0:
+                return self.size
+            off = nl + 1
+        return off
+
+    def line_at(self, offset):
+        """Line number containing byte ``offset``."""
+        with self._lock:
+            k = bisect.bisect_right(self.chunk_offsets, offset) - 1
+            if k < 0:
+                return 0
+            start, first = self.chunk_offsets[k], self.chunk_lines[k]
+        return first + self._mm[start:offset].count(b"\n")
+
+    def lines(self, start, count, max_width=4000):
+        """Decode ``count`` lines starting at line ``start``."""
+        if self._mm is None:
+            return []
+        out = []
+        off = self.line_offset(start)
+        while len(out) < count and off < self.size:
+            nl = self._mm.find(b"\n", off)
+            end = self.size if nl < 0 else nl
+            out.append(self._mm[off:min(end, off + max_width)].rstrip(b"\r").decode("utf-8", errors="replace"))
+            off = end + 1
+        return out
+
+    def search(self, pattern, start, backward=False, window=4 * 1024 * 1024):
+        """Offset and length of the next match of compiled bytes ``pattern`` from ``start``."""
+        if self._mm is None:
+            return None
+        if not backward:
+            m = pattern.search(self._mm, start)
+            return (m.start(), m.end() - m.start()) if m else None
+        end = start
+        while end > 0:
+            begin = max(0, end - window)
+            last = None
+            for m in pattern.finditer(self._mm, begin, end):
+                last = m
+            if last is not None:
+                return last.start(), last.end() - last.start()
+            # overlap windows slightly so matches across the boundary are found
+            end = begin + min(1024, end - begin) if begin else 0
+            if begin == 0:
+                break
+        return None
+
+    def close(self):
+        self._closed = True
+        if self._thread is not None:
+            self._thread.join()
+        if self._mm is not None:
+            self._mm.close()
+        self._fh.close()
+
+
+class PagerWindow(QDialog):
+    """Pager that renders only the visible lines of a memory-mapped file."""
+
+    def __init__(self, path, parent=None, font=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"view - {os.path.basename(path)}")
+        self.resize(1000, 650)
+        self.setAttribute(Qt.WA_DeleteOnClose)
+        self.index = SparseLineIndex(path)
+        self.top = 0
+        self.match = None
+
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+        bar = QHBoxLayout()
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("search (regex)")
+        self.search_input.returnPressed.connect(lambda: self.find(backward=False))
+        bar.addWidget(self.search_input, 1)
+        self.case_box = QCheckBox("Aa")
+        bar.addWidget(self.case_box)
+        prev_button = QPushButton("prev")
+        prev_button.clicked.connect(lambda: self.find(backward=True))
+        bar.addWidget(prev_button)
+        next_button = QPushButton("next")
+        next_button.clicked.connect(lambda: self.find(backward=False))
+        bar.addWidget(next_button)
+        self.goto_input = QLineEdit()
+        self.goto_input.setPlaceholderText("line")
+        self.goto_input.setMaximumWidth(90)
+        self.goto_input.returnPressed.connect(self.goto_line)
+        bar.addWidget(self.goto_input)
+        self.follow_box = QCheckBox("follow")
+        self.follow_box.toggled.connect(self.set_follow)
+        bar.addWidget(self.follow_box)
+        layout.addLayout(bar)
+
+        body = QHBoxLayout()
+        self.text = QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.text.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.text.setUndoRedoEnabled(False)
+        if font is not None:
+            self.text.setFont(font)
+        self.text.setStyleSheet("QPlainTextEdit { background-color: #0a0a0a; color: #d0d0d0; border: 1px solid #1a1a1a; }")
+        self.text.installEventFilter(self)
+        self.text.viewport().installEventFilter(self)
+        body.addWidget(self.text, 1)
+        self.scrollbar = QScrollBar(Qt.Vertical)
+        self.scrollbar.valueChanged.connect(self.scroll_to)
+        body.addWidget(self.scrollbar)
+        layout.addLayout(body, 1)
+
+        self.status = QLabel("")
+        self.status.setStyleSheet("QLabel { color: #6a6a6a; font-size: 11px; }")
+        layout.addWidget(self.status)
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(200)
+        self._timer.timeout.connect(self._poll)
+        self._timer.start()
+        QTimer.singleShot(0, self.render)
+
+    def visible_rows(self):
+        return max(1, self.text.viewport().height() // max(1, self.text.fontMetrics().lineSpacing()) - 1)
+
+    def scroll_to(self, line, force=False):
+        line = max(0, min(line, max(0, self.index.total_lines - self.visible_rows())))
+        if line != self.top or force:
+            self.top = line
+            self.render()
+        if self.scrollbar.value() != line:
+            self.scrollbar.setValue(line)
+
+    def render(self):
+        rows = self.visible_rows()
+        lines = self.index.lines(self.top, rows)
+        width = len(str(self.top + len(lines)))
+        self.text.setPlainText("\n".join(f"{self.top + i + 1:>{width}}  {line}" for i, line in enumerate(lines)))
+        selections = []
+        if self.match is not None:
+            _, length, line, col = self.match
+            if self.top <= line < self.top + len(lines):
+                sel = QTextEdit.ExtraSelection()
+                sel.format.setBackground(QColor("#44475a"))
+                sel.format.setForeground(QColor(MopsTerminal.COLORS["yellow"]))
+                block = self.text.document().findBlockByNumber(line - self.top)
+                cursor = QTextCursor(block)
+                cursor.setPosition(block.position() + width + 2 + col)
+                cursor.setPosition(min(block.position() + block.length() - 1, cursor.position() + length), QTextCursor.KeepAnchor)
+                sel.cursor = cursor
+                selections.append(sel)
+        self.text.setExtraSelections(selections)
+        self._update_status()
+
+    def _update_status(self):
+        state = "" if self.index.done else " (indexing...)"
+        follow = " [follow]" if self.follow_box.isChecked() else ""
+        self.status.setText(f"line {self.top + 1:,} of {self.index.total_lines:,}  ·  {self.index.size:,} bytes{state}{follow}")
+
+    def _poll(self):
+        grew = self.index.refresh() if self.follow_box.isChecked() else False
+        self.scrollbar.setRange(0, max(0, self.index.total_lines - self.visible_rows()))
+        self.scrollbar.setPageStep(self.visible_rows())
+        if self.follow_box.isChecked():
+            if grew or self.top != self.scrollbar.maximum():
+                self.scroll_to(self.scrollbar.maximum(), force=True)
+        elif not self.index.done or self.top + self.visible_rows() > self.index.total_lines:
+            self.render()
+        else:
+            self._update_status()
+
+    def set_follow(self, enabled):
+        self._timer.setInterval(500 if enabled else 200)
+        self._poll()
+
+    def goto_line(self):
+        text = self.goto_input.text().strip()
+        if text.isdigit():
+            self.scroll_to(int(text) - 1)
+
+    def find(self, backward=False):
+        needle = self.search_input.text()
+        if not needle:
+            return
+        try:
+            pattern = re.compile(needle.encode("utf-8"), 0 if self.case_box.isChecked() else re.IGNORECASE)
+        except re.error as e:
+            self.status.setText(f"bad pattern: {e}")
+            return
+        if self.match is not None:
+            offset, length = self.match[:2]
+            start = offset if backward else offset + max(1, length)
+        else:
+            start = self.index.line_offset(self.top)
+        found = self.index.search(pattern, start, backward=backward)
+        if found is None:
+            self.status.setText(f"'{needle}' not found {'before' if backward else 'after'} this point")
+            return
+        offset, length = found
+        line = self.index.line_at(offset)
+        line_start = self.index.line_offset(line)
+        col = len(self.index._mm[line_start:offset].decode("utf-8", errors="replace"))
+        self.match = (offset, length, line, col)
+        self.scroll_to(line - self.visible_rows() // 3, force=True)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Wheel:
+            self.scroll_to(self.top - event.angleDelta().y() // 40)
+            return True
+        if event.type() == QEvent.KeyPress:
+            page = self.visible_rows()
+            moves = {Qt.Key_Up: -1, Qt.Key_Down: 1, Qt.Key_PageUp: -page, Qt.Key_PageDown: page}
+            if event.key() in moves:
+                self.scroll_to(self.top + moves[event.key()])
+                return True
+            if event.key() == Qt.Key_Home:
+                self.scroll_to(0)
+                return True
+            if event.key() == Qt.Key_End:
+                self.scroll_to(self.index.total_lines)
+                return True
+        if event.type() == QEvent.Resize and obj is self.text.viewport():
+            QTimer.singleShot(0, self.render)
+        return super().eventFilter(obj, event)
+
+    def closeEvent(self, event):
+        self._timer.stop()
+        self.index.close()
+        super().closeEvent(event)
+
+
+class ScrollbackIndex(QObject):
+    """Searchable mirror of a QTextEdit's plain text, kept up to date on append.
+
+    Appends at the end of the document are copied into a list of
+    newline-aligned chunks, so offsets in the mirror equal document
+    positions and a search is a C-speed regex scan per chunk. Any other
+    edit (clear, in-place rewrites) marks the mirror stale and it is rebuilt
+    from the document the next time it is searched.
+    """
+    # Characters outside the BMP take two positions in a QTextDocument
+    ASTRAL = re.compile("[\U00010000-\U0010FFFF]")
+
+    def __init__(self, edit, chunk_size=64 * 1024):
+        super().__init__(edit)
+        self.edit = edit
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.tail = []
+        self._tail_len = 0
+        self.length = 0
+        self.stale = True
+        edit.document().contentsChange.connect(self._changed)
+
+    def _normalize(self, text):
+        return self.ASTRAL.sub("\ufffd\ufffd", text.replace("\u2029", "\n").replace("\u2028", "\n"))
+
+    def _changed(self, position, removed, added):
+        if self.stale:
+            return
+        if removed or position != self.length:
+            self.stale = True
+            return
+        if not added:
+            return
+        cursor = QTextCursor(self.edit.document())
+        cursor.setPosition(position)
+        cursor.setPosition(position + added, QTextCursor.KeepAnchor)
+        text = self._normalize(cursor.selectedText())
+        self.tail.append(text)
+        self._tail_len += len(text)
+        self.length += len(text)
+        if self._tail_len >= self.chunk_size:
+            self._freeze()
+
+    def _freeze(self):
+        joined = "".join(self.tail)
+        cut = joined.rfind("\n") + 1 or len(joined)
+        self.chunks.append(joined[:cut])
+        rest = joined[cut:]
+        self.tail = [rest] if rest else []
+        self._tail_len = len(rest)
+
+    def rebuild(self):
+        text = self._normalize(self.edit.document().toPlainText())
+        self.chunks, self.tail, self._tail_len = [], [], 0
+        for start in range(0, len(text), self.chunk_size):
+            self.tail.append(text[start:start + self.chunk_size])
+            self._tail_len += len(self.tail[-1])
+            self._freeze()
+        self.length = len(text)
+        self.stale = False
+
+    def search(self, pattern, limit=100000):
+        """Return (starts, lengths, total) for non-empty matches of a compiled regex."""
+        if self.stale:
+            self.rebuild()
+        starts, lengths, total, base = array.array("Q"), array.array("L"), 0, 0
+        for chunk in self.chunks + ["".join(self.tail)]:
+            for m in pattern.finditer(chunk):
+                if m.end() == m.start():
+                    continue
+                total += 1
+                if total <= limit:
+                    starts.append(base + m.start())
+                    lengths.append(m.end() - m.start())
+            base += len(chunk)
+        return starts, lengths, total
+
+
+class FindBar(QFrame):
+    """Incremental find-in-scrollback bar (Ctrl+F) for a QTextEdit pane.
+
+    Only matches inside the visible part of the pane get highlight
+    selections; they are recomputed as the pane scrolls.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.edit = None
+        self.index = None
+        self.starts = array.array("Q")
+        self.lengths = array.array("L")
+        self.total = 0
+        self.current = -1
+        self.setStyleSheet("QFrame { background-color: #0a0a0a; border: 1px solid #1a1a1a; border-radius: 2px; margin-top: 6px; }")
+        layout = QHBoxLayout()
+        layout.setContentsMargins(6, 2, 6, 2)
+        self.setLayout(layout)
+        self.query = QLineEdit()
+        self.query.setPlaceholderText("find in scrollback")
+        self.query.installEventFilter(self)
+        self.query.textChanged.connect(lambda _: self._debounce.start())
+        layout.addWidget(self.query, 1)
+        self.regex_box = QCheckBox(".*")
+        self.regex_box.toggled.connect(self.search)
+        layout.addWidget(self.regex_box)
+        self.case_box = QCheckBox("Aa")
+        self.case_box.toggled.connect(self.search)
+        layout.addWidget(self.case_box)
+        self.count_label = QLabel("")
+        self.count_label.setStyleSheet("QLabel { color: #6a6a6a; font-size: 11px; border: none; }")
+        layout.addWidget(self.count_label)
+        for label, step in (("prev", -1), ("next", 1)):
+            button = QPushButton(label)
+            button.clicked.connect(lambda _, s=step: self.step(s))
+            layout.addWidget(button)
+        close_button = QPushButton("×")
+        close_button.clicked.connect(self.close_bar)
+        layout.addWidget(close_button)
+        self._debounce = QTimer(self)
+        self._debounce.setSingleShot(True)
+        self._debounce.setInterval(120)
+        self._debounce.timeout.connect(self.search)
+        self.setVisible(False)
+
+    def open_for(self, edit, index):
+        if self.edit is not None and self.edit is not edit:
+            self._detach()
+        if self.edit is not edit:
+            self.edit, self.index = edit, index
+            edit.verticalScrollBar().valueChanged.connect(self.highlight_visible)
+        self.setVisible(True)
+        self.query.setFocus()
+        self.query.selectAll()
+        self.search()
+
+    def _detach(self):
+        try:
+            self.edit.verticalScrollBar().valueChanged.disconnect(self.highlight_visible)
+        except TypeError:
+            pass
+        self.edit.setExtraSelections([])
+
+    def close_bar(self):
+        if self.edit is not None:
+            self._detach()
+            self.edit = self.index = None
+        self.setVisible(False)
+
+    def search(self):
+        if self.edit is None:
+            return
+        text = self.query.text()
+        self.current = -1
+        if not text:
+            self.starts, self.lengths, self.total = array.array("Q"), array.array("L"), 0
+            self.count_label.setText("")
+            self.highlight_visible()
+            return
+        flags = 0 if self.case_box.isChecked() else re.IGNORECASE
+        try:
+            pattern = re.compile(text if self.regex_box.isChecked() else re.escape(text), flags)
+        except re.error:
+            self.count_label.setText("bad pattern")
+            return
+        self.starts, self.lengths, self.total = self.index.search(pattern)
+        # Start from the last match so the newest output is shown first
+        self.current = len(self.starts) - 1
+        self._show_current()
+
+    def step(self, delta):
+        if not len(self.starts):
+            return
+        self.current = (self.current + delta) % len(self.starts)
+        self._show_current()
+
+    def _show_current(self):
+        if self.current >= 0:
+            cursor = QTextCursor(self.edit.document())
+            cursor.setPosition(min(self.starts[self.current], self.edit.document().characterCount() - 1))
+            self.edit.setTextCursor(cursor)
+            self.edit.ensureCursorVisible()
+        shown = f"{self.total:,}" if self.total <= len(self.starts) else f"{len(self.starts):,}+"
+        self.count_label.setText(f"{self.current + 1:,}/{shown}" if self.total else "no matches")
+        self.highlight_visible()
+
+    def highlight_visible(self, *_):
+        if self.edit is None:
+            return
+        viewport = self.edit.viewport()
+        first = self.edit.cursorForPosition(viewport.rect().topLeft()).position()
+        last = self.edit.cursorForPosition(viewport.rect().bottomRight()).position()
+        lo = bisect.bisect_left(self.starts, max(0, first - 1000))
+        hi = bisect.bisect_right(self.starts, last)
+        limit = self.edit.document().characterCount() - 1
+        selections = []
+        for i in range(lo, hi):
+            sel = QTextEdit.ExtraSelection()
+            current = i == self.current
+            sel.format.setBackground(QColor("#8a6d1a" if current else "#44475a"))
+            if current:
+                sel.format.setForeground(QColor(MopsTerminal.COLORS["white"]))
+            cursor = QTextCursor(self.edit.document())
+            cursor.setPosition(min(self.starts[i], limit))
+            cursor.setPosition(min(self.starts[i] + self.lengths[i], limit), QTextCursor.KeepAnchor)
+            sel.cursor = cursor
+            selections.append(sel)
+        self.edit.setExtraSelections(selections)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.KeyPress:
+            if event.key() == Qt.Key_Escape:
+                self.close_bar()
+                return True
+            if event.key() in (Qt.Key_Return, Qt.Key_Enter):
+                if self._debounce.isActive():
+                    self._debounce.stop()
+                    self.search()
+                else:
+                    self.step(1 if event.modifiers() & Qt.ShiftModifier else -1)
+                return True
+        return super().eventFilter(obj, event)
+
+
+class SessionLogger:
+    """Archives session records as JSON lines from a background writer thread.
+
+    The GUI thread only does a non-blocking put into a bounded queue. When
+    the queue is full the record is counted and dropped, and the writer
+    emits a single "lost N records" marker once it catches up. The file is
+    flushed every ``flush_interval`` rather than after every batch. Segments
+    are rotated by size or age, and closed segments are gzip-compressed off
+    the writer thread. ``close`` waits a bounded time for the writer, so
+    closing the window never hangs on a slow disk.
+    """
+
+    def __init__(self, directory, max_bytes=8 * 1024 * 1024, max_age=3600, queue_size=10000, flush_interval=0.5):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        self.prefix = f"session-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.segment = 0
+        self.written = 0
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._fh = None
+        self._opened_at = 0.0
+        self._flushed_at = 0.0
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"{self.prefix}.{self.segment:03d}.jsonl")
+
+    def log(self, kind, **fields):
+        """Queue a record without ever blocking the caller."""
+        fields["ts"] = round(time.time(), 3)
+        fields["kind"] = kind
+        try:
+            self._queue.put_nowait(fields)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+                while len(batch) < 1000:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if None in batch:
+                stop = True
+                batch = [r for r in batch if r is not None]
+            with self._dropped_lock:
+                lost, self.dropped = self.dropped, 0
+            if lost:
+                batch.insert(0, {"ts": round(time.time(), 3), "kind": "lost", "count": lost})
+            if batch:
+                try:
+                    self._write(batch)
+                except OSError:
+                    # Disk full or the directory gone: the next 'lost' marker counts this batch too
+                    with self._dropped_lock:
+                        self.dropped += len(batch) - 1 + lost if lost else len(batch)
+                    self._abandon_segment()
+            try:
+                # get() wakes at least every flush_interval, busy or not
+                if self._fh is not None and time.time() - self._flushed_at >= self.flush_interval:
+                    self._fh.flush()
+                    self._flushed_at = time.time()
+            except OSError:
+                pass
+        self._close_segment(compress=False)
+
+    def _write(self, batch):
+        if self._fh is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._fh = open(self.path, "ab", buffering=256 * 1024)
+            self._opened_at = self._flushed_at = time.time()
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in batch)
+        self._fh.write(data.encode("utf-8", errors="replace"))
+        self.written += len(batch)
+        if self._fh.tell() >= self.max_bytes or time.time() - self._opened_at >= self.max_age:
+            self._close_segment(compress=True)
+            self.segment += 1
+
+    def _close_segment(self, compress):
+        if self._fh is None:
+            return
+        self._fh.close()
+        self._fh = None
+        if compress:
+            threading.Thread(target=self._compress, args=(self.path,), daemon=True).start()
+
+    def _abandon_segment(self):
+        """Drop a handle that failed; the next batch reopens the segment."""
+        fh, self._fh = self._fh, None
+        if fh is not None:
+            try:
+                fh.close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _compress(path):
+        import gzip
+        import shutil
+        try:
+            # Renamed into place when complete: an exit mid-compression leaves the plain segment
+            with open(path, "rb") as src, gzip.open(path + ".gz.tmp", "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(path + ".gz.tmp", path + ".gz")
+            os.remove(path)
+        except OSError:
+            pass
+
+    def close(self, timeout=1.0):
+        """Stop the writer, waiting at most ``timeout`` seconds in all."""
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(max(0.0, deadline - time.monotonic()))
+
+
+class SessionRecorder:
+    """Writes a compact binary recording of everything rendered in the main pane.
+
+    Layout: an 8-byte magic plus the start time, then a stream of events
+    (``<IBBI`` = milliseconds since start, kind, color index, payload length)
+    followed by their UTF-8 payload. Every KEYFRAME_INTERVAL ms (or after
+    KEYFRAME_BYTES of output) a keyframe event carries a zlib-compressed
+    snapshot of the scrollback tail, so replay can seek by rendering one
+    snapshot instead of everything before it. On stop a footer holds the
+    keyframe index as two columns (times, offsets).
+    """
+
+    MAGIC = b"MOPSREC\x01"
+    INDEX_MAGIC = b"MOPSIDX\x01"
+    EVENT = struct.Struct("<IBBI")
+    FOOTER = struct.Struct("<QI8s")
+    OUTPUT, COMMAND, KEYFRAME = 1, 2, 3
+    COLORS = ("default", "cyan", "green", "red", "yellow", "white", "gray", "black")
+    KEYFRAME_INTERVAL = 30000
+    KEYFRAME_BYTES = 512 * 1024
+    SNAPSHOT_CHARS = 64 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self.fh = open(path, "wb", buffering=1024 * 1024)
+        self.start = time.time()
+        self.fh.write(self.MAGIC + struct.pack("<d", self.start))
+        self.events = 0
+        self.index_times = array.array("I")
+        self.index_offsets = array.array("Q")
+        self._tail = collections.deque()
+        self._tail_chars = 0
+        self._since_keyframe = 0
+        self._keyframe(0)
+
+    def elapsed_ms(self):
+        return int((time.time() - self.start) * 1000)
+
+    def output(self, text, color):
+        now = self.elapsed_ms()
+        if self._since_keyframe >= self.KEYFRAME_BYTES or now - self.index_times[-1] >= self.KEYFRAME_INTERVAL:
+            self._keyframe(now)
+        color_id = self.COLORS.index(color) if color in self.COLORS else 0
+        data = text.encode("utf-8", "replace")
+        self._write(now, self.OUTPUT, color_id, data)
+        self._since_keyframe += len(data)
+        self._tail.append((color_id, text))
+        self._tail_chars += len(text)
+        while self._tail_chars > self.SNAPSHOT_CHARS and len(self._tail) > 1:
+            self._tail_chars -= len(self._tail.popleft()[1])
+
+    @classmethod
+    def pack_runs(cls, runs):
+        """Serialize (color name, text) runs as color id, length, UTF-8 text."""
+        out = bytearray()
+        for color, text in runs:
+            data = text.encode("utf-8", "replace")
+            out += struct.pack("<BI", cls.COLORS.index(color) if color in cls.COLORS else 0, len(data)) + data
+        return bytes(out)
+
+    def command(self, cmd):
+        self._write(self.elapsed_ms(), self.COMMAND, 0, cmd.encode("utf-8", "replace"))
+
+    def _write(self, ms, kind, color_id, data):
+        self.fh.write(self.EVENT.pack(ms, kind, color_id, len(data)))
+        self.fh.write(data)
+        self.events += 1
+
+    def _keyframe(self, ms):
+        self.index_times.append(ms)
+        self.index_offsets.append(self.fh.tell())
+        snapshot = self.pack_runs((self.COLORS[color_id], text) for color_id, text in self._tail)
+        self._write(ms, self.KEYFRAME, 0, zlib.compress(snapshot, 6))
+        self._since_keyframe = 0
+
+    def close(self):
+        index_offset = self.fh.tell()
+        self.fh.write(self.index_times.tobytes())
+        self.fh.write(self.index_offsets.tobytes())
+        self.fh.write(self.FOOTER.pack(index_offset, len(self.index_times), self.INDEX_MAGIC))
+        self.fh.close()
+        return self.elapsed_ms()
+
+
+class RecordingReader:
+    """Random access over a SessionRecorder file via its keyframe index.
+
+    Recordings that were never stopped cleanly have no footer; their index
+    is rebuilt by skipping over event headers.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fh = open(path, "rb")
+        header = self.fh.read(16)
+        if len(header) < 16 or header[:8] != SessionRecorder.MAGIC:
+            self.fh.close()
+            raise ValueError("not a mops recording")
+        self.start = struct.unpack("<d", header[8:])[0]
+        self.size = os.fstat(self.fh.fileno()).st_size
+        self.index_times = array.array("I")
+        self.index_offsets = array.array("Q")
+        if not self._read_footer():
+            self._rebuild_index()
+        self.duration_ms = self._duration()
+
+    def _read_footer(self):
+        footer = SessionRecorder.FOOTER
+        if self.size < 16 + footer.size:
+            return False
+        self.fh.seek(self.size - footer.size)
+        index_offset, count, magic = footer.unpack(self.fh.read(footer.size))
+        if magic != SessionRecorder.INDEX_MAGIC:
+            return False
+        self.fh.seek(index_offset)
+        self.index_times.frombytes(self.fh.read(4 * count))
+        self.index_offsets.frombytes(self.fh.read(8 * count))
+        self.end = index_offset
+        return True
+
+    def _rebuild_index(self):
+        event = SessionRecorder.EVENT
+        offset = 16
+        self.fh.seek(offset)
+        while True:
+            head = self.fh.read(event.size)
+            if len(head) < event.size:
+                break
+            ms, kind, _, length = event.unpack(head)
+            if offset + event.size + length > self.size:
+                break
+            if kind == SessionRecorder.KEYFRAME:
+                self.index_times.append(ms)
+                self.index_offsets.append(offset)
+            offset += event.size + length
+            self.fh.seek(offset)
+        self.end = offset
+
+    def _duration(self):
+        last = 0
+        for ms, _, _, _ in self.events(self.index_offsets[-1] if self.index_offsets else 16):
+            last = ms
+        return last
+
+    def events(self, offset):
+        """Yield (ms, kind, color, payload) from a byte offset to the end of the event stream."""
+        event = SessionRecorder.EVENT
+        fh = open(self.path, "rb", buffering=256 * 1024)
+        try:
+            fh.seek(offset)
+            while offset < self.end:
+                head = fh.read(event.size)
+                if len(head) < event.size:
+                    break
+                ms, kind, color_id, length = event.unpack(head)
+                payload = fh.read(length)
+                offset += event.size + length
+                yield ms, kind, SessionRecorder.COLORS[color_id], payload
+        finally:
+            fh.close()
+
+    def keyframe_for(self, ms):
+        """Offset of the last keyframe at or before ``ms``."""
+        i = max(bisect.bisect_right(self.index_times, ms) - 1, 0)
+        return self.index_offsets[i]
+
+    @staticmethod
+    def snapshot_runs(payload):
+        data = zlib.decompress(payload)
+        pos = 0
+        while pos < len(data):
+            color_id, length = struct.unpack_from("<BI", data, pos)
+            pos += 5
+            yield SessionRecorder.COLORS[color_id], data[pos:pos + length].decode("utf-8", "replace")
+            pos += length
+
+    def close(self):
+        self.fh.close()
+
+
+class SessionReplay(QObject):
+    """Plays a recording back through a render callback on a timer.
+
+    Seeking renders the nearest keyframe snapshot and fast-forwards only
+    the events after it; playback then follows the recorded timestamps,
+    scaled by ``speed``.
+    """
+
+    def __init__(self, reader, render, speed=1.0, start_ms=0, on_finished=None, parent=None):
+        super().__init__(parent)
+        self.reader = reader
+        self.render = render
+        self.speed = speed
+        self.on_finished = on_finished
+        self.position = start_ms
+        self._events = None
+        self._pending = None
+        self._timer = QTimer(self)
+        self._timer.setInterval(20)
+        self._timer.timeout.connect(self._tick)
+
+    def start(self):
+        self.seek(self.position)
+        self._clock = time.monotonic()
+        self._base = self.position
+        self._timer.start()
+
+    def seek(self, ms):
+        self._events = self.reader.events(self.reader.keyframe_for(ms))
+        self._pending = None
+        self._emit_until(ms, snapshot=True)
+        self.position = ms
+
+    def _emit_until(self, ms, snapshot=False):
+        run_color, run = None, []
+        for event in self._iter_events():
+            when, kind, color, payload = event
+            if when > ms:
+                self._pending = event
+                break
+            if kind == SessionRecorder.KEYFRAME:
+                if not snapshot:
+                    continue
+                # A later keyframe supersedes what has been buffered so far
+                run_color, run = None, []
+                for snap_color, text in RecordingReader.snapshot_runs(payload):
+                    if snap_color != run_color and run:
+                        self.render("".join(run), run_color)
+                        run = []
+                    run_color = snap_color
+                    run.append(text)
+                snapshot = False
+                continue
+            if kind != SessionRecorder.OUTPUT:
+                continue
+            if color != run_color and run:
+                self.render("".join(run), run_color)
+                run = []
+            run_color = color
+            run.append(payload.decode("utf-8", "replace"))
+        else:
+            self._events = None
+        if run:
+            self.render("".join(run), run_color)
+
+    def _iter_events(self):
+        # chain() rather than a generator so breaking out keeps the file iterator open
+        pending, self._pending = self._pending, None
+        rest = self._events if self._events is not None else ()
+        return itertools.chain((pending,), rest) if pending is not None else iter(rest)
+
+    def _tick(self):
+        target = self._base + (time.monotonic() - self._clock) * 1000 * self.speed
+        self._emit_until(target)
+        self.position = min(target, self.reader.duration_ms)
+        if self._events is None and self._pending is None:
+            self.stop()
+
+    def stop(self):
+        if not self._timer.isActive():
+            return
+        self._timer.stop()
+        self._events = self._pending = None
+        self.reader.close()
+        if self.on_finished:
+            self.on_finished(self)
+
+
+class SessionStore:
+    """Compact on-disk snapshot of a terminal session.
+
+    The file starts with a small JSON header (cwd, layout, toggles,
+    history) so startup only has to read a few KB; the scrollback follows
+    as zlib-compressed color runs and is loaded separately, off the GUI
+    thread. Writes go to a temp file and are swapped in atomically.
+    """
+
+    MAGIC = b"MOPSSES\x01"
+    LENGTH = struct.Struct("<I")
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def save(self, state, main_runs, secondary_text):
+        blobs = [json.dumps(state).encode("utf-8"),
+                 zlib.compress(SessionRecorder.pack_runs(main_runs), 6),
+                 zlib.compress(secondary_text.encode("utf-8", "replace"), 6)]
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with self._lock:
+            with open(tmp, "wb") as f:
+                f.write(self.MAGIC)
+                for blob in blobs:
+                    f.write(self.LENGTH.pack(len(blob)))
+                    f.write(blob)
+            os.replace(tmp, self.path)
+
+    def save_async(self, state, main_runs, secondary_text):
+        threading.Thread(target=self._save_quietly, args=(state, main_runs, secondary_text), daemon=True).start()
+
+    def _save_quietly(self, *args):
+        try:
+            self.save(*args)
+        except OSError:
+            pass
+
+    def _read_blob(self, f):
+        head = f.read(self.LENGTH.size)
+        if len(head) < self.LENGTH.size:
+            raise ValueError("truncated session file")
+        return f.read(self.LENGTH.unpack(head)[0])
+
+    def load_state(self):
+        """Read just the header; returns None when there is no usable session."""
+        try:
+            with open(self.path, "rb") as f:
+                if f.read(len(self.MAGIC)) != self.MAGIC:
+                    return None
+                return json.loads(self._read_blob(f).decode("utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def load_scrollback(self):
+        """Return (main color runs, secondary text) from the body of the file."""
+        with open(self.path, "rb") as f:
+            f.read(len(self.MAGIC))
+            self._read_blob(f)
+            main = list(RecordingReader.snapshot_runs(self._read_blob(f)))
+            secondary = zlib.decompress(self._read_blob(f)).decode("utf-8", "replace")
+        return main, secondary
+
+    def clear(self):
+        with self._lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class FavoritesStore:
+    """Favorite commands in a small SQLite database shared by all windows.
+
+    Each favorite has a stable, unique name plus use count and last-used
+    time, which feed a frecency score (uses decayed with a one-week
+    half-life). SQLite in WAL mode makes every change an atomic,
+    incremental transaction, so concurrent windows never clobber each
+    other. The rows are kept in memory and only read again after a write
+    here or a commit by another connection (``PRAGMA data_version``). A
+    legacy ``~/.mops_favorites.json`` is imported on first open.
+    """
+
+    HALF_LIFE = 7 * 24 * 3600
+
+    def __init__(self, path, legacy_json=None):
+        import sqlite3
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=5.0)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS favorites (
+                name TEXT PRIMARY KEY,
+                command TEXT NOT NULL,
+                uses INTEGER NOT NULL DEFAULT 0,
+                last_used REAL,
+                created REAL NOT NULL)""")
+        self._rows = None
+        self._commands = None
+        self._version = None
+        if legacy_json and os.path.exists(legacy_json) and not self.db.execute("SELECT 1 FROM favorites LIMIT 1").fetchone():
+            self._import_json(legacy_json)
+
+    def _import_json(self, path):
+        try:
+            with open(path, "r") as f:
+                legacy = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO favorites (name, command, created) VALUES (?, ?, ?)",
+                                [(str(k), str(v), now) for k, v in legacy.items()])
+
+    def add(self, command, name=None):
+        """Store a command and return its name; re-adding a command keeps its existing name."""
+        row = self.db.execute("SELECT name FROM favorites WHERE command = ?", (command,)).fetchone()
+        if row and not name:
+            return row[0]
+        base = name or re.sub(r"[^\w.-]+", "-", command.split()[0]).strip("-").lower() or "fav"
+        with self.db:
+            if name:
+                self.db.execute("INSERT OR REPLACE INTO favorites (name, command, uses, last_used, created) "
+                                "VALUES (?, ?, COALESCE((SELECT uses FROM favorites WHERE name = ?), 0), "
+                                "(SELECT last_used FROM favorites WHERE name = ?), ?)",
+                                (name, command, name, name, time.time()))
+            else:
+                taken = {r[0] for r in self.db.execute("SELECT name FROM favorites WHERE name = ? OR name LIKE ?",
+                                                       (base, base + "-%"))}
+                name, n = base, 2
+                while name in taken:
+                    name, n = f"{base}-{n}", n + 1
+                self.db.execute("INSERT INTO favorites (name, command, created) VALUES (?, ?, ?)",
+                                (name, command, time.time()))
+        self._rows = None
+        return name
+
+    def remove(self, name):
+        with self.db:
+            removed = self.db.execute("DELETE FROM favorites WHERE name = ?", (name,)).rowcount
+        self._rows = None
+        return bool(removed)
+
+    def get(self, name):
+        return next((command for n, command, *_ in self._load() if n == name), None)
+
+    def touch(self, command):
+        """Record a use of every favorite with this exact command text."""
+        with self.db:
+            self.db.execute("UPDATE favorites SET uses = uses + 1, last_used = ? WHERE command = ?", (time.time(), command))
+        self._rows = None
+
+    def _load(self):
+        """The cached rows; re-read after our own writes or a commit by another connection."""
+        version = self.db.execute("PRAGMA data_version").fetchone()[0]
+        if self._rows is None or version != self._version:
+            self._rows = self.db.execute("SELECT name, command, uses, last_used, created FROM favorites").fetchall()
+            self._commands = {row[1] for row in self._rows}
+            self._version = version
+        return self._rows
+
+    def is_favorite_command(self, command):
+        self._load()
+        return command in self._commands
+
+    def ranked(self):
+        """[(name, command, uses, last_used, score)] ordered by frecency."""
+        now = time.time()
+        rows = []
+        for name, command, uses, last_used, created in self._load():
+            age = now - (last_used or created)
+            rows.append((name, command, uses, last_used, (1 + uses) * 0.5 ** (age / self.HALF_LIFE)))
+        rows.sort(key=lambda r: r[4], reverse=True)
+        return rows
+
+    def close(self):
+        self.db.close()
+
+
+class ResultCache:
+    """Memoizes the output of slow, idempotent commands like systeminfo.
+
+    Entries are keyed by (command line, cwd) and expire after the TTL of
+    the first policy pattern (fnmatch, case-insensitive) that matches the
+    command; commands matching no policy, and any command with a
+    redirection, pipe or command separator, are never cached. Entries are
+    evicted least-recently-used first once their total size passes
+    ``max_bytes``.
+    """
+
+    DEFAULT_POLICIES = [
+        ("systeminfo*", 600),
+        # Only the read-only forms: /release, /renew and /flushdns must always run
+        ("ipconfig", 60),
+        ("ipconfig /all", 60),
+        ("whoami*", 3600),
+        ("hostname", 3600),
+        ("ver", 3600),
+        ("getmac*", 600),
+        ("uname*", 3600),
+        ("lsb_release*", 3600),
+    ]
+
+    # Defaults from older versions that saved configs may still carry
+    RETIRED_POLICIES = [("ipconfig*", 60)]
+
+    def __init__(self, max_bytes=4 * 1024 * 1024, policies=None):
+        self.max_bytes = max_bytes
+        self.policies = list(self.DEFAULT_POLICIES if policies is None else policies)
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(cmd):
+        return " ".join(cmd.split())
+
+    def ttl_for(self, cmd):
+        import fnmatch
+        if re.search(r"[<>|&;]", cmd):
+            return None
+        low = self.normalize(cmd).lower()
+        for pattern, ttl in self.policies:
+            if fnmatch.fnmatchcase(low, pattern.lower()):
+                return ttl or None
+        return None
+
+    def set_policy(self, pattern, ttl):
+        """Add or replace a pattern's TTL; a TTL of 0 removes the pattern."""
+        self.policies = [(p, t) for p, t in self.policies if p.lower() != pattern.lower()]
+        if ttl > 0:
+            # Newest policy wins over older, broader ones
+            self.policies.insert(0, (pattern, ttl))
+
+    def get(self, cmd, cwd):
+        """Return (chunks, returncode, age seconds) for a live entry, else None."""
+        key = (self.normalize(cmd), cwd)
+        entry = self.entries.get(key)
+        ttl = self.ttl_for(cmd)
+        if entry is None or ttl is None or time.time() - entry[2] > ttl:
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0], entry[1], time.time() - entry[2]
+
+    def put(self, cmd, cwd, chunks, returncode):
+        size = sum(len(text) for _, text in chunks)
+        if size > self.max_bytes // 4:
+            return
+        key = (self.normalize(cmd), cwd)
+        if key in self.entries:
+            self._drop(key)
+        self.entries[key] = (list(chunks), returncode, time.time(), size)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._drop(next(iter(self.entries)))
+
+    def _drop(self, key):
+        self.size -= self.entries.pop(key)[3]
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+
+# ──────────────────  path index behind 'find'  ──────────────────
+class PathIndex:
+    """On-disk index of the file and directory names under a set of roots.
+
+    ``dirs`` maps every indexed directory to ``(mtime_ns, file names,
+    subdirectory names)``. A refresh walks the roots on a thread pool but
+    only lists directories whose mtime changed, so keeping the index current
+    costs one ``stat`` per directory. Searches run against a snapshot in which
+    all names are joined into one newline-separated string, so a pattern is a
+    single regex pass however many paths there are.
+    """
+
+    VERSION = 1
+    SKIP_DIRS = {".git", ".hg", ".svn", "node_modules", "__pycache__", "$RECYCLE.BIN", "System Volume Information"}
+    MAX_CANDIDATES = 20000
+
+    def __init__(self, path, roots=None):
+        self.path = path
+        self.roots = roots or [os.path.expanduser("~")]
+        self.dirs = {}
+        self.snapshot = None
+        self.state = "empty"
+        self.refreshed_at = None
+        self.loaded = False
+        self._again = False
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # ---- persistence ----
+    def load(self):
+        """Read the index file; a missing, unreadable or corrupt file leaves the index empty.
+
+        ``loaded`` is only set once this returns, so roots changed meanwhile are not overwritten.
+        """
+        try:
+            return self._load()
+        finally:
+            self.loaded = True
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                blob = zlib.decompress(f.read()).decode("utf-8", "surrogateescape")
+        except (OSError, zlib.error):
+            return False
+        header, _, body = blob.partition("\n")
+        try:
+            meta = json.loads(header)
+        except ValueError:
+            return False
+        if not isinstance(meta, dict) or meta.get("version") != self.VERSION:
+            return False
+        dirs = {}
+        try:
+            for record in body.split("\n"):
+                if not record:
+                    continue
+                fields = record.split("\0")
+                dirs[fields[0]] = (int(fields[1]), tuple(n for n in fields[2:] if n[-1:] != "/"),
+                                   tuple(n[:-1] for n in fields[2:] if n[-1:] == "/"))
+        except (ValueError, IndexError):
+            # Truncated or corrupt record: rebuild from scratch on the next refresh
+            return False
+        self.roots = meta.get("roots") or self.roots
+        self.refreshed_at = meta.get("refreshed_at")
+        self.dirs = dirs
+        self.snapshot = self._build(dirs)
+        return True
+
+    def save(self):
+        header = json.dumps({"version": self.VERSION, "roots": self.roots, "refreshed_at": self.refreshed_at})
+        records = ["\0".join([path, str(mtime), *files, *(d + "/" for d in subdirs)])
+                   for path, (mtime, files, subdirs) in self.dirs.items()]
+        data = zlib.compress("\n".join([header] + records).encode("utf-8", "surrogateescape"), 1)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+    # ---- refresh ----
+    def refresh_async(self):
+        """Load (first time) and refresh in a background thread; no-op while one is running."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                # Roots may have changed mid-walk: go round once more when it ends
+                self._again = True
+                return False
+            self._thread = threading.Thread(target=self._refresh_worker, daemon=True)
+            self._thread.start()
+            return True
+
+    def busy(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _refresh_worker(self):
+        try:
+            if not self.loaded:
+                self.state = "loading"
+                self.load()
+            while True:
+                with self._lock:
+                    self._again = False
+                self.state = "refreshing"
+                dirs, changed = self._walk()
+                if changed or len(dirs) != len(self.dirs) or self.snapshot is None:
+                    self.dirs = dirs
+                    self.snapshot = self._build(dirs)
+                self.refreshed_at = time.time()
+                self.save()
+                # Decided under the lock: a later refresh_async starts a new worker instead
+                with self._lock:
+                    if not self._again:
+                        self.state = "ready"
+                        self._thread = None
+                        return
+        except Exception as e:
+            self.state = f"error: {e}"
+
+    def _scan(self, path):
+        """Return (path, entry, listed) where entry is reused if the directory is unchanged."""
+        mtime = os.stat(path).st_mtime_ns
+        old = self.dirs.get(path)
+        if old is not None and old[0] == mtime:
+            return path, old, False
+        files, subdirs = [], []
+        with os.scandir(path) as it:
+            for entry in it:
+                if "\n" in entry.name:
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    else:
+                        files.append(entry.name)
+                except OSError:
+                    pass
+        return path, (mtime, tuple(files), tuple(subdirs)), True
+
+    def _walk(self):
+        import concurrent.futures
+        dirs, changed = {}, 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=16) as pool:
+            pending = {pool.submit(self._scan, root) for root in self.roots if os.path.isdir(root)}
+            while pending:
+                finished, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    try:
+                        path, entry, listed = future.result()
+                    except OSError:
+                        continue
+                    dirs[path] = entry
+                    changed += listed
+                    for name in entry[2]:
+                        if name not in self.SKIP_DIRS:
+                            pending.add(pool.submit(self._scan, os.path.join(path, name)))
+        return dirs, changed
+
+    @staticmethod
+    def _build(dirs):
+        """Flatten ``dirs`` into (names blob, lowercased blob, line starts, owning dir ids, is-dir flags, dir paths)."""
+        names, owners, kinds, paths = [], array.array("I"), bytearray(), []
+        for dir_id, (path, (_, files, subdirs)) in enumerate(dirs.items()):
+            paths.append(path)
+            names.extend(files)
+            names.extend(subdirs)
+            owners.extend(itertools.repeat(dir_id, len(files) + len(subdirs)))
+            kinds.extend(bytes(len(files)))
+            kinds.extend(b"\1" * len(subdirs))
+        starts = array.array("Q", itertools.accumulate((len(n) + 1 for n in names), initial=0))
+        blob = "\n".join(names) + "\n"
+        lower = blob.lower()
+        if len(lower) != len(blob):
+            # A few characters lowercase to two code points; keep those names as they are
+            lower = "\n".join(n.lower() if len(n.lower()) == len(n) else n for n in names) + "\n"
+        return blob, lower, starts, owners, kinds, paths
+
+    # ---- search ----
+    @staticmethod
+    def _matching_lines(lower, starts, pattern):
+        """Yield (kind, line) for names matching the lowercased ``pattern``, best kind first.
+
+        Plain substring hits are found with ``str.find``; a glob's longest literal
+        fragment is found the same way and only those names are matched in full.
+        The fuzzy pass (letters in order) follows a ``(kind, -1)`` marker; its
+        regex uses negated classes (``a[^\\nb]*b``) so it never backtracks.
+        """
+        glob = "*" in pattern or "?" in pattern
+        if glob:
+            regex = re.compile("".join("[^\n]*" if c == "*" else "[^\n]" if c == "?" else re.escape(c) for c in pattern))
+            literal = max(re.split(r"[*?]", pattern), key=len)
+            if not literal:
+                for m in re.finditer(f"^{regex.pattern}$", lower, re.MULTILINE):
+                    yield "glob", bisect.bisect_right(starts, m.start()) - 1
+                return
+        else:
+            literal = pattern
+        pos = lower.find(literal)
+        while pos >= 0:
+            line = bisect.bisect_right(starts, pos) - 1
+            if not glob or regex.fullmatch(lower, starts[line], starts[line + 1] - 1):
+                yield "glob" if glob else "name", line
+            pos = lower.find(literal, starts[line + 1])
+        if glob:
+            return
+        yield "fuzzy", -1
+        fuzzy = re.escape(pattern[0]) + "".join(f"[^\n{re.escape(c)}]*{re.escape(c)}" for c in pattern[1:])
+        for m in re.finditer(fuzzy, lower):
+            yield "fuzzy", bisect.bisect_right(starts, m.start()) - 1
+
+    def search(self, pattern, limit=50, dirs_only=False):
+        """Return (ranked [(path, is_dir)], number of matches) for ``pattern``.
+
+        The last path component is matched against names; any earlier
+        components must appear, in order, in the containing directory.
+        """
+        snap = self.snapshot
+        if snap is None or not pattern:
+            return [], 0
+        blob, lower, starts, owners, kinds, paths = snap
+        parts = [p.lower() for p in re.split(r"[\\/]+", pattern) if p]
+        if not parts:
+            return [], 0
+        name_pattern, dir_parts = parts[-1], parts[:-1]
+        seen, ranked = set(), []
+        for kind, line in self._matching_lines(lower, starts, name_pattern):
+            if line < 0:
+                # Substring hits are done; fuzzy ones are only a fallback
+                if ranked:
+                    break
+                continue
+            if line in seen:
+                continue
+            seen.add(line)
+            if dirs_only and not kinds[line]:
+                continue
+            parent = paths[owners[line]]
+            if dir_parts and not self._in_order(parent.lower(), dir_parts):
+                continue
+            low = lower[starts[line]:starts[line + 1] - 1]
+            score = (kind == "fuzzy", low != name_pattern, not low.startswith(name_pattern), len(low), len(parent))
+            ranked.append((score, line, parent))
+            if len(ranked) >= self.MAX_CANDIDATES:
+                break
+        ranked.sort()
+        return [(os.path.join(parent, blob[starts[line]:starts[line + 1] - 1]), bool(kinds[line]))
+                for _, line, parent in ranked[:limit]], len(ranked)
+
+    @staticmethod
+    def _in_order(text, parts):
+        pos = 0
+        for part in parts:
+            pos = text.find(part, pos)
+            if pos < 0:
+                return False
+            pos += len(part)
+        return True
+
+    def entry_count(self):
+        snap = self.snapshot
+        return len(snap[3]) if snap else 0
+
+
+# ──────────────────  saved Wi-Fi profiles ('wifcode')  ──────────────────
+class WifiBackend:
+    """Source of saved Wi-Fi profiles and their keys.
+
+    Subclasses implement ``profile_names`` and ``read_key`` (``None`` for an
+    open network; ``RuntimeError`` when a profile cannot be read). ``profiles``
+    and ``key`` wrap them in a short-lived cache, so running ``wifcode`` again
+    within ``CACHE_TTL`` seconds does not query the system again. ``key`` is
+    safe to call from several threads at once.
+    """
+
+    name = "wifi"
+    CACHE_TTL = 60.0
+
+    def __init__(self):
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def profile_names(self):
+        raise NotImplementedError
+
+    def read_key(self, profile):
+        raise NotImplementedError
+
+    def _cached(self, key, fetch):
+        with self._lock:
+            hit = self._cache.get(key)
+        if hit is not None and time.monotonic() - hit[0] < self.CACHE_TTL:
+            return hit[1]
+        value = fetch()
+        with self._lock:
+            self._cache[key] = (time.monotonic(), value)
+        return value
+
+    def profiles(self):
+        return self._cached(("profiles",), self.profile_names)
+
+    def key(self, profile):
+        return self._cached(("key", profile), lambda: self.read_key(profile))
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    @staticmethod
+    def _run(args, timeout=10):
+        try:
+            proc = subprocess.run(args, capture_output=True, text=True, timeout=timeout,
+                                  creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise RuntimeError(str(e)) from None
+        if proc.returncode != 0:
+            raise RuntimeError((proc.stderr or proc.stdout).strip() or f"exit {proc.returncode}")
+        return proc.stdout
+
+
+class NetshWifiBackend(WifiBackend):
+    """Windows: ``netsh wlan``, one process per profile lookup."""
+
+    name = "netsh"
+
+    @staticmethod
+    def parse_profiles(text):
+        names = []
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith("All User Profile") or line.startswith("User Profile"):
+                name = line.split(":", 1)[1].strip() if ":" in line else ""
+                if name:
+                    names.append(name)
+        return names
+
+    @staticmethod
+    def parse_key(text):
+        for line in text.splitlines():
+            line = line.strip()
+            if line.lower().startswith("key content") and ":" in line:
+                return line.split(":", 1)[1].strip() or None
+        return None
+
+    def profile_names(self):
+        return self.parse_profiles(self._run(["netsh", "wlan", "show", "profiles"]))
+
+    def read_key(self, profile):
+        return self.parse_key(self._run(["netsh", "wlan", "show", "profile", f"name={profile}", "key=clear"]))
+
+
+class NetworkManagerWifiBackend(WifiBackend):
+    """Linux: NetworkManager keyfiles, or ``nmcli`` when they are not readable.
+
+    ``connections_dir`` and ``nmcli`` default to the class attributes, so a
+    fixture directory or a stand-in ``nmcli`` script can be substituted.
+    """
+
+    name = "NetworkManager"
+    CONNECTIONS_DIR = "/etc/NetworkManager/system-connections"
+    NMCLI = "nmcli"
+    WIFI_TYPES = ("wifi", "802-11-wireless")
+
+    def __init__(self, connections_dir=None, nmcli=None):
+        super().__init__()
+        self.connections_dir = connections_dir or self.CONNECTIONS_DIR
+        self.nmcli = nmcli or self.NMCLI
+        self._keys = None
+
+    @classmethod
+    def parse_keyfile(cls, text):
+        """Return (profile name, key or None) for a Wi-Fi keyfile, or None for anything else."""
+        import configparser
+        parser = configparser.ConfigParser(interpolation=None, strict=False)
+        parser.optionxform = str
+        parser.read_string(text)
+        if parser.get("connection", "type", fallback="") not in cls.WIFI_TYPES:
+            return None
+        name = parser.get("connection", "id", fallback="") or parser.get("wifi", "ssid", fallback="")
+        key = (parser.get("wifi-security", "psk", fallback="") or parser.get("wifi-security", "wep-key0", fallback="")
+               or parser.get("802-1x", "password", fallback=""))
+        return name, key or None
+
+    def _read_keyfiles(self):
+        """Parse every keyfile; ``None`` if the directory or any file is unreadable (root-only)."""
+        keys = {}
+        try:
+            names = sorted(os.listdir(self.connections_dir))
+        except OSError:
+            return None
+        for filename in names:
+            path = os.path.join(self.connections_dir, filename)
+            if not os.path.isfile(path):
+                continue
+            try:
+                with open(path, "r", encoding="utf-8", errors="replace") as f:
+                    parsed = self.parse_keyfile(f.read())
+            except PermissionError:
+                return None
+            except Exception:
+                continue
+            if parsed:
+                keys[parsed[0]] = parsed[1]
+        return keys
+
+    @staticmethod
+    def _split_terse(line):
+        # nmcli -t separates fields with ':' and escapes literal ':' and '\\' with '\\'
+        return [re.sub(r"\\(.)", r"\1", field) for field in re.split(r"(?<!\\):", line)]
+
+    def profile_names(self):
+        self._keys = self._read_keyfiles()
+        if self._keys is not None:
+            self.name = "NetworkManager keyfiles"
+            return list(self._keys)
+        if shutil.which(self.nmcli) is None:
+            raise RuntimeError(f"{self.connections_dir} is not readable and {self.nmcli} was not found")
+        self.name = "nmcli"
+        names = []
+        for line in self._run([self.nmcli, "-t", "-f", "NAME,TYPE", "connection", "show"]).splitlines():
+            fields = self._split_terse(line)
+            if len(fields) == 2 and fields[1] in self.WIFI_TYPES and fields[0]:
+                names.append(fields[0])
+        return names
+
+    def read_key(self, profile):
+        if self._keys is not None and profile in self._keys:
+            return self._keys[profile]
+        out = self._run([self.nmcli, "-s", "-e", "no", "-g", "802-11-wireless-security.psk",
+                         "connection", "show", "id", profile])
+        return out.strip() or None
+
+
+def wifi_backend():
+    """The Wi-Fi backend for this platform, or None where there is none."""
+    if os.name == "nt":
+        return NetshWifiBackend()
+    if sys.platform.startswith("linux"):
+        return NetworkManagerWifiBackend()
+    return None
+
+
+# ──────────────────  calc engine (runs in a worker process)  ──────────────────
+CALC_MAX_ITEMS = 1000000       # largest vector / expanded range
+CALC_MAX_BITS = 1000000        # largest integer power computed
+CALC_MAX_DIGITS = 10000        # largest integer shown
+CALC_MAX_OUTPUT = 10000        # characters of formatted result
+
+
+class CalcRange:
+    """Lazy ``range`` for calc: len/sum/min/max are O(1), arithmetic expands it."""
+
+    def __init__(self, *args):
+        self.r = range(*(_calc_int(a) for a in args))
+
+    def __len__(self):
+        return len(self.r)
+
+    def __iter__(self):
+        return iter(self.r)
+
+    def expand(self):
+        if len(self.r) > CALC_MAX_ITEMS:
+            raise OverflowError(f"range of {len(self.r):,} items is too large to expand")
+        return CalcVector(self.r)
+
+    def __repr__(self):
+        return repr(self.r)
+
+
+class CalcVector(tuple):
+    """Tuple with element-wise arithmetic against scalars and equal-length vectors."""
+
+    def __new__(cls, items):
+        items = tuple(items)
+        if len(items) > CALC_MAX_ITEMS:
+            raise OverflowError(f"vector of {len(items):,} items is too large")
+        return super().__new__(cls, items)
+
+    def _apply(self, other, fn, reflected=False):
+        if isinstance(other, CalcRange):
+            other = other.expand()
+        if isinstance(other, tuple):
+            if len(other) != len(self):
+                raise ValueError(f"vector lengths differ ({len(self)} vs {len(other)})")
+            pairs = zip(other, self) if reflected else zip(self, other)
+            return CalcVector(fn(a, b) for a, b in pairs)
+        return CalcVector(fn(other, a) if reflected else fn(a, other) for a in self)
+
+    def __repr__(self):
+        if len(self) > 20:
+            head = ", ".join(map(_calc_format_scalar, self[:10]))
+            return f"[{head}, … {len(self) - 10:,} more]"
+        return "[" + ", ".join(map(_calc_format_scalar, self)) + "]"
+
+
+def _calc_binary(fn):
+    def forward(self, other):
+        return self._apply(other, fn)
+
+    def reflected(self, other):
+        return self._apply(other, fn, reflected=True)
+    return forward, reflected
+
+
+for _name, _fn in (("add", operator.add), ("sub", operator.sub), ("mul", operator.mul),
+                   ("truediv", operator.truediv), ("floordiv", operator.floordiv), ("mod", operator.mod)):
+    _forward, _reflected = _calc_binary(_fn)
+    setattr(CalcVector, f"__{_name}__", _forward)
+    setattr(CalcVector, f"__r{_name}__", _reflected)
+    setattr(CalcRange, f"__{_name}__", lambda self, other, _f=_forward: _f(self.expand(), other))
+    setattr(CalcRange, f"__r{_name}__", lambda self, other, _r=_reflected: _r(self.expand(), other))
+CalcVector.__neg__ = lambda self: CalcVector(-a for a in self)
+CalcRange.__neg__ = lambda self: -self.expand()
+
+
+def _calc_int(value):
+    from fractions import Fraction
+    from decimal import Decimal
+    if isinstance(value, bool) or not isinstance(value, (int, Fraction, Decimal, float)) or value != int(value):
+        raise TypeError(f"expected an integer, got {value!r}")
+    return int(value)
+
+
+def _calc_pow(base, exp):
+    """``**`` with a size guard so 9**9**9 fails fast instead of hanging."""
+    from fractions import Fraction
+    if isinstance(base, (CalcVector, CalcRange)) or isinstance(exp, (CalcVector, CalcRange)):
+        if isinstance(base, CalcRange):
+            base = base.expand()
+        if isinstance(base, CalcVector):
+            return base._apply(exp, _calc_pow)
+        return exp.expand()._apply(base, _calc_pow, reflected=True) if isinstance(exp, CalcRange) else exp._apply(base, _calc_pow, reflected=True)
+    if isinstance(base, (int, Fraction)) and isinstance(exp, (int, Fraction)) and getattr(exp, "denominator", 1) == 1:
+        size = max(abs(base.numerator).bit_length(), base.denominator.bit_length(), 1)
+        if abs(int(exp)) * size > CALC_MAX_BITS:
+            raise OverflowError("result too large")
+    return base ** exp
+
+
+def _calc_exact(fn, num):
+    """``/`` or ``**`` for the exact modes: int operands that would give a float are promoted to ``num``."""
+    def call(a, b):
+        if isinstance(a, (CalcVector, CalcRange)) or isinstance(b, (CalcVector, CalcRange)):
+            if isinstance(a, CalcRange):
+                a = a.expand()
+            if isinstance(a, CalcVector):
+                return a._apply(b, call)
+            return b.expand()._apply(a, call, reflected=True) if isinstance(b, CalcRange) else b._apply(a, call, reflected=True)
+        if type(a) is int and type(b) is int and (fn is operator.truediv or b < 0):
+            a = num(a)
+        return fn(a, b)
+    return call
+
+
+def _calc_sum(values, start=0):
+    if isinstance(values, CalcRange):
+        r = values.r
+        return start + (len(r) * (r[0] + r[-1]) // 2 if len(r) else 0)
+    return sum(values, start)
+
+
+def _calc_min(*args):
+    if len(args) == 1 and isinstance(args[0], CalcRange):
+        r = args[0].r
+        return min(r[0], r[-1])
+    return min(*args)
+
+
+def _calc_max(*args):
+    if len(args) == 1 and isinstance(args[0], CalcRange):
+        r = args[0].r
+        return max(r[0], r[-1])
+    return max(*args)
+
+
+def _calc_mean(values):
+    if isinstance(values, CalcRange):
+        r = values.r
+        return (r[0] + r[-1]) / 2
+    values = tuple(values)
+    return sum(values) / len(values)
+
+
+def _calc_dot(a, b):
+    return sum(CalcVector(a) * CalcVector(b))
+
+
+def _calc_math(name, fn, decimal_mode):
+    """Wrap a float math function: element-wise on vectors, Decimal-aware in decimal mode."""
+    from decimal import Decimal
+    from fractions import Fraction
+    native = {"sqrt": "sqrt", "exp": "exp", "ln": "ln", "log10": "log10"}.get(name)
+
+    def call(*args):
+        if len(args) == 1 and isinstance(args[0], (CalcVector, CalcRange)):
+            return CalcVector(call(a) for a in args[0])
+        if native and len(args) == 1 and (isinstance(args[0], Decimal) or decimal_mode and type(args[0]) is int):
+            return getattr(Decimal(args[0]), native)()
+        result = fn(*(float(a) if isinstance(a, (Decimal, Fraction)) else a for a in args))
+        return Decimal(repr(result)) if decimal_mode and isinstance(result, float) else result
+    return call
+
+
+# Units are expressed in SI base units, so 'calc 26.2 * mi / km' converts miles to km
+CALC_CONSTANTS = {
+    "pi": (math.pi, "π"), "e": (math.e, "Euler's number"), "tau": (math.tau, "2π"),
+    "inf": (math.inf, "infinity"), "phi": ((1 + 5 ** 0.5) / 2, "golden ratio"),
+    "c": (299792458.0, "speed of light, m/s"), "g0": (9.80665, "standard gravity, m/s²"),
+    "h": (6.62607015e-34, "Planck constant, J·s"), "k_B": (1.380649e-23, "Boltzmann constant, J/K"),
+    "N_A": (6.02214076e23, "Avogadro constant, 1/mol"), "G": (6.6743e-11, "gravitational constant, m³/(kg·s²)"),
+    "q_e": (1.602176634e-19, "elementary charge, C"),
+    "m": (1.0, "metre"), "km": (1e3, "kilometre, m"), "cm": (1e-2, "centimetre, m"), "mm": (1e-3, "millimetre, m"),
+    "inch": (0.0254, "inch, m"), "ft": (0.3048, "foot, m"), "yd": (0.9144, "yard, m"), "mi": (1609.344, "mile, m"),
+    "kg": (1.0, "kilogram"), "lb": (0.45359237, "pound, kg"), "oz": (0.028349523125, "ounce, kg"),
+    "s": (1.0, "second"), "minute": (60.0, "minute, s"), "hour": (3600.0, "hour, s"), "day": (86400.0, "day, s"),
+    "week": (604800.0, "week, s"), "year": (31557600.0, "Julian year, s"),
+    "KB": (1e3, "kilobyte, B"), "MB": (1e6, "megabyte, B"), "GB": (1e9, "gigabyte, B"), "TB": (1e12, "terabyte, B"),
+    "KiB": (1024.0, "kibibyte, B"), "MiB": (1024.0 ** 2, "mebibyte, B"), "GiB": (1024.0 ** 3, "gibibyte, B"),
+    "TiB": (1024.0 ** 4, "tebibyte, B"),
+}
+
+CALC_FLOAT_FUNCTIONS = {
+    "sqrt": math.sqrt, "cbrt": lambda x: math.copysign(abs(x) ** (1 / 3), x), "exp": math.exp,
+    "ln": math.log, "log": math.log, "log2": math.log2, "log10": math.log10,
+    "sin": math.sin, "cos": math.cos, "tan": math.tan, "asin": math.asin, "acos": math.acos, "atan": math.atan,
+    "atan2": math.atan2, "sinh": math.sinh, "cosh": math.cosh, "tanh": math.tanh, "hypot": math.hypot,
+    "degrees": math.degrees, "radians": math.radians,
+}
+
+CALC_FUNCTIONS = {
+    "abs": abs, "round": round, "int": int, "float": float, "hex": hex, "bin": bin, "oct": oct,
+    "floor": math.floor, "ceil": math.ceil, "trunc": math.trunc, "isqrt": math.isqrt, "gcd": math.gcd,
+    "lcm": math.lcm, "factorial": math.factorial, "comb": math.comb, "perm": math.perm,
+    "range": CalcRange, "sum": _calc_sum, "min": _calc_min, "max": _calc_max, "mean": _calc_mean,
+    "prod": math.prod, "len": len, "dot": _calc_dot, "sorted": lambda v: CalcVector(sorted(v)),
+}
+
+
+class _CalcRewriter(ast.NodeTransformer):
+    """Validates a calc statement against a node whitelist and rewrites literals, ** and vectors."""
+
+    ALLOWED = (ast.Expression, ast.Expr, ast.Module, ast.Assign, ast.Name, ast.Load, ast.Store, ast.Constant,
+               ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp, ast.Call, ast.List, ast.Tuple,
+               ast.operator, ast.unaryop, ast.boolop, ast.cmpop)
+
+    def __init__(self, mode):
+        self.mode = mode
+
+    def generic_visit(self, node):
+        if not isinstance(node, self.ALLOWED) or isinstance(node, ast.MatMult):
+            raise SyntaxError(f"'{type(node).__name__}' is not allowed in calc")
+        return super().generic_visit(node)
+
+    def visit_Name(self, node):
+        if node.id.startswith("_"):
+            raise SyntaxError(f"name '{node.id}' is not allowed in calc")
+        return node
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in CALC_FUNCTIONS and node.func.id not in CALC_FLOAT_FUNCTIONS:
+            raise SyntaxError("only calc functions can be called (see 'calc funcs')")
+        if node.keywords:
+            raise SyntaxError("keyword arguments are not supported")
+        node.args = [self.visit(a) for a in node.args]
+        return node
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, (str, bool, int)):
+            return node
+        if not isinstance(node.value, float):
+            raise SyntaxError(f"literal {node.value!r} is not allowed in calc")
+        if self.mode == "float":
+            return node
+        # Exact literals: Decimal('0.1') / Fraction('0.1') rather than the binary float 0.1
+        return ast.Call(func=ast.Name(id="_num", ctx=ast.Load()), args=[ast.Constant(value=repr(node.value))], keywords=[])
+
+    def visit_BinOp(self, node):
+        node = self.generic_visit(node)
+        if isinstance(node.op, ast.Pow):
+            return ast.Call(func=ast.Name(id="_pow", ctx=ast.Load()), args=[node.left, node.right], keywords=[])
+        if isinstance(node.op, ast.Div) and self.mode != "float":
+            # Ints stay ints (hex, factorial, ...), so 1/3 must not become a binary float
+            return ast.Call(func=ast.Name(id="_div", ctx=ast.Load()), args=[node.left, node.right], keywords=[])
+        return node
+
+    def _vector(self, node):
+        node = self.generic_visit(node)
+        return ast.Call(func=ast.Name(id="_vec", ctx=ast.Load()),
+                        args=[ast.List(elts=node.elts, ctx=ast.Load())], keywords=[])
+
+    visit_List = _vector
+    visit_Tuple = _vector
+
+
+@functools.lru_cache(maxsize=256)
+def calc_compile(source, mode):
+    """Parse, validate and compile a calc statement; returns (code, assigned name or None)."""
+    tree = ast.parse(source.strip(), "<calc>", "exec")
+    if len(tree.body) != 1:
+        raise SyntaxError("enter a single expression or assignment")
+    stmt, target = tree.body[0], None
+    if isinstance(stmt, ast.Assign):
+        if len(stmt.targets) != 1 or not isinstance(stmt.targets[0], ast.Name):
+            raise SyntaxError("can only assign to a single name, e.g. x = 3")
+        target = stmt.targets[0].id
+        if target.startswith("_") or target in CALC_FUNCTIONS or target in CALC_FLOAT_FUNCTIONS:
+            raise SyntaxError(f"cannot assign to '{target}'")
+        expr = stmt.value
+    elif isinstance(stmt, ast.Expr):
+        expr = stmt.value
+    else:
+        raise SyntaxError(f"'{type(stmt).__name__}' is not allowed in calc")
+    body = _CalcRewriter(mode).visit(expr)
+    tree = ast.fix_missing_locations(ast.Expression(body=body))
+    return compile(tree, "<calc>", "eval"), target
+
+
+@functools.lru_cache(maxsize=3)
+def calc_namespace(mode):
+    from decimal import Decimal
+    from fractions import Fraction
+    num = {"decimal": Decimal, "fraction": Fraction}.get(mode, float)
+    ns = {"__builtins__": {}, "_pow": _calc_pow, "_vec": CalcVector, "_num": num}
+    if mode != "float":
+        ns["_pow"] = _calc_exact(_calc_pow, num)
+        ns["_div"] = _calc_exact(operator.truediv, num)
+    ns.update(CALC_FUNCTIONS)
+    for name, fn in CALC_FLOAT_FUNCTIONS.items():
+        ns[name] = _calc_math(name, fn, mode == "decimal")
+    for name, (value, _) in CALC_CONSTANTS.items():
+        ns[name] = Decimal(repr(value)) if mode == "decimal" and math.isfinite(value) else value
+    return ns
+
+
+def _calc_format_scalar(value):
+    from fractions import Fraction
+    if isinstance(value, int) and not isinstance(value, bool) and value.bit_length() > CALC_MAX_DIGITS * 3.33:
+        raise OverflowError(f"result has about {int(value.bit_length() * 0.30103):,} digits")
+    if isinstance(value, Fraction) and value.denominator != 1:
+        return f"{value}"
+    if isinstance(value, Fraction):
+        return str(value.numerator)
+    return str(value)
+
+
+def calc_format(value):
+    from fractions import Fraction
+    text = repr(value) if isinstance(value, (CalcVector, CalcRange)) else _calc_format_scalar(value)
+    if isinstance(value, Fraction) and value.denominator != 1:
+        text += f"  (≈ {float(value):.12g})"
+    if len(text) > CALC_MAX_OUTPUT:
+        raise OverflowError(f"result is too long to show ({len(text):,} characters)")
+    return text
+
+
+def calc_evaluate(source, mode, variables):
+    """Evaluate one statement; returns (formatted result, assigned name, value)."""
+    from decimal import localcontext
+    code, target = calc_compile(source, mode)
+    with localcontext() as ctx:
+        ctx.prec = 50
+        value = eval(code, calc_namespace(mode), dict(variables))
+        text = calc_format(value)
+    return text, target, value
+
+
+def _calc_worker_main(conn):
+    """Worker process loop: receive (source, mode, variables), send back a result tuple."""
+    try:
+        import resource
+        limit = 1024 * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except Exception:
+        pass
+    if hasattr(sys, "set_int_max_str_digits"):
+        sys.set_int_max_str_digits(CALC_MAX_DIGITS + 10)
+    while True:
+        try:
+            source, mode, variables = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            text, target, value = calc_evaluate(source, mode, variables)
+            conn.send(("ok", text, target, value))
+        except MemoryError:
+            conn.send(("error", "out of memory", None, None))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}" if not isinstance(e, (SyntaxError, OverflowError)) else str(e), None, None))
+
+
+class CalcWorker:
+    """Owns the calc worker process; a request that overruns ``timeout`` kills it.
+
+    The process is started lazily and restarted on the next request after
+    a timeout or crash. Polling keeps the GUI thread free while it works.
+    """
+
+    def __init__(self, timeout=3.0):
+        self.timeout = timeout
+        self.process = None
+        self.conn = None
+        self.deadline = None
+
+    def submit(self, source, mode, variables):
+        if self.process is None or not self.process.is_alive():
+            ctx = multiprocessing.get_context("spawn")
+            self.conn, child = ctx.Pipe()
+            self.process = ctx.Process(target=_calc_worker_main, args=(child,), daemon=True)
+            self.process.start()
+            child.close()
+            # First request pays for process start-up
+            self.deadline = time.monotonic() + self.timeout + 10
+        else:
+            self.deadline = time.monotonic() + self.timeout
+        self.conn.send((source, mode, variables))
+
+    def poll(self):
+        """None while busy, else ("ok", text, name, value) or ("error", message, None, None)."""
+        try:
+            if self.conn.poll():
+                return self.conn.recv()
+        except (EOFError, OSError):
+            self.stop()
+            return ("error", "calc worker crashed", None, None)
+        if not self.process.is_alive():
+            self.stop()
+            return ("error", "calc worker crashed (memory limit?)", None, None)
+        if time.monotonic() > self.deadline:
+            self.stop()
+            return ("error", f"timed out after {self.timeout:g}s", None, None)
+        return None
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.join(1)
+            self.conn.close()
+        self.process = self.conn = None
+
+
+class _KernelStream:
+    """File-like stdout/stderr for the py kernel that ships text to the terminal in batches.
+
+    ``lock`` is shared by everything sending on ``conn``, including the
+    kernel's flusher thread, which sends whatever a quiet snippet left
+    buffered.
+    """
+
+    def __init__(self, conn, name, lock):
+        self.conn = conn
+        self.name = name
+        self.lock = lock
+        self.parts = []
+        self.size = 0
+        self.last = time.monotonic()
+
+    def write(self, text):
+        if not isinstance(text, str):
+            raise TypeError(f"write() argument must be str, not {type(text).__name__}")
+        with self.lock:
+            self.parts.append(text)
+            self.size += len(text)
+            if self.size >= 8192 or ("\n" in text and time.monotonic() - self.last > 0.02):
+                self._send()
+        return len(text)
+
+    def flush(self):
+        with self.lock:
+            self._send()
+
+    def _send(self):
+        if self.parts:
+            self.conn.send((self.name, "".join(self.parts)))
+            self.parts, self.size = [], 0
+            self.last = time.monotonic()
+
+    def isatty(self):
+        return False
+
+    @property
+    def encoding(self):
+        return "utf-8"
+
+
+def _kernel_run(code, namespace):
+    """exec a snippet; like the REPL, echo the value of a trailing expression."""
+    tree = ast.parse(code, "<py>", "exec")
+    last = None
+    if tree.body and isinstance(tree.body[-1], ast.Expr):
+        last = ast.Expression(body=tree.body.pop().value)
+    exec(compile(tree, "<py>", "exec"), namespace)
+    if last is not None:
+        value = eval(compile(last, "<py>", "eval"), namespace)
+        if value is not None:
+            namespace["_"] = value
+            print(repr(value))
+
+
+def _kernel_main(conn, ctrl):
+    """py kernel process: runs snippets in one persistent namespace."""
+    import traceback
+    import _thread
+    namespace = {"__name__": "__main__", "__builtins__": __builtins__}
+    for module in ("os", "sys", "re", "math", "json", "time", "datetime", "pathlib", "collections", "itertools", "functools"):
+        namespace[module] = __import__(module)
+    lock = threading.Lock()
+    out, err = _KernelStream(conn, "stdout", lock), _KernelStream(conn, "stderr", lock)
+    sys.stdout, sys.stderr = out, err
+
+    def flush_pending():
+        # A line printed just after a flush would otherwise wait for the next write
+        while True:
+            time.sleep(0.05)
+            try:
+                out.flush()
+                err.flush()
+            except (OSError, ValueError):
+                return
+
+    def watch_interrupts():
+        # Windows has no SIGINT for us to send; the parent asks over this pipe instead
+        while True:
+            try:
+                ctrl.recv()
+            except (EOFError, OSError):
+                return
+            _thread.interrupt_main()
+
+    threading.Thread(target=watch_interrupts, daemon=True).start()
+    threading.Thread(target=flush_pending, daemon=True).start()
+    while True:
+        try:
+            message = conn.recv()
+        except KeyboardInterrupt:
+            continue
+        except (EOFError, OSError):
+            return
+        code, cwd = message
+        error = None
+        try:
+            if cwd and os.path.isdir(cwd):
+                os.chdir(cwd)
+            _kernel_run(code, namespace)
+        except KeyboardInterrupt:
+            error = "KeyboardInterrupt"
+        except SystemExit:
+            error = "SystemExit is ignored in the py kernel (use 'py restart')"
+        except BaseException:
+            # Hide the kernel's own frames from the traceback
+            exc = traceback.TracebackException(*sys.exc_info())
+            exc.stack = traceback.StackSummary.from_list([f for f in exc.stack if f.filename != __file__])
+            err.write("".join(exc.format()))
+        try:
+            with lock:
+                out._send()
+                err._send()
+                conn.send(("done", error))
+        except KeyboardInterrupt:
+            with lock:
+                conn.send(("done", "KeyboardInterrupt"))
+
+
+class PythonKernel:
+    """A persistent Python worker process for the ``py`` builtin.
+
+    Started lazily on the first snippet and again after a crash or restart.
+    Output arrives as ("stdout"|"stderr", text) messages that the owner
+    polls from the GUI thread; ``interrupt`` raises KeyboardInterrupt in the
+    running snippet and escalates to a restart if the code does not stop.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.process = None
+        self.conn = None
+        self.ctrl = None
+        self.busy = False
+        self.started = None
+        self.interrupted_at = None
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def run(self, code, cwd):
+        if not self.alive:
+            ctx = multiprocessing.get_context("spawn")
+            self.conn, child = ctx.Pipe()
+            self.ctrl, child_ctrl = ctx.Pipe()
+            self.process = ctx.Process(target=_kernel_main, args=(child, child_ctrl), daemon=True,
+                                       name=f"mops-py-{self.name}")
+            self.process.start()
+            child.close()
+            child_ctrl.close()
+            self.started = time.time()
+        self.conn.send((code, cwd))
+        self.busy = True
+        self.interrupted_at = None
+
+    def poll(self, limit=200):
+        """Return up to ``limit`` messages; ("done", error) ends a snippet, ("died", msg) the process."""
+        messages = []
+        if self.conn is None:
+            return messages
+        try:
+            while len(messages) < limit and self.conn.poll():
+                message = self.conn.recv()
+                messages.append(message)
+                if message[0] == "done":
+                    self.busy = False
+                    break
+        except (EOFError, OSError):
+            pass
+        if self.busy and not messages and not self.alive:
+            code = self.process.exitcode
+            self.stop()
+            messages.append(("died", f"py kernel exited (code {code}); state was lost"))
+        elif self.busy and self.interrupted_at and time.monotonic() - self.interrupted_at > 3:
+            self.stop()
+            messages.append(("died", "py kernel did not stop; restarted it (state was lost)"))
+        return messages
+
+    def interrupt(self):
+        if not self.busy or not self.alive:
+            return False
+        if os.name == "nt":
+            self.ctrl.send("interrupt")
+        else:
+            os.kill(self.process.pid, signal.SIGINT)
+        self.interrupted_at = time.monotonic()
+        return True
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.join(1)
+            self.conn.close()
+            self.ctrl.close()
+        self.process = self.conn = self.ctrl = None
+        self.busy = False
+
+
+class PerfTracer:
+    """Ring buffer of per-command timing spans, exportable as a Chrome trace.
+
+    Disabled by default: ``begin`` then returns None and every hook is a
+    single ``if rec`` test. Times are ``time.perf_counter`` seconds.
+    """
+
+    PHASES = ("dispatch", "spawn", "first_byte", "last_byte", "render", "completer", "total")
+
+    def __init__(self, capacity=500):
+        self.enabled = False
+        self.records = collections.deque(maxlen=capacity)
+        self.origin = time.perf_counter()
+        self._next_id = 1
+
+    def begin(self, cmd):
+        if not self.enabled:
+            return None
+        rec = {"id": self._next_id, "cmd": cmd, "start": time.perf_counter(), "end": None,
+               "spans": [], "marks": {}, "render": 0.0, "render_calls": 0}
+        self._next_id += 1
+        self.records.append(rec)
+        return rec
+
+    @staticmethod
+    def span(rec, name, start, end=None):
+        rec["spans"].append((name, start, end if end is not None else time.perf_counter()))
+
+    @staticmethod
+    def render(rec, start):
+        """Account one render flush; only the first 200 are kept as separate spans."""
+        end = time.perf_counter()
+        rec["render"] += end - start
+        rec["render_calls"] += 1
+        if rec["render_calls"] <= 200:
+            rec["spans"].append(("render", start, end))
+
+    @staticmethod
+    def finish(rec):
+        rec["end"] = time.perf_counter()
+
+    def breakdown(self, rec):
+        """Phase -> milliseconds; first/last byte are measured from the command start."""
+        out = {}
+        for name, start, end in rec["spans"]:
+            if name != "render":
+                out[name] = out.get(name, 0.0) + (end - start) * 1000
+        for name, when in rec["marks"].items():
+            if when is not None:
+                out[name] = (when - rec["start"]) * 1000
+        if rec["render_calls"]:
+            out["render"] = rec["render"] * 1000
+        if rec["end"] is not None:
+            out["total"] = (rec["end"] - rec["start"]) * 1000
+        return out
+
+    def percentiles(self, quantiles=(50, 90, 99)):
+        """Phase -> (count, {q: ms}) over finished records."""
+        samples = collections.defaultdict(list)
+        for rec in self.records:
+            if rec["end"] is not None:
+                for name, ms in self.breakdown(rec).items():
+                    samples[name].append(ms)
+        out = {}
+        for name in self.PHASES:
+            values = sorted(samples.get(name, ()))
+            if values:
+                out[name] = (len(values), {q: values[min(len(values) - 1, int(len(values) * q / 100))] for q in quantiles})
+        return out
+
+    def chrome_trace(self):
+        """Trace-event JSON (chrome://tracing, Perfetto): GUI phases on tid 1, the child process on tid 2."""
+        events = [{"name": "process_name", "ph": "M", "pid": 1, "args": {"name": "mops terminal"}},
+                  {"name": "thread_name", "ph": "M", "pid": 1, "tid": 1, "args": {"name": "GUI"}},
+                  {"name": "thread_name", "ph": "M", "pid": 1, "tid": 2, "args": {"name": "child process"}}]
+
+        def us(t):
+            return round((t - self.origin) * 1e6, 1)
+
+        for rec in self.records:
+            args = {"cmd": rec["cmd"], "id": rec["id"]}
+            if rec["end"] is not None:
+                events.append({"name": rec["cmd"][:60], "cat": "command", "ph": "X", "pid": 1, "tid": 1,
+                               "ts": us(rec["start"]), "dur": us(rec["end"]) - us(rec["start"]), "args": args})
+            for name, start, end in rec["spans"]:
+                events.append({"name": name, "cat": "phase", "ph": "X", "pid": 1, "tid": 2 if name == "process" else 1,
+                               "ts": us(start), "dur": us(end) - us(start), "args": args})
+            for name, when in rec["marks"].items():
+                if when is not None:
+                    events.append({"name": name, "cat": "mark", "ph": "i", "s": "t", "pid": 1, "tid": 2,
+                                   "ts": us(when), "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+class StallWatchdog(QObject):
+    """Detects GUI event-loop stalls from a background thread.
+
+    A QTimer on the GUI thread stamps a heartbeat every ``interval`` ms.
+    The watchdog thread checks the stamp; once the loop has been silent for
+    ``threshold`` seconds it captures the GUI thread's Python stack via
+    ``sys._current_frames`` together with ``context()`` (which must only
+    read plain Python attributes) and appends the report to ``log_path`` at
+    once, so it survives a window that is killed while frozen. The length
+    is appended when the stall ends.
+    """
+
+    def __init__(self, parent, context, log_path, interval=100, threshold=0.5, keep=50):
+        super().__init__(parent)
+        self.context = context
+        self.log_path = log_path
+        self.interval = interval / 1000
+        self.threshold = threshold
+        self.stalls = collections.deque(maxlen=keep)
+        self.count = 0
+        self.max_lag = 0.0
+        self._gui_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop = threading.Event()
+        self._timer = QTimer(self)
+        self._timer.setInterval(interval)
+        self._timer.timeout.connect(self._heartbeat)
+        self._timer.start()
+        self._thread = threading.Thread(target=self._watch, daemon=True, name="mops-watchdog")
+        self._thread.start()
+
+    def _heartbeat(self):
+        self._beat = time.monotonic()
+
+    def _watch(self):
+        current = None
+        while not self._stop.wait(self.interval / 2):
+            lag = time.monotonic() - self._beat - self.interval
+            if lag >= self.threshold:
+                if current is None:
+                    current = self._capture(lag)
+                    stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(current["time"]))
+                    self._log(f"=== stall {stamp}  >= {lag * 1000:.0f} ms  {json.dumps(current['context'])}\n"
+                              + current["stack"])
+                current["duration"] = lag
+            elif current is not None:
+                # The loop came back; the heartbeat gap is the stall length
+                self._finish(current)
+                current = None
+
+    def _capture(self, lag):
+        frame = sys._current_frames().get(self._gui_thread)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else "(no frame)\n"
+        try:
+            context = self.context()
+        except Exception as e:
+            context = {"error": repr(e)}
+        return {"time": time.time(), "duration": lag, "stack": stack, "context": context}
+
+    def _finish(self, stall):
+        self.stalls.append(stall)
+        self.count += 1
+        self.max_lag = max(self.max_lag, stall["duration"])
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stall["time"]))
+        self._log(f"=== stall {stamp} ended after {stall['duration'] * 1000:.0f} ms\n")
+
+    def _log(self, text):
+        try:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(text)
+        except OSError:
+            pass
+
+    def stop(self):
+        self._stop.set()
+        self._timer.stop()
+
+
+def shell_args(cmd):
+    """Return (args, shell) for running ``cmd`` through PowerShell or the system shell."""
+    powershell_keywords = ["get-", "set-", "$", "select-object", "where-object", "foreach-object", "invoke-", "test-path", "|"]
+    if any(k in cmd.lower() for k in powershell_keywords):
+        return ["powershell", "-NoProfile", "-Command", cmd], False
+    return cmd, True
+
+
+def line_color(line):
+    """Highlighting rule applied to each line of command output."""
+    low = line.lower()
+    if "error" in low or "failed" in low:
+        return "red"
+    if "warning" in low:
+        return "yellow"
+    return "white"
+
+
+class TerminalEngine(QObject):
+    """Command dispatch, jobs, history and output for one terminal session.
+
+    The desktop window drives one engine and ``--serve-socket`` serves any
+    number of them, so both run the same commands. A command line is looked
+    up by its first word in a table filled with ``register``; the window adds
+    its widget-bound commands (panels, pager, favorites, ...) to its own engine.
+    Anything else runs in the shell as a managed job.
+
+    Everything a session prints is an event ``{"seq", "stream", "text",
+    "color"}`` kept in a backlog of about ``BACKLOG_CHARS``. A subscriber is
+    first given the backlog after the ``seq`` it asks for, then every new
+    event, in order, so a client that reconnects misses nothing still in the
+    backlog. The engine uses Qt timers and must only be called from the
+    thread running the event loop.
+    """
+
+    BACKLOG_CHARS = 4 * 1024 * 1024
+    EVENT_CHARS = 64 * 1024
+    CACHE_CONFIG = os.path.expanduser("~/.mops_cache.json")
+    FIND_INDEX = os.path.expanduser("~/.mops_find_index")
+    # A find search that takes longer than this finishes in the background
+    FIND_WAIT = 0.05
+
+    directory_changed = pyqtSignal(str)
+    job_done = pyqtSignal(object)
+
+    def __init__(self, name="main", cwd=None, cache_config=None, find_index=None, parent=None):
+        super().__init__(parent)
+        self.name = name
+        self.current_dir = cwd or os.getcwd()
+        self.command_history = []
+        self.builtins = {}
+        self.pipes = {}
+        self._seq = 0
+        self._events = collections.deque()
+        self._backlog = 0
+        self._subscribers = []
+        self._lock = threading.RLock()
+
+        # Job control: every external command runs as a managed job
+        self.job_manager = JobManager(self)
+        self.fg_job = None
+        self._perf_current = None
+        # Server handle (id of the 'serve' job)
+        self.server_job = None
+
+        # Opt-in memoization of slow system-info commands (see 'cache')
+        self.cache_config = cache_config or self.CACHE_CONFIG
+        self.result_cache, self.cache_enabled = self.load_cache_config()
+
+        # Per-directory listings of 'du', reused while a directory's mtime is unchanged
+        self.du_cache = {}
+
+        # wifcode looks profiles up on a worker pool and streams them through a queue
+        self.wifi_backend = wifi_backend()
+        self._wifi_queue = queue.Queue()
+        self._wifi_timer = QTimer(self)
+        self._wifi_timer.setInterval(30)
+        self._wifi_timer.timeout.connect(self._poll_wifi)
+
+        # calc runs in a worker process; variables persist across calls
+        self.calc_worker = CalcWorker()
+        self.calc_mode = "float"
+        self.calc_vars = {}
+        self._calc_queue = collections.deque()
+        self._calc_timer = QTimer(self)
+        self._calc_timer.setInterval(10)
+        self._calc_timer.timeout.connect(self._poll_calc)
+
+        # 'py' kernels, one per pane, started on first use
+        self.kernels = {}
+        self._py_queue = {}
+        self._py_sinks = {}
+        self._py_timer = QTimer(self)
+        self._py_timer.setInterval(15)
+        self._py_timer.timeout.connect(self._poll_kernels)
+
+        # Path index behind 'find'; an existing index is refreshed shortly after startup
+        if find_index is None:
+            find_index = PathIndex(self.FIND_INDEX)
+            if os.path.exists(find_index.path):
+                QTimer.singleShot(3000, find_index.refresh_async)
+        self.find_index = find_index
+        self.find_results = []
+        self._find_pending = None
+        self._find_searches = collections.deque()
+        self._find_timer = QTimer(self)
+        self._find_timer.setInterval(50)
+        self._find_timer.timeout.connect(self._poll_find)
+
+        for name, handler, args, background in (
+            ("cd", self._cd, "any", False),
+            ("pwd", lambda _: self._pwd(), "bare", False),
+            ("ls", lambda _: self.list_dir(), "bare", False),
+            ("dir", lambda _: self.list_dir(), "bare", False),
+            ("history", lambda _: self._history(), "bare", False),
+            ("help", lambda _: self._help(), "bare", False),
+            ("tree", lambda rest: self.print_tree(rest.split()[0] if rest else self.current_dir), "any", False),
+            ("search", self.search_files, "required", False),
+            ("mkcd", self.make_and_cd, "required", False),
+            ("extract", self.extract_archive, "required", False),
+            ("wifcode", self._wifcode, "any", False),
+            ("serve", self._serve, "any", False),
+            ("stopserve", lambda _: self.stop_server(), "any", False),
+            ("mops", self._mops, "required", False),
+            ("cache", lambda rest: self.cache_command(rest.split()), "any", False),
+            ("jobs", lambda rest: self.list_jobs(rest.split()), "any", False),
+            ("fg", self.foreground_job, "any", False),
+            ("kill", self._kill, "any", False),
+            ("parallel", self.run_parallel, "required", False),
+            ("follow", self.follow_files, "required", True),
+            ("copy", self.copy_files, "required", True),
+            ("move", lambda rest, background=False: self.copy_files(rest, move=True, background=background), "required", True),
+            ("find", self._find, "required", False),
+            ("du", self.disk_usage, "any", True),
+            ("hash", self.hash_files, "any", True),
+            ("compress", self.compress_files, "any", True),
+            ("calc", self.calc_expr, "required", False),
+            ("py", self.py_command, "any", False),
+        ):
+            self.register(name, handler, args, background)
+
+    def register(self, name, handler, args="any", background=False):
+        """Make ``name`` a builtin; ``handler(rest)`` gets the text after the name.
+
+        ``args`` is "any", "bare" (the name alone) or "required"; a command line
+        of another shape goes to the shell instead. A ``background`` handler is
+        also called with ``background=True`` for a trailing '&'.
+        """
+        self.builtins[name.lower()] = (handler, args, background)
+
+    def register_pipe(self, name, handler):
+        """Make ``CMD | name`` call ``handler(CMD)`` instead of running a shell pipe."""
+        self.pipes[name.lower()] = handler
+
+    # ---- output stream ----
+    @property
+    def seq(self):
+        return self._seq
+
+    def emit(self, text, stream="ui", color=None, **extra):
+        """Append an event and hand it to every subscriber."""
+        with self._lock:
+            self._seq += 1
+            event = {"seq": self._seq, "stream": stream, "text": text, "color": color or line_color(text), **extra}
+            self._events.append(event)
+            self._backlog += len(text)
+            while self._backlog > self.BACKLOG_CHARS and len(self._events) > 1:
+                self._backlog -= len(self._events.popleft()["text"])
+            for callback in list(self._subscribers):
+                callback(event)
+        return event
+
+    def append_text(self, text, color="default", animate=True, stream="ui"):
+        """Same signature as the window's; ``animate`` is a hint for it."""
+        self.emit(text, stream=stream, color=color, animate=animate)
+
+    def subscribe(self, callback, since=0):
+        """Replay events after ``since`` to ``callback``, then deliver new ones.
+
+        Callbacks may run with the engine lock held; socket clients only queue
+        the event.
+        """
+        with self._lock:
+            for event in self._events:
+                if event["seq"] > since:
+                    callback(event)
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    # ---- commands ----
+    def execute(self, cmd):
+        """Echo, record and run one command line; returns the id of a job it started."""
+        cmd = cmd.strip()
+        if not cmd:
+            return None
+        self.emit(f"> {cmd}\n", stream="echo", color="yellow", animate=True)
+        if cmd not in self.command_history:
+            self.command_history.append(cmd)
+        known = set(self.job_manager.jobs)
+        self.dispatch(cmd)
+        started = [job_id for job_id in self.job_manager.jobs if job_id not in known]
+        return started[-1] if started else None
+
+    def dispatch(self, cmd):
+        """Run a builtin, a registered pipe target, or the shell."""
+        head, bar, tail = cmd.rpartition("|")
+        if bar and head.strip() and tail.strip().lower() in self.pipes:
+            self.pipes[tail.strip().lower()](head.strip())
+            return
+        # Trailing '&' (but not '&&') sends the command to the background
+        background = cmd.endswith("&") and not cmd.endswith("&&") and bool(cmd[:-1].strip())
+        line = cmd[:-1].strip() if background else cmd
+        word, _, rest = line.partition(" ")
+        rest = rest.strip()
+        handler, args, can_background = self.builtins.get(word.lower(), (None, None, False))
+        if handler is not None and (args == "bare" and rest or args == "required" and not rest):
+            handler = None
+        try:
+            if background and handler is not None and can_background:
+                handler(rest, background=True)
+            elif background:
+                self.run_background(line)
+            elif handler is not None:
+                handler(rest)
+            else:
+                self.execute_command(cmd)
+        except Exception as e:
+            self.append_text(f"{word} error: {e}\n", color="red", animate=False)
+
+    def close(self):
+        self.job_manager.kill_all()
+        self._find_timer.stop()
+        self._wifi_timer.stop()
+        self._calc_timer.stop()
+        self._py_timer.stop()
+        self.calc_worker.stop()
+        for kernel in self.kernels.values():
+            kernel.stop()
+
+    def _shell_args(self, cmd):
+        return shell_args(cmd)
+
+    # ---- builtins ----
+    def _cd(self, path):
+        if path:
+            self.change_directory(path)
+        else:
+            self._pwd()
+
+    def _pwd(self):
+        self.append_text(f"{self.current_dir}\n", color="cyan")
+
+    def _history(self):
+        self.append_text("".join(f"{i:>4}  {cmd}\n" for i, cmd in enumerate(self.command_history[-50:], 1)),
+                         color="white", animate=False)
+
+    def _help(self):
+        self.append_text(f"Builtins: {', '.join(sorted(self.builtins))}; anything else runs in the shell.\n",
+                         color="cyan", animate=False)
+
+    def _kill(self, arg):
+        # As in a shell: %N is a job, anything else (PID, -9 PID, -l) is the system kill
+        if arg.startswith("%"):
+            self.kill_job(arg)
+        elif os.name == "nt" and arg.isdigit():
+            self.kill_job(arg)  # there is no system kill to hand a PID to
+        elif arg and os.name != "nt":
+            self.execute_command(f"kill {arg}")
+        else:
+            self.append_text("Usage: kill %<job id>\n", color="yellow")
+
+    def _find(self, spec):
+        if os.name == "nt":
+            # The Windows find (find "text" file, find /I ...) still goes to the shell
+            system = spec[:1] in ('"', "/")
+        else:
+            # find PATH ..., find -name X and other multi-word forms are the system find
+            system = (spec[:1] in (".", "/", "~") or spec[:1] == "-" and spec[1:2] != "-"
+                      or not spec.startswith("--") and len(spec.split()) > 1)
+        if system:
+            self.execute_command(f"find {spec}")
+        else:
+            self.find_command(spec)
+
+    def _wifcode(self, rest):
+        flags = [p.lower() for p in rest.split()]
+        show_flag = any(f in ("--show", "-s", "show") for f in flags)
+        self.show_wifi_passwords(show=show_flag, refresh="--refresh" in flags)
+
+    def _serve(self, rest):
+        parts = rest.split()
+        port = int(parts[0]) if parts and parts[0].isdigit() else 8000
+        self.start_server(port)
+
+    def _mops(self, rest):
+        parts = rest.split()
+        pkg = None
+        if len(parts) > 1 and parts[0].lower() == "install":
+            pkg = parts[1]
+        elif parts:
+            pkg = parts[0]
+        if pkg:
+            self.mops_install(pkg)
+        else:
+            self.append_text("Usage: mops install <package>\n", color="yellow")
+
+    def _job_sink(self, job, chunks):
+        """Emit job output as events, batching runs of same-colored lines."""
+        perf_rec = job.perf if job is not None else None
+        render_start = time.perf_counter() if perf_rec else 0.0
+        job_id = job.id if job is not None else None
+        for stream, color, text in self._runs(chunks):
+            self.emit(text, stream=stream, color=color, job=job_id)
+        if perf_rec:
+            PerfTracer.render(perf_rec, render_start)
+
+    def _runs(self, chunks):
+        """Group chunks into (stream, color, text) runs of at most ``EVENT_CHARS``."""
+        runs, key, parts, size = [], None, [], 0
+        for stream, text in chunks:
+            chunk_key = (stream, "red" if stream == "stderr" else line_color(text))
+            if chunk_key != key or size >= self.EVENT_CHARS:
+                if parts:
+                    runs.append((*key, "".join(parts)))
+                key, parts, size = chunk_key, [], 0
+            parts.append(text)
+            size += len(text)
+        if parts:
+            runs.append((*key, "".join(parts)))
+        return runs
+
+    def _job_finished(self, job):
+        if job.perf:
+            rec = job.perf
+            rec["marks"].update(first_byte=job.first_output_at, last_byte=job.last_output_at)
+            spawned = next((end for name, _, end in rec["spans"] if name == "spawn"), rec["start"])
+            PerfTracer.span(rec, "process", spawned, job.exit_at or time.perf_counter())
+            PerfTracer.finish(rec)
+        self.job_done.emit(job)
+        # Every job ends with an 'exit' event, empty when there is nothing to say
+        text, color = "", "gray"
+        if job.id == self.fg_job:
+            self.fg_job = None
+            if job.total_chunks == 0 and job.status == "done":
+                text = "[Command executed]\n"
+            elif job.status == "killed":
+                text, color = f"[{job.id}] Killed  {job.cmd}\n", "yellow"
+        elif job.sink is None and job.listed:
+            text = f"[{job.id}] {self._job_state(job)}  {job.cmd}\n"
+        self.emit(text, stream="exit", color=color, job=job.id, code=job.returncode)
+
+    # ---- filesystem ----
+    def change_directory(self, path):
+        # 'cd @N' jumps to the Nth result of the last find, 'cd ?NAME' to the best directory match
+        if path.startswith("@") and path[1:].isdigit():
+            n = int(path[1:])
+            if not 1 <= n <= len(self.find_results):
+                self.append_text(f"cd: no find result {path}\n", color="red")
+                return
+            found, is_dir = self.find_results[n - 1]
+            path = found if is_dir else os.path.dirname(found)
+        elif path.startswith("?") and len(path) > 1:
+            matches, _ = self.find_index.search(path[1:].strip(), limit=1, dirs_only=True)
+            if not matches:
+                self.append_text(f"cd: no indexed directory matches {path[1:]}\n", color="red")
+                return
+            path = matches[0][0]
+        try:
+            full_path = os.path.join(self.current_dir, path) if not os.path.isabs(path) else path
+            os.chdir(full_path)
+            self.current_dir = os.getcwd()
+            self.append_text(f"{self.current_dir}\n", color="cyan")
+            self.directory_changed.emit(self.current_dir)
+        except FileNotFoundError:
+            self.append_text(f"Error: directory is as real as my girlfriend {path}\n", color="red")
+        except Exception as e:
+            self.append_text(f"Error: {e}\n", color="red")
+
+    def _resolve_path(self, path):
+        path = path.strip().strip('"')
+        return path if os.path.isabs(path) else os.path.join(self.current_dir, path)
+
+    def list_dir(self):
+        try:
+            entries = os.listdir(self.current_dir)
+            for name in sorted(entries):
+                path = os.path.join(self.current_dir, name)
+                if os.path.isdir(path):
+                    self.append_text(f"{name}/\n", color="cyan")
+                else:
+                    self.append_text(f"{name}\n", color="white")
+        except Exception as e:
+            self.append_text(f"List error: {e}\n", color="red")
+
+    def print_tree(self, root, prefix="", max_depth=4, _depth=0):
+        try:
+            if _depth > max_depth:
+                return
+            entries = sorted(os.listdir(root))
+            for i, name in enumerate(entries):
+                path = os.path.join(root, name)
+                connector = "└── " if i == len(entries)-1 else "├── "
+                if os.path.isdir(path):
+                    self.append_text(f"{prefix}{connector}{name}/\n", color="cyan")
+                    self.print_tree(path, prefix + ("    " if i == len(entries)-1 else "│   "), max_depth, _depth+1)
+                else:
+                    self.append_text(f"{prefix}{connector}{name}\n", color="white")
+        except Exception as e:
+            self.append_text(f"Tree error: {e}\n", color="red")
+
+    def search_files(self, pattern):
+        try:
+            count = 0
+            for root, dirs, files in os.walk(self.current_dir):
+                for fname in files:
+                    fpath = os.path.join(root, fname)
+                    try:
+                        with open(fpath, 'r', errors='ignore') as fh:
+                            for i, line in enumerate(fh, 1):
+                                if pattern.lower() in line.lower():
+                                    rel = os.path.relpath(fpath, self.current_dir)
+                                    self.append_text(f"{rel}:{i}: {line.strip()}\n", color="white")
+                                    count += 1
+                    except Exception:
+                        continue
+            if count == 0:
+                self.append_text("No matches found.\n", color="gray")
+        except Exception as e:
+            self.append_text(f"Search error: {e}\n", color="red")
+
+    def make_and_cd(self, path):
+        try:
+            os.makedirs(path, exist_ok=True)
+            self.change_directory(path)
+        except Exception as e:
+            self.append_text(f"mkcd error: {e}\n", color="red")
+
+    def extract_archive(self, path):
+        try:
+            if not os.path.isabs(path):
+                path = os.path.join(self.current_dir, path)
+            if not os.path.exists(path):
+                self.append_text("File is not real.\n", color="red")
+                return
+            if path.endswith('.zip'):
+                import zipfile
+                with zipfile.ZipFile(path, 'r') as z:
+                    z.extractall(self.current_dir)
+                self.append_text("Extracted zip archive.\n", color="green")
+            elif any(path.endswith(ext) for ext in ('.tar', '.tar.gz', '.tgz', '.tar.bz2')):
+                import tarfile
+                with tarfile.open(path, 'r:*') as t:
+                    t.extractall(self.current_dir)
+                self.append_text("Extracted tar archive.\n", color="green")
+            else:
+                self.append_text("Unsupported archive type.\n", color="yellow")
+        except Exception as e:
+            self.append_text(f"Extract error: {e}\n", color="red")
+
+    # ---- external commands and the result cache ----
+    def execute_command(self, cmd):
+        try:
+            sink, on_finished = self._job_sink, self._job_finished
+            if self.result_cache.ttl_for(cmd.replace("--fresh", "")) is not None:
+                fresh = len(cmd.split()) > 1 and cmd.split()[-1] == "--fresh"
+                if fresh:
+                    cmd = cmd.rsplit(None, 1)[0]
+                if self.cache_enabled:
+                    hit = None if fresh else self.result_cache.get(cmd, self.current_dir)
+                    if hit is not None:
+                        self._replay_cached(*hit)
+                        return
+                    sink, on_finished = self._caching_callbacks(cmd, self.current_dir)
+            args, shell = self._shell_args(cmd)
+            if self.fg_job is not None:
+                self._detach_foreground()
+            perf_rec = self._perf_current
+            spawn_start = time.perf_counter() if perf_rec else 0.0
+            job = self.job_manager.submit(cmd, self.current_dir, args=args, shell=shell, sink=sink,
+                                          on_finished=on_finished, background=False)
+            if perf_rec:
+                PerfTracer.span(perf_rec, "spawn", spawn_start)
+                if not job.done:
+                    job.perf, perf_rec["job"] = perf_rec, job.id
+            if job.status == "running":
+                self.fg_job = job.id
+        except Exception as e:
+            self.append_text(f"Execution error: {e}\n", color="red", animate=False)
+
+    def _caching_callbacks(self, cmd, cwd):
+        """Sink/finish pair that stores a successful, fully-seen run in the result cache."""
+        seen = []
+
+        def sink(job, chunks):
+            seen.extend(chunks)
+            self._job_sink(job, chunks)
+
+        def finished(job):
+            if job.status == "done" and job.returncode == 0 and len(seen) == job.total_chunks:
+                self.result_cache.put(cmd, cwd, seen, job.returncode)
+            self._job_finished(job)
+
+        return sink, finished
+
+    def _replay_cached(self, chunks, returncode, age):
+        self._job_sink(None, chunks)
+        age_text = f"{int(age)}s" if age < 60 else f"{int(age // 60)}m {int(age % 60)}s"
+        self.append_text(f"[cached {age_text} ago, exit {returncode} — add --fresh to rerun]\n", color="gray", animate=False)
+
+    def load_cache_config(self):
+        """Read the result cache switch and per-pattern policies."""
+        enabled, policies = False, None
+        try:
+            if os.path.exists(self.cache_config):
+                with open(self.cache_config, 'r') as f:
+                    config = json.load(f)
+                enabled = bool(config.get("enabled"))
+                policies = [(p, int(t)) for p, t in config.get("policies", [])
+                            if (p, int(t)) not in ResultCache.RETIRED_POLICIES]
+        except Exception:
+            pass
+        return ResultCache(policies=policies), enabled
+
+    def save_cache_config(self):
+        try:
+            tmp = self.cache_config + ".tmp"
+            with open(tmp, 'w') as f:
+                json.dump({"enabled": self.cache_enabled, "policies": self.result_cache.policies}, f, indent=2)
+            os.replace(tmp, self.cache_config)
+        except Exception as e:
+            self.append_text(f"Error saving cache settings: {e}\n", color="red")
+
+    def cache_command(self, args):
+        """cache [on|off|clear] | cache policy PATTERN SECONDS."""
+        action = args[0].lower() if args else ""
+        cache = self.result_cache
+        if action in ("on", "off"):
+            self.cache_enabled = action == "on"
+            if not self.cache_enabled:
+                cache.clear()
+            self.save_cache_config()
+            self.append_text(f"✓ Result cache {'enabled' if self.cache_enabled else 'disabled'}.\n", color="green")
+        elif action == "clear":
+            cache.clear()
+            self.append_text("✓ Result cache cleared.\n", color="green")
+        elif action == "policy" and len(args) == 3 and args[2].isdigit():
+            cache.set_policy(args[1], int(args[2]))
+            self.save_cache_config()
+            verb = f"cached for {args[2]}s" if int(args[2]) else "no longer cached"
+            self.append_text(f"✓ Commands matching '{args[1]}' are {verb}.\n", color="green")
+        elif action:
+            self.append_text("Usage: cache [on|off|clear] | cache policy <pattern> <seconds>\n", color="yellow")
+        else:
+            state = "ON" if self.cache_enabled else "OFF"
+            self.append_text(f"Result cache {state}: {len(cache.entries)} entries, {cache.size / 1024:.1f} KB, "
+                             f"{cache.hits} hits / {cache.misses} misses\n", color="cyan")
+            for pattern, ttl in cache.policies:
+                self.append_text(f"  {pattern:24} {ttl}s\n", color="white", animate=False)
+
+    def run_background(self, cmd, args=None, shell=None):
+        """Start ``cmd`` as a background job with its output captured to the job buffer."""
+        if args is None:
+            args, shell = self._shell_args(cmd)
+        job = self.job_manager.submit(cmd, self.current_dir, args=args, shell=shell, on_finished=self._job_finished)
+        state = "queued" if job.status == "queued" else f"pid {job.process.pid}" if job.process else job.status
+        self.append_text(f"[{job.id}] {state}  {cmd}\n", color="gray", animate=False)
+        return job
+
+    # ---- job control ----
+    def _detach_foreground(self):
+        job = self.job_manager.detach(self.fg_job)
+        self.fg_job = None
+        if job is not None and job.status == "running":
+            self.append_text(f"[{job.id}] continues in background  {job.cmd}\n", color="gray", animate=False)
+
+    def _job_state(self, job):
+        return {"done": f"Done (exit {job.returncode})", "killed": "Killed", "failed": "Failed"}.get(job.status, job.status)
+
+    def _parse_job_id(self, arg):
+        arg = arg.strip().lstrip("%")
+        if not arg:
+            listed = [j for j in self.job_manager.jobs.values() if j.listed]
+            return listed[-1].id if listed else None
+        return int(arg) if arg.isdigit() else None
+
+    def list_jobs(self, args=()):
+        """List jobs with status, runtime and CPU time; 'jobs --limit N' sets the concurrency cap."""
+        if len(args) == 2 and args[0] in ("--limit", "-j") and args[1].isdigit() and int(args[1]) > 0:
+            self.job_manager.max_running = int(args[1])
+            self.append_text(f"Background job limit set to {args[1]}.\n", color="green", animate=False)
+            return
+        jobs = [j for j in self.job_manager.jobs.values() if j.listed]
+        if not jobs:
+            self.append_text("No jobs.\n", color="gray", animate=False)
+            return
+        self.append_text(f"{'ID':>4}  {'STATUS':9} {'RUNTIME':>9} {'CPU':>8}  COMMAND\n", color="cyan", animate=False)
+        for job in jobs:
+            status = job.status if job.status != "done" else f"exit {job.returncode}"
+            color = "green" if job.status == "running" else "gray" if job.status == "queued" else "white"
+            self.append_text(f"{job.id:>4}  {status:9} {job.runtime():>8.1f}s {job.cpu_seconds():>7.2f}s  {job.cmd}\n",
+                             color=color, animate=False)
+        self.append_text(f"{self.job_manager.running_background()}/{self.job_manager.max_running} background slots in use\n",
+                         color="gray", animate=False)
+
+    def foreground_job(self, arg):
+        """Attach a job's output to the pane, replaying what it printed while detached."""
+        job_id = self._parse_job_id(arg)
+        job = self.job_manager.get(job_id) if job_id is not None else None
+        if job is None:
+            self.append_text("fg: no such job\n", color="red", animate=False)
+            return
+        if self.fg_job is not None and self.fg_job != job.id:
+            self._detach_foreground()
+        self.append_text(f"[{job.id}] {job.cmd}\n", color="gray", animate=False)
+        self.job_manager.attach(job.id, self._job_sink)
+        if job.status in ("running", "queued"):
+            self.fg_job = job.id
+        else:
+            self.append_text(f"[{job.id}] {self._job_state(job)}\n", color="gray", animate=False)
+
+    def kill_job(self, arg):
+        """Terminate a job and its whole process tree."""
+        job_id = self._parse_job_id(arg)
+        if job_id is None or self.job_manager.get(job_id) is None:
+            self.append_text("kill: no such job\n", color="red", animate=False)
+            return
+        job = self.job_manager.kill(job_id)
+        if job.status == "killed":
+            self.append_text(f"[{job.id}] Terminating  {job.cmd}\n", color="yellow", animate=False)
+        else:
+            self.append_text(f"[{job.id}] Not running ({job.status})\n", color="gray", animate=False)
+
+    def run_parallel(self, spec):
+        """parallel [-j N] [--tag] CMD ::: ARG... | parallel [-j N] [--tag] CMD < LISTFILE"""
+        try:
+            # Only a trailing '< FILE' names a list file; any other '<' belongs to CMD
+            listfile = re.match(r"^(.*\S)\s*<\s*([^<>|&]+?)\s*$", spec)
+            if " ::: " in f" {spec} ":
+                head, _, tail = f" {spec} ".partition(" ::: ")
+                items = [w.strip('"') for w in shlex.split(tail, posix=os.name != "nt")]
+            elif listfile:
+                head = listfile.group(1)
+                path = os.path.join(self.current_dir, listfile.group(2).strip('"'))
+                with open(path, "r", errors="replace") as fh:
+                    items = [line.strip() for line in fh if line.strip()]
+            else:
+                self.append_text("Usage: parallel [-j N] [--tag] CMD ::: ARG... (or CMD < LISTFILE)\n", color="yellow")
+                return
+            words = head.split()
+            jobs, tag = os.cpu_count() or 4, False
+            while words and words[0].startswith("-"):
+                opt = words.pop(0)
+                if opt == "-j" and words and words[0].isdigit():
+                    jobs = int(words.pop(0))
+                elif opt.startswith("-j") and opt[2:].isdigit():
+                    jobs = int(opt[2:])
+                elif opt == "--tag":
+                    tag = True
+                else:
+                    self.append_text(f"parallel: unknown option {opt}\n", color="red")
+                    return
+                if jobs < 1:
+                    self.append_text("parallel: -j needs at least 1\n", color="red")
+                    return
+            template = " ".join(words)
+            if not template or not items:
+                self.append_text("parallel: nothing to run\n", color="yellow")
+                return
+            self.append_text(f"Running {len(items)} jobs, {jobs} at a time...\n", color="cyan", animate=False)
+            ParallelRun(self, template, items, jobs, tag=tag).start()
+        except Exception as e:
+            self.append_text(f"parallel error: {e}\n", color="red")
+
+    def follow_files(self, spec, background=False, sink=None):
+        """follow [-n N] FILE... streams appended lines as a job ('kill %N' stops it).
+
+        With ``sink`` the lines go there instead of the foreground.
+        """
+        words = spec.split()
+        backlog = 10
+        while words and words[0].startswith("-"):
+            opt = words.pop(0)
+            if opt == "-n" and words and words[0].isdigit():
+                backlog = int(words.pop(0))
+            else:
+                self.append_text(f"follow: unknown option {opt}\n", color="red")
+                return
+        if not words:
+            self.append_text("Usage: follow [-n N] <file> [file...]\n", color="yellow")
+            return
+        paths = [self._resolve_path(w) for w in words]
+        missing = [p for p in paths if not os.path.isfile(p)]
+        if missing:
+            self.append_text(f"follow: no such file {missing[0]}\n", color="red")
+            return
+        job = FollowJob(self.job_manager.next_id(), f"follow {' '.join(words)}", self.current_dir, paths, backlog=backlog)
+        if background:
+            self.job_manager.add(job, on_finished=self._job_finished)
+            self.append_text(f"[{job.id}] following {len(paths)} file(s)\n", color="gray", animate=False)
+            return
+        if sink is not None:
+            self.job_manager.add(job, sink=sink, on_finished=self._job_finished, background=False)
+        else:
+            if self.fg_job is not None:
+                self._detach_foreground()
+            self.job_manager.add(job, sink=self._job_sink, on_finished=self._job_finished, background=False)
+            self.fg_job = job.id
+        self.append_text(f"[{job.id}] following {len(paths)} file(s); 'kill %{job.id}' to stop\n", color="gray", animate=False)
+
+    # ---- file jobs and the path index ----
+    def copy_files(self, spec, move=False, background=False):
+        """copy/move [-j N] SRC... DST as a resumable job ('kill %N' cancels it)."""
+        name = "move" if move else "copy"
+        try:
+            words = [w.strip('"') for w in shlex.split(spec, posix=os.name != "nt")]
+        except ValueError as e:
+            self.append_text(f"{name} error: {e}\n", color="red")
+            return
+        if os.name == "nt" and any(w.startswith("/") and len(w) == 2 for w in words):
+            # cmd.exe switches such as /Y: leave those to the shell's own copy/move
+            self.execute_command(f"{name} {spec}")
+            return
+        workers = 8
+        if len(words) > 2 and words[0] == "-j" and words[1].isdigit():
+            workers = max(1, int(words[1]))
+            words = words[2:]
+        if len(words) < 2:
+            self.append_text(f"Usage: {name} [-j N] <source>... <destination>\n", color="yellow")
+            return
+        sources = [self._resolve_path(w) for w in words[:-1]]
+        dest = self._resolve_path(words[-1])
+        missing = [p for p in sources if not os.path.exists(p)]
+        if missing:
+            self.append_text(f"{name}: no such file or directory {missing[0]}\n", color="red")
+            return
+        if len(sources) > 1 and not os.path.isdir(dest):
+            self.append_text(f"{name}: {dest} is not a directory\n", color="red")
+            return
+        job = CopyJob(None, f"{name} {spec}", self.current_dir, sources, dest,
+                      move=move, workers=workers)
+        for src in sources:
+            real_src, real_target = os.path.realpath(src), os.path.realpath(job.target_for(src))
+            if real_src == real_target or real_target.startswith(real_src.rstrip(os.sep) + os.sep):
+                self.append_text(f"{name}: cannot {name} {src} into itself\n", color="red")
+                return
+        job.id = self.job_manager.next_id()
+        if background:
+            self.job_manager.add(job, on_finished=self._job_finished)
+            self.append_text(f"[{job.id}] {name} started in the background\n", color="gray", animate=False)
+            return
+        if self.fg_job is not None:
+            self._detach_foreground()
+        self.job_manager.add(job, sink=self._job_sink, on_finished=self._job_finished, background=False)
+        self.fg_job = job.id
+        self.append_text(f"[{job.id}] {name} started; 'kill %{job.id}' cancels\n", color="gray", animate=False)
+
+    def disk_usage(self, spec, background=False):
+        """du [PATH] [--depth N] [--top K] [--fresh]: largest directories, computed as a job."""
+        try:
+            words = [w.strip('"') for w in shlex.split(spec, posix=os.name != "nt")]
+        except ValueError as e:
+            self.append_text(f"du error: {e}\n", color="red")
+            return
+        depth, top, fresh, paths = 1, 20, False, []
+        while words:
+            word = words.pop(0)
+            if word in ("--depth", "--top") and words and words[0].isdigit():
+                value = int(words.pop(0))
+                if word == "--depth":
+                    depth = value
+                else:
+                    top = max(1, value)
+            elif word == "--fresh":
+                fresh = True
+            elif word.startswith("-"):
+                self.append_text("Usage: du [path] [--depth N] [--top K] [--fresh]\n", color="yellow")
+                return
+            else:
+                paths.append(word)
+        root = os.path.normpath(self._resolve_path(paths[0])) if paths else self.current_dir
+        if not os.path.isdir(root):
+            self.append_text(f"du: {root} is not a directory\n", color="red")
+            return
+        if fresh:
+            self.du_cache.clear()
+        job = DuJob(self.job_manager.next_id(), f"du {spec}".strip(), self.current_dir, root,
+                    depth=depth, top=top, cache=self.du_cache)
+        if background:
+            self.job_manager.add(job, on_finished=self._job_finished)
+            self.append_text(f"[{job.id}] du started in the background\n", color="gray", animate=False)
+            return
+        if self.fg_job is not None:
+            self._detach_foreground()
+        self.job_manager.add(job, sink=self._job_sink, on_finished=self._job_finished, background=False)
+        self.fg_job = job.id
+
+    def find_command(self, spec):
+        """find [--dirs] PATTERN searches the path index; --refresh, --roots, --add-root/--remove-root PATH."""
+        index = self.find_index
+        words = spec.split(None, 1)
+        opt = words[0] if words else ""
+        if opt in ("--add-root", "--remove-root", "--roots"):
+            if not index.loaded and index.busy():
+                self.append_text("find: the index is still loading; try again in a moment\n", color="yellow")
+                return
+            if not index.loaded:
+                index.load()
+            if opt != "--roots":
+                root = os.path.normpath(self._resolve_path(words[1])) if len(words) > 1 else ""
+                if opt == "--add-root" and os.path.isdir(root) and root not in index.roots:
+                    index.roots.append(root)
+                elif opt == "--remove-root" and root in index.roots and len(index.roots) > 1:
+                    index.roots.remove(root)
+                else:
+                    self.append_text(f"find: cannot {opt[2:].replace('-', ' ')} {root or '(none given)'}\n", color="red")
+                    return
+                index.refresh_async()
+            for root in index.roots:
+                self.append_text(f"  {root}\n", color="cyan", animate=False)
+            return
+        if opt == "--refresh":
+            index.refresh_async()
+            self.append_text(f"find: refreshing the index of {', '.join(index.roots)} in the background\n", color="gray", animate=False)
+            return
+        dirs_only = opt == "--dirs"
+        pattern = (words[1] if dirs_only and len(words) > 1 else "" if dirs_only else spec).strip().strip('"')
+        if not pattern:
+            self.append_text("Usage: find [--dirs] <name, *glob* or fuzzy letters>\n", color="yellow")
+            return
+        if index.snapshot is None:
+            index.refresh_async()
+            self._find_pending = (pattern, dirs_only)
+            self._find_timer.start()
+            self.append_text(f"find: indexing {', '.join(index.roots)} in the background; results will follow\n", color="gray", animate=False)
+            return
+        if index.refreshed_at is None or time.time() - index.refreshed_at > 60:
+            index.refresh_async()
+        self._show_find_results(pattern, dirs_only)
+
+    def _poll_find(self):
+        if self._find_pending is not None:
+            if self.find_index.snapshot is None and self.find_index.busy():
+                return
+            pattern, dirs_only = self._find_pending
+            self._find_pending = None
+            self._show_find_results(pattern, dirs_only)
+        self._drain_find()
+        if self._find_pending is None and not self._find_searches:
+            self._find_timer.stop()
+
+    def _show_find_results(self, pattern, dirs_only=False):
+        """Search on a worker thread; a quick search is printed at once, a slow one when it finishes."""
+        future = concurrent.futures.Future()
+
+        def run():
+            start = time.perf_counter()
+            try:
+                matches, total = self.find_index.search(pattern, dirs_only=dirs_only)
+                future.set_result((matches, total, (time.perf_counter() - start) * 1000))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, daemon=True).start()
+        self._find_searches.append((pattern, future))
+        try:
+            future.result(timeout=self.FIND_WAIT)
+        except concurrent.futures.TimeoutError:
+            self.append_text(f"find: searching for {pattern}...\n", color="gray", animate=False)
+            self._find_timer.start()
+        except Exception:
+            pass
+        self._drain_find()
+
+    def _drain_find(self):
+        # Searches are printed in the order they were typed
+        while self._find_searches and self._find_searches[0][1].done():
+            pattern, future = self._find_searches.popleft()
+            try:
+                matches, total, elapsed = future.result()
+            except Exception as e:
+                self.append_text(f"find error: {e}\n", color="red", animate=False)
+                continue
+            self._print_find_results(pattern, matches, total, elapsed)
+
+    def _print_find_results(self, pattern, matches, total, elapsed):
+        self.find_results = matches
+        if not matches:
+            self.append_text(f"find: nothing matches {pattern}\n", color="yellow", animate=False)
+        for n, (path, is_dir) in enumerate(matches, 1):
+            self.append_text(f"{n:>4}  {path}{os.sep if is_dir else ''}\n", color="cyan" if is_dir else "white", animate=False)
+        age = time.time() - (self.find_index.refreshed_at or time.time())
+        age_text = f"{int(age)}s" if age < 60 else f"{int(age // 60)}m {int(age % 60)}s"
+        more = f"{len(matches)} of {total}{'+' if total >= PathIndex.MAX_CANDIDATES else ''}" if total > len(matches) else f"{total}"
+        self.append_text(f"({more} matches in {elapsed:.1f} ms; {self.find_index.entry_count():,} paths indexed, "
+                         f"refreshed {age_text} ago; 'cd @N' jumps to one)\n", color="gray", animate=False)
+
+    def hash_files(self, spec, background=False):
+        """hash [--algo A] [-j N] [--manifest] PATH... | hash --check FILE, as a job."""
+        usage = "Usage: hash [--algo sha256|sha1|md5|blake2b] [-j N] [--manifest] <file/dir>... | hash --check <file>\n"
+        try:
+            words = [w.strip('"') for w in shlex.split(spec, posix=os.name != "nt")]
+        except ValueError as e:
+            self.append_text(f"hash error: {e}\n", color="red")
+            return
+        algo, check, manifest, workers, paths = None, None, False, max(4, os.cpu_count() or 1), []
+        while words:
+            word = words.pop(0)
+            if word == "--algo" and words and words[0].lower() in HashJob.ALGOS:
+                algo = words.pop(0).lower()
+            elif word == "--check" and words:
+                check = self._resolve_path(words.pop(0))
+            elif word == "-j" and words and words[0].isdigit():
+                workers = max(1, int(words.pop(0)))
+            elif word == "--manifest":
+                manifest = True
+            elif word.startswith("-"):
+                self.append_text(usage, color="yellow")
+                return
+            else:
+                paths.append(self._resolve_path(word))
+        if check:
+            if not os.path.isfile(check):
+                self.append_text(f"hash: no such checksum file {check}\n", color="red")
+                return
+            job = HashJob(None, f"hash {spec}", self.current_dir, algo=algo, check=check, workers=workers)
+        else:
+            if not paths:
+                self.append_text(usage, color="yellow")
+                return
+            missing = [p for p in paths if not os.path.exists(p)]
+            if missing:
+                self.append_text(f"hash: no such file or directory {missing[0]}\n", color="red")
+                return
+            algo = algo or "sha256"
+            if manifest:
+                if len(paths) != 1 or not os.path.isdir(paths[0]):
+                    self.append_text("hash: --manifest needs exactly one directory\n", color="red")
+                    return
+                manifest = os.path.join(paths[0], f"{algo.upper()}SUMS")
+            job = HashJob(None, f"hash {spec}", self.current_dir, paths, algo=algo,
+                          manifest=manifest or None, workers=workers)
+        job.id = self.job_manager.next_id()
+        if background:
+            self.job_manager.add(job, on_finished=self._job_finished)
+            self.append_text(f"[{job.id}] hash started in the background\n", color="gray", animate=False)
+            return
+        if self.fg_job is not None:
+            self._detach_foreground()
+        self.job_manager.add(job, sink=self._job_sink, on_finished=self._job_finished, background=False)
+        self.fg_job = job.id
+
+    def compress_files(self, spec, background=False):
+        """compress [-j N] [--level N] [--force] OUTPUT.{zip,tar.gz,tgz,tar} INPUT... as a job."""
+        usage = "Usage: compress [-j N] [--level 1-9] [--force] <output.zip|.tar.gz|.tar> <input>...\n"
+        try:
+            words = [w.strip('"') for w in shlex.split(spec, posix=os.name != "nt")]
+        except ValueError as e:
+            self.append_text(f"compress error: {e}\n", color="red")
+            return
+        workers, level, force, paths = os.cpu_count() or 1, 6, False, []
+        while words:
+            word = words.pop(0)
+            if word == "-j" and words and words[0].isdigit():
+                workers = max(1, int(words.pop(0)))
+            elif word == "--level" and words and words[0] in tuple("123456789"):
+                level = int(words.pop(0))
+            elif word == "--force":
+                force = True
+            elif word.startswith("-"):
+                self.append_text(usage, color="yellow")
+                return
+            else:
+                paths.append(self._resolve_path(word))
+        if len(paths) < 2:
+            self.append_text(usage, color="yellow")
+            return
+        output, inputs = paths[0], paths[1:]
+        if not output.lower().endswith((".zip", ".tar.gz", ".tgz", ".tar")):
+            self.append_text("compress: the output must end in .zip, .tar.gz, .tgz or .tar\n", color="red")
+            return
+        missing = [p for p in inputs if not os.path.exists(p)]
+        if missing:
+            self.append_text(f"compress: no such file or directory {missing[0]}\n", color="red")
+            return
+        if os.path.exists(output) and not force:
+            self.append_text(f"compress: {output} exists (add --force to replace it)\n", color="red")
+            return
+        job = CompressJob(self.job_manager.next_id(), f"compress {spec}", self.current_dir, output, inputs,
+                          level=level, workers=workers)
+        if background:
+            self.job_manager.add(job, on_finished=self._job_finished)
+            self.append_text(f"[{job.id}] compress started in the background\n", color="gray", animate=False)
+            return
+        if self.fg_job is not None:
+            self._detach_foreground()
+        self.job_manager.add(job, sink=self._job_sink, on_finished=self._job_finished, background=False)
+        self.fg_job = job.id
+        self.append_text(f"[{job.id}] compressing on {workers} threads; 'kill %{job.id}' cancels\n", color="gray", animate=False)
+
+    # ---- calc and py ----
+    def calc_expr(self, expr):
+        """Evaluate a calc statement in the worker, or handle calc mode/vars/clear/funcs."""
+        words = expr.split()
+        if words[0] == "mode" and len(words) <= 2:
+            if len(words) == 2:
+                if words[1] not in ("float", "decimal", "fraction"):
+                    self.append_text("Usage: calc mode float|decimal|fraction\n", color="yellow")
+                    return
+                self.calc_mode = words[1]
+            self.append_text(f"calc mode: {self.calc_mode}\n", color="cyan")
+        elif expr == "vars":
+            if not self.calc_vars:
+                self.append_text("No calc variables yet. Assign one with 'calc x = 3'.\n", color="yellow")
+            for name, value in sorted(self.calc_vars.items()):
+                try:
+                    shown = calc_format(value)
+                except (OverflowError, ValueError):
+                    # ValueError: this process keeps Python's default int-to-str digit limit
+                    shown = "(too large to show)"
+                self.append_text(f"  {name} = {shown}\n", color="white", animate=False)
+        elif expr == "clear":
+            self.calc_vars.clear()
+            self.append_text("✓ calc variables cleared.\n", color="green")
+        elif expr == "funcs":
+            names = sorted(set(CALC_FUNCTIONS) | set(CALC_FLOAT_FUNCTIONS))
+            self.append_text("Functions: " + ", ".join(names) + "\n", color="cyan", animate=False)
+            for name, (value, about) in CALC_CONSTANTS.items():
+                self.append_text(f"  {name:8} {value:<24.12g} {about}\n", color="white", animate=False)
+        else:
+            self._calc_queue.append(expr)
+            if not self._calc_timer.isActive():
+                self._start_calc()
+
+    def _start_calc(self):
+        try:
+            self.calc_worker.submit(self._calc_queue[0], self.calc_mode, self.calc_vars)
+            self._calc_timer.start()
+        except Exception as e:
+            self._calc_queue.popleft()
+            self.append_text(f"Calc error: {e}\n", color="red")
+
+    def _poll_calc(self):
+        result = self.calc_worker.poll()
+        if result is None:
+            return
+        self._calc_timer.stop()
+        self._calc_queue.popleft()
+        status, text, target, value = result
+        if status == "ok":
+            self.calc_vars[target or "ans"] = value
+            self.append_text(f"{target} = {text}\n" if target else f"{text}\n", color="green")
+        else:
+            self.append_text(f"Calc error: {text}\n", color="red")
+        if self._calc_queue:
+            self._start_calc()
+
+    def py_command(self, arg, pane="main", sink=None):
+        """py CODE | py interrupt | py restart | py (status), for one of the session's kernels.
+
+        Each ``pane`` has its own kernel; its output goes to ``sink(job, chunks)``,
+        by default the session's own output.
+        """
+        if pane not in self.kernels:
+            self.kernels[pane] = PythonKernel(pane)
+            self._py_queue[pane] = collections.deque()
+        self._py_sinks[pane] = sink or self._job_sink
+        kernel = self.kernels[pane]
+        say = self.append_text if sink is None else (lambda text, color="default": sink(None, [("stdout", text)]))
+        if arg in ("interrupt", "stop"):
+            self._py_queue[pane].clear()
+            if not kernel.interrupt():
+                say("py: nothing is running.\n", color="yellow")
+        elif arg == "restart":
+            self._py_queue[pane].clear()
+            kernel.stop()
+            say("✓ py kernel restarted.\n", color="green")
+        elif not arg:
+            if kernel.alive:
+                state = "busy" if kernel.busy else "idle"
+                say(f"py kernel ({pane}): pid {kernel.process.pid}, {state}, up {int(time.time() - kernel.started)}s\n", color="cyan")
+            else:
+                say(f"py kernel ({pane}) not started. Usage: py <code> | py interrupt | py restart\n", color="yellow")
+        else:
+            self._py_queue[pane].append(arg)
+            if not kernel.busy:
+                self._start_py(pane)
+
+    def _start_py(self, pane):
+        try:
+            self.kernels[pane].run(self._py_queue[pane].popleft(), self.current_dir)
+            self._py_timer.start()
+        except Exception as e:
+            self._py_output(pane, [("stderr", f"py error: {e}\n")])
+
+    def _py_output(self, pane, chunks):
+        self._py_sinks[pane](None, chunks)
+
+    def _poll_kernels(self):
+        for pane, kernel in self.kernels.items():
+            if not kernel.busy:
+                continue
+            chunks = []
+            for kind, payload in kernel.poll():
+                if kind in ("stdout", "stderr"):
+                    chunks.append((kind, payload))
+                elif kind == "died":
+                    chunks.append(("stderr", payload + "\n"))
+                elif payload:
+                    chunks.append(("stderr", payload + "\n"))
+            if chunks:
+                self._py_output(pane, chunks)
+            if not kernel.busy and self._py_queue[pane]:
+                self._start_py(pane)
+        if not any(kernel.busy for kernel in self.kernels.values()):
+            self._py_timer.stop()
+
+    # ---- system ----
+    def show_wifi_passwords(self, show=False, refresh=False):
+        """List saved Wi-Fi profiles; keys are looked up concurrently and shown as they arrive."""
+        if self.wifi_backend is None:
+            self.append_text("wifcode is only supported on Windows and Linux (NetworkManager).\n", color="red", animate=False)
+            return
+        if self._wifi_timer.isActive():
+            self.append_text("wifcode is already running.\n", color="yellow", animate=False)
+            return
+        if refresh:
+            self.wifi_backend.clear_cache()
+        threading.Thread(target=self._wifi_lookup, args=(self.wifi_backend, show), daemon=True).start()
+        self._wifi_timer.start()
+
+    def _wifi_lookup(self, backend, show):
+        """Worker thread: puts (text, color) on the queue, then None when finished."""
+        import concurrent.futures
+        put = self._wifi_queue.put
+        start = time.perf_counter()
+        try:
+            profiles = backend.profiles()
+        except Exception as e:
+            put((f"Error fetching Wi-Fi profiles: {e}\n", "red"))
+            put(None)
+            return
+        if not profiles:
+            put(("No saved Wi-Fi profiles found.\n", "yellow"))
+            put(None)
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(profiles))) as pool:
+            futures = {pool.submit(backend.key, profile): profile for profile in profiles}
+            for future in concurrent.futures.as_completed(futures):
+                profile = futures[future]
+                try:
+                    password = future.result()
+                except Exception as e:
+                    put((f"{profile}: Error reading profile ({e})\n", "red"))
+                    continue
+                if password is None:
+                    put((f"{profile}: <no password or open network>\n", "yellow"))
+                elif show:
+                    put((f"{profile}: {password}\n", "green"))
+                else:
+                    put((f"{profile}: <hidden> (use 'wifcode --show')\n", "yellow"))
+        put((f"({len(profiles)} profiles via {backend.name} in {(time.perf_counter() - start) * 1000:.0f} ms)\n", "gray"))
+        put(None)
+
+    def _poll_wifi(self):
+        while True:
+            try:
+                item = self._wifi_queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is None:
+                self._wifi_timer.stop()
+                return
+            self.append_text(item[0], color=item[1], animate=False)
+
+    def start_server(self, port=8000):
+        server = self.job_manager.get(self.server_job) if self.server_job else None
+        if server and server.status in ("running", "queued"):
+            self.append_text(f"Server already running (job {server.id}).\n", color="yellow")
+            return
+        try:
+            cmd = [sys.executable, "-m", "http.server", str(port)]
+            job = self.run_background(f"serve {port}", args=cmd, shell=False)
+            self.server_job = job.id
+            if job.status == "queued":
+                self.append_text(f"Server queued behind the background job limit (job {job.id}); it will serve "
+                                 f"{self.current_dir} at http://localhost:{port}/ once a slot frees "
+                                 f"('jobs --limit N' raises the limit)\n", color="yellow")
+            elif job.status != "failed":
+                self.append_text(f"Serving {self.current_dir} at http://localhost:{port}/ (job {job.id})\n", color="green")
+        except Exception as e:
+            self.append_text(f"Serve error: {e}\n", color="red")
+
+    def stop_server(self):
+        server = self.job_manager.get(self.server_job) if self.server_job else None
+        if not server or server.status not in ("running", "queued"):
+            self.append_text("No server running.\n", color="gray")
+            self.server_job = None
+            return
+        try:
+            self.job_manager.kill(server.id)
+            self.append_text("Server stopped.\n", color="green")
+        except Exception as e:
+            self.append_text(f"Stop server error: {e}\n", color="red")
+        finally:
+            self.server_job = None
+
+    def mops_install(self, package):
+        try:
+            self.append_text(f"Installing {package}...\n", color="cyan")
+            cmd = [sys.executable, "-m", "pip", "install", package]
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            for line in proc.stdout:
+                self.append_text(line, color="white")
+            proc.wait()
+            if proc.returncode == 0:
+                self.append_text(f"Installed {package}.\n", color="green")
+            else:
+                self.append_text(f"Installation failed (exit {proc.returncode}).\n", color="red")
+        except Exception as e:
+            self.append_text(f"mops install error: {e}\n", color="red")
+    
+
+
+ENGINE_MAX_FRAME = 16 * 1024 * 1024
+
+
+def engine_address(spec):
+    """Map ``PORT``/``localhost:PORT`` to loopback TCP and anything else to a Unix socket path."""
+    m = re.fullmatch(r"(?:(localhost|127\.0\.0\.1):)?(\d+)", spec.strip())
+    if m:
+        return socket.AF_INET, ("127.0.0.1", int(m.group(2)))
+    if not hasattr(socket, "AF_UNIX"):
+        raise ValueError("Unix sockets are not available here; use PORT or localhost:PORT")
+    return socket.AF_UNIX, spec
+
+
+def engine_frame(message):
+    """Encode one message: 4-byte big-endian length, then compact UTF-8 JSON."""
+    data = json.dumps(message, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return struct.pack(">I", len(data)) + data
+
+
+def engine_frames(sock):
+    """Yield decoded messages from ``sock`` until it closes."""
+    buf = bytearray()
+    while True:
+        try:
+            data = sock.recv(256 * 1024)
+        except OSError:
+            return
+        if not data:
+            return
+        buf += data
+        while len(buf) >= 4:
+            size = struct.unpack_from(">I", buf)[0]
+            if size > ENGINE_MAX_FRAME:
+                raise ValueError(f"frame of {size} bytes is too large")
+            if len(buf) < 4 + size:
+                break
+            message = json.loads(bytes(buf[4:4 + size]).decode("utf-8"))
+            del buf[:4 + size]
+            yield message
+
+
+class EngineServer(QObject):
+    """Serves TerminalEngine sessions to local clients over a framed socket protocol.
+
+    Each connection gets a reader thread and a writer thread that sends
+    whatever has queued up since its last write in one ``sendall``. Requests
+    are handed to the thread running the Qt event loop, where the engines
+    live, and the reader waits for the reply. A client that falls more than
+    ``CLIENT_QUEUE`` events behind is told the last ``seq`` it got and
+    disconnected; it can attach again from there, and other clients are
+    never held up. On TCP (loopback only)
+    clients must present ``token``; a Unix socket is created mode 0600.
+    """
+
+    CLIENT_QUEUE = 20000
+
+    _request = pyqtSignal(object)
+
+    def __init__(self, spec, token=None, parent=None):
+        super().__init__(parent)
+        self.family, self.address = engine_address(spec)
+        self.token = token
+        if self.family == socket.AF_INET and token is None:
+            import secrets
+            self.token = secrets.token_urlsafe(16)
+        self.sessions = {}
+        # One path index for every session
+        self.find_index = PathIndex(TerminalEngine.FIND_INDEX)
+        self._sock = None
+        self._conns = set()
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+        # Emitted from reader threads, so the slot runs queued on this object's thread
+        self._request.connect(self._run_request)
+
+    @property
+    def spec(self):
+        return f"localhost:{self.address[1]}" if self.family == socket.AF_INET else self.address
+
+    def session(self, name):
+        if name not in self.sessions:
+            self.sessions[name] = TerminalEngine(name, find_index=self.find_index, parent=self)
+        return self.sessions[name]
+
+    def start(self):
+        """Bind and accept connections on a background thread."""
+        if self.family == socket.AF_UNIX:
+            self._clear_stale_socket()
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_UNIX:
+            old_umask = os.umask(0o177)
+            try:
+                sock.bind(self.address)
+            finally:
+                os.umask(old_umask)
+        else:
+            sock.bind(self.address)
+            self.address = sock.getsockname()[:2]
+        sock.listen(16)
+        self._sock = sock
+        threading.Thread(target=self._accept, daemon=True).start()
+        if os.path.exists(self.find_index.path):
+            QTimer.singleShot(3000, self.find_index.refresh_async)
+        return self
+
+    def _clear_stale_socket(self):
+        """Remove a socket left by a dead server; refuse anything else at the path."""
+        try:
+            mode = os.lstat(self.address).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise OSError(errno.EEXIST, f"{self.address} exists and is not a socket")
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.address)
+        except ConnectionRefusedError:
+            os.remove(self.address)
+            return
+        finally:
+            probe.close()
+        raise OSError(errno.EADDRINUSE, f"a server is already listening on {self.address}")
+
+    def serve_forever(self):
+        """Run the Qt event loop until ``close`` (or a signal that sets it)."""
+        app = QCoreApplication.instance() or QCoreApplication(sys.argv)
+        if self._sock is None:
+            self.start()
+        # Wakes the loop so Python signal handlers run and a close is noticed
+        tick = QTimer()
+        tick.timeout.connect(lambda: self._closed.is_set() and app.quit())
+        tick.start(200)
+        try:
+            app.exec_()
+        finally:
+            tick.stop()
+            self.close()
+
+    def close(self):
+        self._closed.set()
+        if self._sock is not None:
+            self._sock.close()
+            if self.family == socket.AF_UNIX and os.path.exists(self.address):
+                os.remove(self.address)
+        with self._lock:
+            conns = list(self._conns)
+        for conn in conns:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for engine in list(self.sessions.values()):
+            engine.close()
+
+    def _call(self, fn, *args):
+        """Run ``fn`` on the event loop thread and return its result."""
+        future = concurrent.futures.Future()
+        self._request.emit((fn, args, future))
+        return future.result()
+
+    def _run_request(self, request):
+        fn, args, future = request
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _accept(self):
+        while not self._closed.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve_client, args=(conn,), daemon=True).start()
+
+    def _serve_client(self, conn):
+        with self._lock:
+            self._conns.add(conn)
+        out = queue.Queue()
+        lagging = threading.Event()
+        state = {"engine": None, "seq": 0}
+
+        def deliver(event):
+            # Runs under the engine lock: only count and queue
+            if lagging.is_set():
+                return
+            if out.qsize() >= self.CLIENT_QUEUE:
+                lagging.set()
+                out.put(None)
+                return
+            out.put(event)
+
+        writer = threading.Thread(target=self._write_client, args=(conn, out, lagging, state), daemon=True)
+        writer.start()
+        try:
+            for message in engine_frames(conn):
+                reply = self._call(self._handle, message, state, deliver)
+                if reply is not None:
+                    out.put(reply)
+                if reply is not None and reply.get("type") == "error" and reply.get("fatal"):
+                    break
+        except Exception as e:
+            out.put({"type": "error", "message": str(e)})
+        finally:
+            if state["engine"] is not None:
+                state["engine"].unsubscribe(deliver)
+            out.put(None)
+            writer.join(timeout=5)
+            with self._lock:
+                self._conns.discard(conn)
+            conn.close()
+
+    def _handle(self, message, state, deliver):
+        op = message.get("op")
+        engine = state["engine"]
+        if op == "attach":
+            if self.token is not None and not hmac.compare_digest(str(message.get("token") or "").encode(),
+                                                                  self.token.encode()):
+                return {"type": "error", "message": "bad or missing token", "fatal": True}
+            if engine is not None:
+                engine.unsubscribe(deliver)
+            engine = state["engine"] = self.session(str(message.get("session") or "main"))
+            # The reply goes first; the backlog after 'since' follows from subscribe
+            state_reply = {"type": "attached", "session": engine.name, "cwd": engine.current_dir, "seq": engine.seq,
+                           "clients": engine.subscriber_count() + 1}
+            deliver(state_reply)
+            engine.subscribe(deliver, since=int(message.get("since") or 0))
+            return None
+        if engine is None:
+            return {"type": "error", "message": "attach first", "fatal": True}
+        if op == "exec":
+            job = engine.execute(str(message.get("cmd", "")))
+            return {"type": "ack", "id": message.get("id"), "job": job}
+        if op == "kill":
+            ok = engine.job_manager.kill(message.get("job")) is not None
+            return {"type": "ack", "id": message.get("id"), "ok": ok}
+        if op == "history":
+            return {"type": "history", "id": message.get("id"), "items": list(engine.command_history)}
+        if op == "ping":
+            return {"type": "pong", "id": message.get("id"), "seq": engine.seq}
+        return {"type": "error", "message": f"unknown op {op!r}"}
+
+    def _write_client(self, conn, out, lagging, state):
+        while True:
+            batch = [out.get()]
+            while len(batch) < 512:
+                try:
+                    batch.append(out.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            frames = []
+            for message in batch:
+                if message is None:
+                    break
+                if "seq" in message and "type" not in message:
+                    state["seq"] = message["seq"]
+                    # 'animate' is a rendering hint for the local window only
+                    message = {"type": "output", **{k: v for k, v in message.items() if k != "animate"}}
+                frames.append(engine_frame(message))
+            if lagging.is_set() and stop:
+                frames.append(engine_frame({"type": "error", "message": "client fell behind; attach again with since",
+                                            "since": state["seq"]}))
+            try:
+                conn.sendall(b"".join(frames))
+            except OSError:
+                return
+            if stop:
+                if lagging.is_set():
+                    try:
+                        conn.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+                return
+
+
+class EngineClient:
+    """A connection to an EngineServer session, for scripts, tests and the Qt UI.
+
+    Messages are read on a background thread and passed to ``on_message``,
+    or queued on ``messages`` when no callback is given. A final
+    ``{"type": "closed"}`` marks the end of the connection.
+    """
+
+    def __init__(self, spec, session="main", since=0, token=None, on_message=None):
+        family, address = engine_address(spec)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(address)
+        self.messages = queue.Queue()
+        self.on_message = on_message or self.messages.put
+        self.last_seq = since
+        self._ids = itertools.count(1)
+        self._send_lock = threading.Lock()
+        self.send({"op": "attach", "session": session, "since": since,
+                   "token": token or os.environ.get("MOPS_SERVE_TOKEN")})
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def send(self, message):
+        with self._send_lock:
+            self.sock.sendall(engine_frame(message))
+
+    def execute(self, cmd):
+        """Run ``cmd`` in the session; returns the request id echoed in the ack."""
+        request = next(self._ids)
+        self.send({"op": "exec", "cmd": cmd, "id": request})
+        return request
+
+    def kill(self, job_id):
+        self.send({"op": "kill", "job": job_id, "id": next(self._ids)})
+
+    def _read(self):
+        try:
+            for message in engine_frames(self.sock):
+                if message.get("type") == "output":
+                    self.last_seq = message["seq"]
+                self.on_message(message)
+        except ValueError:
+            pass
+        self.on_message({"type": "closed"})
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def serve_sessions(spec):
+    """``--serve-socket``: run headless sessions until interrupted."""
+    QCoreApplication.instance() or QCoreApplication(sys.argv)
+    server = EngineServer(spec, token=os.environ.get("MOPS_SERVE_TOKEN"))
+    for name in ("SIGINT", "SIGTERM"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), lambda *_: server._closed.set())
+    try:
+        server.start()
+    except OSError as e:
+        print(f"mops: cannot serve on {spec}: {e}", file=sys.stderr)
+        return 1
+    print(f"Serving mops sessions on {server.spec}", flush=True)
+    if server.token:
+        print(f"Clients must send token {server.token} (or set MOPS_SERVE_TOKEN)", flush=True)
+    server.serve_forever()
+    return 0
+
+
+def _engine_attr(name):
+    """A window attribute that is really its engine's, so there is one copy of it."""
+    return property(lambda self: getattr(self.engine, name), lambda self, value: setattr(self.engine, name, value))
+
+
 class MopsTerminal(QWidget):
-    def __init__(self):
+    # Ghostty-style color palette
+    COLORS = {
+        "cyan": "#8be9fd",
+        "green": "#50fa7b",
+        "red": "#ff5555",
+        "yellow": "#f1fa8c",
+        "white": "#f8f8f2",
+        "default": "#d0d0d0",
+        "gray": "#6272a4",
+        "black": "#0f0f0f",
+    }
+    # 'type'/'cat' open the pager instead of dumping files larger than this
+    PAGER_THRESHOLD = 1024 * 1024
+    SESSION_LOG_DIR = os.path.expanduser("~/.mops_logs")
+    SESSION_FILE = os.path.expanduser("~/.mops_session")
+    FAVORITES_DB = os.path.expanduser("~/.mops_favorites.db")
+    CACHE_CONFIG = os.path.expanduser("~/.mops_cache.json")
+    DIAGNOSTICS_LOG = os.path.expanduser("~/.mops_diagnostics.log")
+    FIND_INDEX = os.path.expanduser("~/.mops_find_index")
+    # How much scrollback per pane is kept across restarts
+    SESSION_SCROLLBACK = 256 * 1024
+
+    # Session state that lives in the engine
+    current_dir = _engine_attr("current_dir")
+    command_history = _engine_attr("command_history")
+    job_manager = _engine_attr("job_manager")
+    fg_job = _engine_attr("fg_job")
+    _perf_current = _engine_attr("_perf_current")
+
+    def __init__(self, restore_session=True):
         super().__init__()
-        self.command_history = []
+        # Dispatch, jobs, history and the working directory; the window adds its own commands
+        self.engine = TerminalEngine(cache_config=self.CACHE_CONFIG, find_index=PathIndex(self.FIND_INDEX), parent=self)
         self.history_index = -1
-        self.current_dir = os.getcwd()
 
         # Window setup
         self.setWindowTitle("mopsrs terminal")
@@ -227,6 +6443,10 @@ class MopsTerminal(QWidget):
         """)
         terminal_layout.addWidget(self.output, 1)
 
+        # Find-in-scrollback bar (Ctrl+F), shared by both panes
+        self.find_bar = FindBar()
+        terminal_layout.addWidget(self.find_bar)
+
         # Input line
         self.input = QLineEdit()
         self.input.setFont(monospace_font)
@@ -303,6 +6523,14 @@ class MopsTerminal(QWidget):
         split_layout.addWidget(self.secondary_input)
         self.secondary_input.returnPressed.connect(self.handle_secondary_command)
 
+        self._secondary_echo_open = False
+
+        # Scrollback indexes for Ctrl+F
+        self.output_index = ScrollbackIndex(self.output)
+        self.secondary_index = ScrollbackIndex(self.secondary_output)
+        self.find_shortcut = QShortcut(QKeySequence("Ctrl+F"), self)
+        self.find_shortcut.activated.connect(self.open_find_bar)
+
         # Terminal splitter (for horizontal/vertical splits)
         self.terminal_splitter = QSplitter(Qt.Vertical)
         self.terminal_splitter.setStyleSheet("QSplitter::handle { background-color: #1a1a1a; height: 2px; }")
@@ -389,6 +6617,19 @@ class MopsTerminal(QWidget):
         adv_time.setStyleSheet("QLabel { color: #3a3a3a; font-size: 7px; margin-left: 16px; margin-top: -2px; }")
         settings_layout.addWidget(adv_time)
 
+        # Session log toggle
+        log_container = QHBoxLayout()
+        log_container.setSpacing(8)
+        log_container.setContentsMargins(0, 4, 0, 4)
+        log_label = QLabel("session log")
+        log_label.setStyleSheet("QLabel { color: #8a8a8a; font-size: 12px; }")
+        self.toggle_session_log = LeverToggle(checked=False, width=44, height=22)
+        self.toggle_session_log.toggled.connect(self.set_session_logging)
+        log_container.addWidget(log_label)
+        log_container.addStretch()
+        log_container.addWidget(self.toggle_session_log)
+        settings_layout.addLayout(log_container)
+
         # Split view button
         self.split_view_button = QPushButton("split view")
         self.split_view_button.setStyleSheet("""
@@ -429,6 +6670,11 @@ class MopsTerminal(QWidget):
         dir_time.setStyleSheet("QLabel { color: #2a2a2a; font-size: 8px; margin-top: 2px; }")
         settings_layout.addWidget(dir_time)
 
+        # Event-loop stall counter (see 'diag')
+        self.stall_label = QLabel("stalls: 0")
+        self.stall_label.setStyleSheet("QLabel { color: #5a5a5a; font-size: 10px; margin-top: 6px; }")
+        settings_layout.addWidget(self.stall_label)
+
         # Stretch at bottom
         settings_layout.addStretch()
 
@@ -461,10 +6707,13 @@ class MopsTerminal(QWidget):
         # Completer
         self.base_commands = [
             "help", "?", "clear", "cls", "exit", "pwd", "cd", "ls", "dir",
-            "whoami", "systeminfo", "ipconfig", "tasklist", "mkdir", "del", "copy",
+            "whoami", "systeminfo", "ipconfig", "tasklist", "mkdir", "del", "copy", "move", "du", "find", "hash", "hash --check", "compress",
             "type", "calc", "tree", "open", "echo",
             "search", "mkcd", "extract", "serve", "stopserve", "mops", "mops install", "wifcode",
-            "newwindow", "splitview", "favorite", "favorites", "advancedmode", "tutorial"
+            "newwindow", "attach", "detach", "splitview", "favorite", "favorites", "fav", "fav run", "advancedmode", "tutorial",
+            "jobs", "fg", "kill", "parallel", "watch", "top", "table", "view", "less", "follow", "sessionlog",
+            "record", "replay", "session", "cache",
+            "py", "py interrupt", "py restart", "perf", "diag"
         ]
         self.completer_model = QStringListModel()
         self.completer = QCompleter(self.completer_model, self)
@@ -473,8 +6722,42 @@ class MopsTerminal(QWidget):
         self.input.setCompleter(self.completer)
         self.update_completer_model()
 
-        # Server handle
-        self.server_process = None
+        # Opt-in session transcript (see 'sessionlog')
+        self.session_log = None
+        # 'record' / 'replay' state
+        self.recorder = None
+        self.replay = None
+
+        # Event-loop stall watchdog (see 'diag')
+        self.last_command = None
+        self.watchdog = StallWatchdog(self, self._stall_context, self.DIAGNOSTICS_LOG)
+        self._stalls_shown = 0
+        self._stall_label_timer = QTimer(self)
+        self._stall_label_timer.timeout.connect(self._update_stall_label)
+        self._stall_label_timer.start(1000)
+
+        # Per-command timing spans (see 'perf'); off until 'perf on'
+        self.perf = PerfTracer()
+
+        # 'attach' connects this window to a served session (see --serve-socket)
+        self.remote = None
+        self.remote_spec = None
+        self._remote_queue = queue.Queue()
+        self._remote_timer = QTimer(self)
+        self._remote_timer.setInterval(20)
+        self._remote_timer.timeout.connect(self._poll_remote)
+
+        # The path index behind 'find' is refreshed shortly after startup
+        if os.path.exists(self.FIND_INDEX):
+            QTimer.singleShot(3000, self.engine.find_index.refresh_async)
+
+        self.watch_session = None
+
+        # Engine output is shown in the main pane
+        self.engine.subscribe(self._render_event)
+        self.engine.directory_changed.connect(self.update_dir_label)
+        self.engine.job_done.connect(self._log_job)
+        self._register_commands()
 
         # Animation helpers
         self._anim_timers = []
@@ -494,24 +6777,26 @@ class MopsTerminal(QWidget):
         # line wrap setting
         self.line_wrap_enabled = False
         
+        # Session persistence (only the first window owns the session file)
+        self.session_store = SessionStore(self.SESSION_FILE) if restore_session else None
+        self._session_saved_key = None
+        restored = self.restore_session_state()
+        if self.session_store is not None:
+            self._session_timer = QTimer(self)
+            self._session_timer.timeout.connect(self.autosave_session)
+            self._session_timer.start(30000)
+
         # Show startup screen for user selection
-        self.show_startup_screen()
+        self.show_startup_screen(show_dialog=not restored)
 
     # ---------------- UI / Animation ----------------
-    def append_text(self, text, color="default", animate=True):
+    def append_text(self, text, color="default", animate=True, stream="ui"):
         """Append text to output with specified color and optional animation."""
-        # Ghostty-style color palette
-        color_map = {
-            "cyan": "#8be9fd",
-            "green": "#50fa7b",
-            "red": "#ff5555",
-            "yellow": "#f1fa8c",
-            "white": "#f8f8f2",
-            "default": "#d0d0d0",
-            "gray": "#6272a4",
-            "black": "#0f0f0f",
-        }
-        html_color = color_map.get(color, color_map["default"])
+        if self.session_log is not None:
+            self.session_log.log("output", pane="main", stream=stream, text=text)
+        if self.recorder is not None and stream != "replay":
+            self.recorder.output(text, color)
+        html_color = self.COLORS.get(color, self.COLORS["default"])
         
         # Add timestamp prefix if enabled
         try:
@@ -608,14 +6893,15 @@ class MopsTerminal(QWidget):
         self.append_text(logo_text, color="white", animate=True)
 
     # ----------------  Startup Screen ----------------
-    def show_startup_screen(self):
+    def show_startup_screen(self, show_dialog=True):
         """Display the initial startup screen with user options."""
         splash = "mopsrs terminal\nType 'help' for commands.\n\n"
         self.output.clear()
         self.append_text(splash, color="cyan", animate=False)
         self.input.setFocus()
         # show a small dialog with the two quick choices
-        QTimer.singleShot(150, self.show_startup_dialog)
+        if show_dialog:
+            QTimer.singleShot(150, self.show_startup_dialog)
 
     def show_startup_dialog(self):
         """Present a simple dialog with two options for new/experienced users."""
@@ -747,163 +7033,739 @@ Advanced mode enables:
   5. 'tree /L:2' shows folder structure 2 levels deep
   6. You can run ANY Windows command here!
 
-🎓 NEXT STEPS
-─────────────────────────────────────────────────────────────────────────────────
+🎓 NEXT STEPS
+─────────────────────────────────────────────────────────────────────────────────
+
+  1. Try navigating your computer with 'cd' and 'ls'
+  2. Enable split view with 'splitview'
+  3. Add a favorite command with 'favorite [command]'
+  4. When comfortable, type 'advancedmode on'
+  5. Read full help with 'help' anytime
+
+═══════════════════════════════════════════════════════════════════════════════
+
+Ready? Start typing commands!  Type 'exit' to quit anytime.
+
+═══════════════════════════════════════════════════════════════════════════════
+"""
+        self.output.clear()
+        self.append_text(tutorial, color="green", animate=False)
+        self.append_text("\n> ", color="yellow", animate=False)
+
+    def show_welcome(self):
+        """Show minimal welcome message."""
+        self.output.clear()
+        logo = "mopsrs terminal\n"
+        self.append_text(logo, color="cyan", animate=False)
+        self.append_text("\n", color="default", animate=False)
+
+    # ---------------- Input handling ----------------
+    def _register_commands(self):
+        """Add the window's own commands to its engine; the shell-level ones are the engine's."""
+        engine = self.engine
+        for name, handler, args in (
+            ("help", lambda _: self.show_help() if self.tutorial_mode else self.show_tutorial(), "bare"),
+            ("?", lambda _: self.show_help(), "bare"),
+            # Startup screen choices
+            ("1", lambda _: self._startup_choice("1"), "bare"),
+            ("2", lambda _: self._startup_choice("2"), "bare"),
+            ("start", lambda _: self._startup_choice("start"), "bare"),
+            ("clear", lambda _: self._clear_output(), "bare"),
+            ("cls", lambda _: self._clear_output(), "bare"),
+            ("exit", lambda _: self.close(), "bare"),
+            ("attach", self.attach_session, "any"),
+            ("detach", lambda _: self.detach_session(), "bare"),
+            ("newwindow", lambda _: self.open_new_window(), "bare"),
+            ("splitview", lambda _: self.toggle_split_view(), "bare"),
+            ("favorite", self.add_favorite, "required"),
+            ("favorites", lambda _: self.list_favorites(), "bare"),
+            ("fav", lambda rest: self.favorite_command(rest) if rest else self.list_favorites(), "any"),
+            ("tutorial", lambda _: self.show_tutorial(), "bare"),
+            ("advancedmode", lambda rest: self.toggle_advanced_mode(f"advancedmode {rest}"), "any"),
+            ("sessionlog", lambda rest: self.session_log_command(f"sessionlog {rest}"), "any"),
+            ("diag", lambda rest: self.show_diagnostics(rest.split()), "any"),
+            ("perf", lambda rest: self.perf_command(rest.split()), "any"),
+            ("session", lambda rest: self.session_command(rest.split()), "any"),
+            ("record", lambda rest: self.record_command(rest.split()), "any"),
+            ("replay", self.replay_command, "required"),
+            ("watch", self.start_watch, "any"),
+            ("top", self.open_top, "any"),
+            ("table", self.open_table_file, "required"),
+            ("view", self.open_pager, "required"),
+            ("less", self.open_pager, "required"),
+            ("type", lambda rest: self._show_file("type", rest), "required"),
+            ("cat", lambda rest: self._show_file("cat", rest), "required"),
+        ):
+            engine.register(name, handler, args)
+        engine.register("follow", self.follow_files, "required", background=True)
+        # 'CMD | table' shows the command's output in a table view
+        engine.register_pipe("table", self.table_from_command)
+
+    def _startup_choice(self, choice):
+        if self.tutorial_mode:
+            self.engine.execute_command(choice)
+        elif choice == "1":
+            self.show_tutorial()
+        else:
+            self.show_welcome()
+
+    def _clear_output(self):
+        self.output.clear()
+        self.show_welcome()
+
+    def _show_file(self, name, path):
+        # Large files open in the pager instead of being dumped into the pane
+        if self._is_large_file(path):
+            self.open_pager(path)
+        else:
+            self.engine.execute_command(f"{name} {path}")
+
+    def _render_event(self, event):
+        """Show an engine event in the main pane."""
+        text, stream, color = event["text"], event["stream"], event["color"]
+        if not text:
+            return
+        if stream == "echo":
+            text = f"\n{text}"
+        if self.show_timestamps and stream in ("stdout", "stderr"):
+            # One timestamp per line of output
+            for line in text.splitlines(True):
+                self.append_text(line, color=color, animate=False, stream=stream)
+            return
+        self.append_text(text, color=color, animate=event.get("animate", False), stream=stream)
+
+    def _log_job(self, job):
+        if self.session_log is not None:
+            self.session_log.log("exit", cmd=job.cmd, job=job.id, code=job.returncode, status=job.status)
+
+    def follow_files(self, spec, background=False):
+        """follow --split streams into the secondary pane; everything else is the engine's follow."""
+        words = spec.split()
+        if "--split" not in words or background:
+            self.engine.follow_files(" ".join(w for w in words if w != "--split"), background=background)
+            return
+        if not self.split_view_enabled:
+            self.toggle_split_view()
+        self.engine.follow_files(" ".join(w for w in words if w != "--split"), sink=self._secondary_sink)
+
+    def handle_command(self):
+        cmd = self.input.text().strip()
+        if not cmd:
+            return
+        if self.session_log is not None:
+            self.session_log.log("command", pane="main", cmd=cmd, cwd=self.current_dir)
+        if self.recorder is not None:
+            self.recorder.command(cmd)
+        if self.favorites is not None and self.favorites.is_favorite_command(cmd):
+            self.favorites.touch(cmd)
+        if self.remote is not None and cmd.lower() != "detach":
+            # Attached: the session echoes the command back to every client
+            self.input.clear()
+            try:
+                self.remote.execute(cmd)
+            except OSError as e:
+                self.append_text(f"Session error: {e}\n", color="red")
+                self._drop_remote()
+                return
+            if cmd not in self.command_history:
+                self.command_history.append(cmd)
+            self.history_index = -1
+            return
+        self.input.clear()
+
+        self.last_command = cmd
+        perf_rec = self._perf_current = self.perf.begin(cmd)
+        dispatch_start = time.perf_counter() if perf_rec else 0.0
+        self.engine.execute(cmd)
+
+        if perf_rec:
+            self._perf_current = None
+            PerfTracer.span(perf_rec, "dispatch", dispatch_start)
+            completer_start = time.perf_counter()
+
+        self.history_index = -1
+        self.update_completer_model()
+
+        if perf_rec:
+            PerfTracer.span(perf_rec, "completer", completer_start)
+            if not perf_rec.get("job"):
+                PerfTracer.finish(perf_rec)
+
+    # ---------------- Filesystem / commands ----------------
+    def _shell_args(self, cmd):
+        return shell_args(cmd)
+
+    def _line_color(self, line):
+        return line_color(line)
+
+    def _resolve_path(self, path):
+        return self.engine._resolve_path(path)
+
+    def _stall_context(self):
+        """Snapshot for a stall report; runs on the watchdog thread, so no Qt calls."""
+        jobs = list(self.job_manager.jobs.values())
+        return {
+            "command": self.last_command,
+            "queued_chunks": sum(len(job._pending) for job in jobs),
+            "running_jobs": sum(1 for job in jobs if job.status == "running"),
+            "anim_timers": len(self._anim_timers),
+        }
+
+    def _update_stall_label(self):
+        count = self.watchdog.count
+        if count != self._stalls_shown:
+            self._stalls_shown = count
+            self.stall_label.setText(f"stalls: {count}  (max {self.watchdog.max_lag * 1000:.0f} ms)")
+            self.stall_label.setStyleSheet("QLabel { color: #b58900; font-size: 10px; margin-top: 6px; }")
+
+    def show_diagnostics(self, args):
+        """diag: recent stalls and memory stats; 'diag N' prints stall N's full stack."""
+        stalls = list(self.watchdog.stalls)
+        if args and args[0].isdigit():
+            index = int(args[0])
+            if not 1 <= index <= len(stalls):
+                self.append_text(f"No stall #{index}; {len(stalls)} recorded.\n", color="yellow")
+                return
+            stall = stalls[index - 1]
+            self.append_text(f"Stall #{index}: {stall['duration'] * 1000:.0f} ms, {stall['context']}\n", color="cyan", animate=False)
+            self.append_text(stall["stack"], color="white", animate=False)
+            return
+        doc = self.output.document()
+        rss = None
+        try:
+            import resource
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            rss = rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+        except Exception:
+            pass
+        lines = [
+            f"Event-loop stalls: {self.watchdog.count} (threshold {self.watchdog.threshold * 1000:.0f} ms, "
+            f"max {self.watchdog.max_lag * 1000:.0f} ms), log: {self.watchdog.log_path}",
+            f"Output: {doc.blockCount():,} blocks, {doc.characterCount():,} chars; "
+            f"secondary {self.secondary_output.document().blockCount():,} blocks",
+            f"History: {len(self.command_history):,} commands; animation timers live: {len(self._anim_timers)}",
+            f"Jobs tracked: {len(self.job_manager.jobs)}; running: {sum(1 for j in self.job_manager.jobs.values() if j.status == 'running')}",
+            f"Peak RSS: {rss:.1f} MB" if rss else "Peak RSS: n/a",
+        ]
+        self.append_text("\n".join(lines) + "\n", color="cyan", animate=False)
+        for i, stall in enumerate(stalls[-10:], start=max(1, len(stalls) - 9)):
+            when = time.strftime("%H:%M:%S", time.localtime(stall["time"]))
+            where = stall["stack"].strip().splitlines()[-2:] if stall["stack"] else []
+            self.append_text(f"  #{i} {when} {stall['duration'] * 1000:6.0f} ms  cmd={stall['context'].get('command')!r}\n",
+                             color="yellow", animate=False)
+            if where:
+                self.append_text(f"      {where[0].strip()}\n", color="gray", animate=False)
+
+    def perf_command(self, args):
+        """perf [on|off|stats|clear] | perf export FILE."""
+        action = args[0].lower() if args else ""
+        perf = self.perf
+        if action in ("on", "off"):
+            perf.enabled = action == "on"
+            self.append_text(f"✓ Command timing {'enabled' if perf.enabled else 'disabled'}.\n", color="green")
+        elif action == "clear":
+            perf.records.clear()
+            self.append_text("✓ Timing buffer cleared.\n", color="green")
+        elif action == "export" and len(args) > 1:
+            path = self._resolve_path(" ".join(args[1:]))
+            try:
+                with open(path, "w") as f:
+                    json.dump(perf.chrome_trace(), f)
+                self.append_text(f"✓ Wrote {len(perf.records)} commands to {path} (open in chrome://tracing or Perfetto)\n", color="green")
+            except Exception as e:
+                self.append_text(f"perf export error: {e}\n", color="red")
+        elif action == "stats":
+            stats = perf.percentiles()
+            if not stats:
+                self.append_text("No finished commands recorded yet.\n", color="yellow")
+                return
+            self.append_text(f"{'phase':12} {'n':>5} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10}\n", color="cyan", animate=False)
+            for name, (count, q) in stats.items():
+                self.append_text(f"{name:12} {count:>5} {q[50]:>10.2f} {q[90]:>10.2f} {q[99]:>10.2f}\n", color="white", animate=False)
+        elif action:
+            self.append_text("Usage: perf [on|off|stats|clear] | perf export <file>\n", color="yellow")
+        else:
+            if not perf.enabled:
+                self.append_text("Command timing is OFF. Type 'perf on' to start recording.\n", color="yellow")
+            recent = [rec for rec in perf.records if rec["cmd"].split()[0].lower() != "perf"][-10:]
+            if not recent:
+                return
+            header = f"{'command':28}" + "".join(f"{name:>11}" for name in PerfTracer.PHASES)
+            self.append_text(header + "   (ms)\n", color="cyan", animate=False)
+            for rec in recent:
+                phases = perf.breakdown(rec)
+                cells = "".join(f"{phases[name]:>11.2f}" if name in phases else f"{'-':>11}" for name in PerfTracer.PHASES)
+                self.append_text(f"{rec['cmd'][:27]:28}{cells}\n", color="white", animate=False)
+
+    def start_watch(self, spec):
+        """watch [-n SECONDS] CMD re-runs CMD into the secondary pane; 'watch stop' ends it."""
+        if self.watch_session is not None:
+            self.watch_session.stop()
+            self.watch_session = None
+            if not spec or spec.lower() == "stop":
+                self.append_text("✓ Watch stopped.\n", color="green")
+                return
+        if not spec or spec.lower() == "stop":
+            self.append_text("Usage: watch [-n SECONDS] <command>\n", color="yellow")
+            return
+        interval = 2.0
+        words = spec.split(None, 2)
+        if words[0] == "-n":
+            try:
+                interval = max(0.1, float(words[1]))
+            except (IndexError, ValueError):
+                self.append_text("watch: -n needs a number of seconds\n", color="red")
+                return
+            spec = words[2] if len(words) > 2 else ""
+        if not spec:
+            self.append_text("Usage: watch [-n SECONDS] <command>\n", color="yellow")
+            return
+        if not self.split_view_enabled:
+            self.toggle_split_view()
+        self.watch_session = WatchSession(self, spec, interval, self.secondary_output)
+        self.watch_session.start()
+        self.append_text(f"Watching '{spec}' every {interval:g}s in the secondary pane ('watch stop' to end).\n", color="cyan")
+
+    def open_top(self, spec=""):
+        """top [-n SECONDS] [FILTER] opens the live process monitor."""
+        try:
+            if not ProcessSampler().supported:
+                self.append_text("top is only supported on Linux and Windows.\n", color="red")
+                return
+            interval = 2.0
+            words = spec.split(None, 2)
+            if words and words[0] == "-n":
+                try:
+                    interval = max(0.25, float(words[1]))
+                except (IndexError, ValueError):
+                    self.append_text("top: -n needs a number of seconds\n", color="red")
+                    return
+                spec = words[2] if len(words) > 2 else ""
+            window = TopWindow(self, interval=interval, filter_text=spec)
+            window.show()
+            self.append_text("✓ Process monitor opened.\n", color="green")
+        except Exception as e:
+            self.append_text(f"top error: {e}\n", color="red")
+
+    def open_table_file(self, path):
+        """Open a delimited file in the table view through a memory-mapped row index."""
+        try:
+            full = path if os.path.isabs(path) else os.path.join(self.current_dir, path)
+            if not os.path.isfile(full):
+                self.append_text("File is not real.\n", color="red")
+                return
+            if os.path.getsize(full) == 0:
+                self.append_text("File is empty.\n", color="yellow")
+                return
+            TableWindow(MappedTableData(full), title=os.path.basename(full), parent=self).show()
+            self.append_text(f"✓ Opened {os.path.basename(full)} in table view.\n", color="green")
+        except Exception as e:
+            self.append_text(f"table error: {e}\n", color="red")
+
+    def _is_large_file(self, path):
+        try:
+            return os.path.getsize(self._resolve_path(path)) > self.PAGER_THRESHOLD
+        except OSError:
+            return False
+
+    def open_pager(self, path):
+        """Open a file in the memory-mapped pager."""
+        try:
+            full = self._resolve_path(path)
+            if not os.path.isfile(full):
+                self.append_text("File is not real.\n", color="red")
+                return
+            PagerWindow(full, parent=self, font=self.output.font()).show()
+            self.append_text(f"✓ Opened {os.path.basename(full)} in the pager.\n", color="green")
+        except Exception as e:
+            self.append_text(f"view error: {e}\n", color="red")
 
-  1. Try navigating your computer with 'cd' and 'ls'
-  2. Enable split view with 'splitview'
-  3. Add a favorite command with 'favorite [command]'
-  4. When comfortable, type 'advancedmode on'
-  5. Read full help with 'help' anytime
+    def table_from_command(self, cmd):
+        """Run ``cmd`` and show its parsed output in the table view."""
+        lines = []
 
-═══════════════════════════════════════════════════════════════════════════════
+        def finished(job):
+            if job.status == "failed" or (job.returncode and not lines):
+                self.append_text(f"table: '{cmd}' failed (exit {job.returncode})\n", color="red", animate=False)
+                return
+            try:
+                TableWindow(TableData.from_text("".join(lines)), title=cmd, parent=self).show()
+                self.append_text(f"✓ Opened output of '{cmd}' in table view.\n", color="green", animate=False)
+            except Exception as e:
+                self.append_text(f"table error: {e}\n", color="red", animate=False)
 
-Ready? Start typing commands!  Type 'exit' to quit anytime.
+        args, shell = self._shell_args(cmd)
+        self.job_manager.submit(cmd, self.current_dir, args=args, shell=shell, background=False,
+                                sink=lambda job, chunks: lines.extend(t for st, t in chunks if st == "stdout"),
+                                on_finished=finished)
 
-═══════════════════════════════════════════════════════════════════════════════
-"""
-        self.output.clear()
-        self.append_text(tutorial, color="green", animate=False)
-        self.append_text("\n> ", color="yellow", animate=False)
+    def set_session_logging(self, enabled):
+        """Start or stop the session logger (also bound to the settings toggle)."""
+        if enabled and self.session_log is None:
+            try:
+                self.session_log = SessionLogger(self.SESSION_LOG_DIR)
+            except OSError as e:
+                self.append_text(f"Session log error: {e}\n", color="red")
+                return
+            self.append_text(f"✓ Session logging to {self.session_log.path}\n", color="green")
+        elif not enabled and self.session_log is not None:
+            logger, self.session_log = self.session_log, None
+            logger.close()
+            self.append_text(f"✓ Session log closed ({logger.written} records).\n", color="green")
+        try:
+            self.toggle_session_log.blockSignals(True)
+            self.toggle_session_log.setChecked(self.session_log is not None)
+            self.toggle_session_log.blockSignals(False)
+        except Exception:
+            pass
 
-    def show_welcome(self):
-        """Show minimal welcome message."""
-        self.output.clear()
-        logo = "mopsrs terminal\n"
-        self.append_text(logo, color="cyan", animate=False)
-        self.append_text("\n", color="default", animate=False)
+    def session_log_command(self, cmd):
+        parts = cmd.lower().split()
+        if len(parts) > 1 and parts[1] in ("on", "off"):
+            self.set_session_logging(parts[1] == "on")
+        elif self.session_log is not None:
+            log = self.session_log
+            self.append_text(f"Session log ON: {log.path} ({log.written} records written, {log.dropped} pending drops)\n", color="cyan")
+        else:
+            self.append_text(f"Session log is OFF. Type 'sessionlog on' to archive this session to {self.SESSION_LOG_DIR}.\n", color="yellow")
+
+    def record_command(self, args):
+        """record start FILE | record stop | record (status)."""
+        action = args[0].lower() if args else ""
+        if action == "start":
+            if len(args) < 2:
+                self.append_text("Usage: record start <file>\n", color="yellow")
+            elif self.recorder is not None:
+                self.append_text(f"Already recording to {self.recorder.path}. Use 'record stop' first.\n", color="yellow")
+            else:
+                try:
+                    self.recorder = SessionRecorder(self._resolve_path(" ".join(args[1:])))
+                    self.append_text(f"✓ Recording to {self.recorder.path}\n", color="green")
+                except Exception as e:
+                    self.append_text(f"Record error: {e}\n", color="red")
+        elif action == "stop":
+            if self.recorder is None:
+                self.append_text("Not recording.\n", color="yellow")
+                return
+            recorder, self.recorder = self.recorder, None
+            try:
+                duration = recorder.close()
+                self.append_text(f"✓ Saved {recorder.path} ({recorder.events} events, "
+                                 f"{self._format_ms(duration)}, {len(recorder.index_times)} keyframes)\n", color="green")
+            except Exception as e:
+                self.append_text(f"Record error: {e}\n", color="red")
+        elif self.recorder is not None:
+            self.append_text(f"Recording to {self.recorder.path} ({self.recorder.events} events, "
+                             f"{self._format_ms(self.recorder.elapsed_ms())})\n", color="cyan")
+        else:
+            self.append_text("Not recording. Usage: record start <file> | record stop\n", color="yellow")
 
-    # ---------------- Input handling ----------------
-    def handle_command(self):
-        cmd = self.input.text().strip()
-        if not cmd:
+    def replay_command(self, arg):
+        """replay FILE [--speed N] [--from T] | replay stop."""
+        if arg.lower() == "stop":
+            if self.replay is None:
+                self.append_text("No replay running.\n", color="yellow")
+            else:
+                self.replay.stop()
             return
-        self.append_text(f"\n> {cmd}\n", color="yellow")
-        self.input.clear()
-
-        # Handle startup screen selection
-        low = cmd.lower()
-        
-        # First-time user selection
-        if low in ("1", "help") and not self.tutorial_mode:
-            self.show_tutorial()
+        speed, start_ms, words = 1.0, 0, []
+        parts = arg.split()
+        try:
+            i = 0
+            while i < len(parts):
+                if parts[i] == "--speed" and i + 1 < len(parts):
+                    speed = float(parts[i + 1])
+                    i += 2
+                elif parts[i] == "--from" and i + 1 < len(parts):
+                    start_ms = self._parse_clock(parts[i + 1])
+                    i += 2
+                else:
+                    words.append(parts[i])
+                    i += 1
+            if not words or speed <= 0:
+                raise ValueError
+        except ValueError:
+            self.append_text("Usage: replay <file> [--speed N] [--from [H:]MM:SS]\n", color="yellow")
             return
-        elif low in ("2", "start") and not self.tutorial_mode:
-            self.show_welcome()
+        if self.replay is not None:
+            self.replay.stop()
+        try:
+            reader = RecordingReader(self._resolve_path(" ".join(words)))
+        except Exception as e:
+            self.append_text(f"Replay error: {e}\n", color="red")
             return
+        self.append_text(f"── replay {os.path.basename(reader.path)}  "
+                         f"{self._format_ms(start_ms)} / {self._format_ms(reader.duration_ms)}  x{speed:g} ──\n", color="gray", animate=False)
+
+        def finished(replay):
+            self.replay = None
+            self.append_text("\n── end of replay ──\n", color="gray", animate=False)
+
+        self.replay = SessionReplay(reader, lambda text, color: self.append_text(text, color=color, animate=False, stream="replay"),
+                                    speed=speed, start_ms=start_ms, on_finished=finished, parent=self)
+        self.replay.start()
+
+    @staticmethod
+    def _parse_clock(value):
+        """'90', '1:30' or '1:02:03' -> milliseconds."""
+        seconds = 0.0
+        for part in value.split(":"):
+            seconds = seconds * 60 + float(part)
+        return int(seconds * 1000)
+
+    @staticmethod
+    def _format_ms(ms):
+        seconds = int(ms // 1000)
+        return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+    def _session_state(self):
+        return {
+            "version": 1,
+            "saved": time.time(),
+            "panes": {"main": {"cwd": self.current_dir}, "secondary": {"cwd": self.current_dir}},
+            "split_view": self.split_view_enabled,
+            "split_orientation": self.split_orientation,
+            "splitter_sizes": {"main": self.main_splitter.sizes(), "terminal": self.terminal_splitter.sizes()},
+            "toggles": {"line_wrap": self.line_wrap_enabled, "timestamps": self.show_timestamps,
+                        "advanced": self.advanced_mode, "session_log": self.session_log is not None},
+            "history": self.command_history[-1000:],
+            "history_index": self.history_index,
+        }
 
-        # Builtin commands
-        if low in ("help", "?"):
-            self.show_help()
-        elif low in ("clear", "cls"):
-            self.output.clear()
-            self.show_welcome()
-        elif low == "exit":
-            sys.exit(0)
-        elif low.startswith("cd "):
-            self.change_directory(cmd[3:].strip())
-        elif low in ("pwd", "cd"):
-            self.append_text(f"{self.current_dir}\n", color="cyan")
-        elif low in ("ls", "dir"):
-            self.list_dir()
-        elif low.startswith("calc "):
-            expr = cmd[5:].strip()
-            self.calc_expr(expr)
-        elif low.startswith("tree"):
-            parts = cmd.split()
-            path = parts[1] if len(parts) > 1 else self.current_dir
-            self.print_tree(path)
-        elif low.startswith("wifcode"):
-            parts = cmd.split()
-            show_flag = len(parts) > 1 and parts[1].lower() in ("--show", "-s", "show")
-            self.show_wifi_passwords(show=show_flag)
-        elif low.startswith("search "):
-            pattern = cmd.split(None, 1)[1]
-            self.search_files(pattern)
-        elif low.startswith("mkcd "):
-            path = cmd.split(None, 1)[1]
-            self.make_and_cd(path)
-        elif low.startswith("extract "):
-            path = cmd.split(None, 1)[1]
-            self.extract_archive(path)
-        elif low.startswith("serve"):
-            parts = cmd.split()
-            port = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 8000
-            self.start_server(port)
-        elif low.startswith("stopserve"):
-            self.stop_server()
-        elif low.startswith("mops "):
-            parts = cmd.split()
-            pkg = None
-            if len(parts) > 2 and parts[1].lower() == "install":
-                pkg = parts[2]
-            elif len(parts) > 1:
-                pkg = parts[1]
-            if pkg:
-                self.mops_install(pkg)
-            else:
-                self.append_text("Usage: mops install <package>\n", color="yellow")
-        elif low == "newwindow":
-            self.open_new_window()
-        elif low == "splitview":
-            self.toggle_split_view()
-        elif low.startswith("favorite "):
-            fav_name = cmd.split(None, 1)[1]
-            self.add_favorite(fav_name)
-        elif low == "favorites":
-            self.list_favorites()
-        elif low == "tutorial":
-            self.show_tutorial()
-        elif low.startswith("advancedmode"):
-            self.toggle_advanced_mode(cmd)
+    def _scrollback_runs(self, edit, limit):
+        """(color, text) runs for roughly the last ``limit`` characters of a pane.
+
+        Walks blocks backwards from the end so the cost depends on ``limit``,
+        not on the size of the document.
+        """
+        names = {QColor(value).name(): name for name, value in self.COLORS.items()}
+        blocks, size = [], 0
+        block = edit.document().lastBlock()
+        while block.isValid() and size < limit:
+            runs = []
+            it = block.begin()
+            while not it.atEnd():
+                fragment = it.fragment()
+                if fragment.isValid():
+                    color = names.get(fragment.charFormat().foreground().color().name(), "default")
+                    runs.append((color, fragment.text()))
+                it += 1
+            blocks.append(runs)
+            size += block.length()
+            block = block.previous()
+        out = []
+        for i, runs in enumerate(reversed(blocks)):
+            if i:
+                out.append(("default", "\n"))
+            out.extend(runs)
+        return out
+
+    def save_session(self, wait=False):
+        """Snapshot the session; the compress-and-write happens off the GUI thread unless ``wait``."""
+        if self.session_store is None:
+            return
+        state = self._session_state()
+        main = self._scrollback_runs(self.output, self.SESSION_SCROLLBACK)
+        secondary = "".join(text for _, text in self._scrollback_runs(self.secondary_output, self.SESSION_SCROLLBACK))
+        self._session_saved_key = self._session_key()
+        if wait:
+            self.session_store.save(state, main, secondary)
         else:
-            self.execute_command(cmd)
-
-        # history & completer refresh
-        if cmd not in self.command_history:
-            self.command_history.append(cmd)
-        self.history_index = -1
+            self.session_store.save_async(state, main, secondary)
+
+    def _session_key(self):
+        return (self.output.document().characterCount(), self.secondary_output.document().characterCount(),
+                self.current_dir, len(self.command_history), self.split_view_enabled,
+                self.line_wrap_enabled, self.show_timestamps, self.advanced_mode)
+
+    def autosave_session(self):
+        if self._session_key() != self._session_saved_key:
+            self.save_session()
+
+    def restore_session_state(self):
+        """Apply the saved header right away and stream the scrollback in afterwards."""
+        if self.session_store is None:
+            return False
+        state = self.session_store.load_state()
+        if not state:
+            return False
+        cwd = state.get("panes", {}).get("main", {}).get("cwd")
+        if cwd and os.path.isdir(cwd):
+            try:
+                os.chdir(cwd)
+                self.current_dir = os.getcwd()
+                self.update_dir_label()
+            except OSError:
+                pass
+        self.command_history = list(state.get("history", []))
+        self.history_index = state.get("history_index", -1)
+        if not -1 <= self.history_index < len(self.command_history):
+            self.history_index = -1
         self.update_completer_model()
+        toggles = state.get("toggles", {})
+        self.line_wrap_enabled = bool(toggles.get("line_wrap"))
+        mode = QTextEdit.WidgetWidth if self.line_wrap_enabled else QTextEdit.NoWrap
+        self.output.setLineWrapMode(mode)
+        self.secondary_output.setLineWrapMode(mode)
+        self.show_timestamps = bool(toggles.get("timestamps"))
+        self.advanced_mode = bool(toggles.get("advanced"))
+        for toggle, on in ((self.toggle_wrap, self.line_wrap_enabled), (self.toggle_timestamps, self.show_timestamps),
+                           (self.toggle_advanced, self.advanced_mode)):
+            toggle.blockSignals(True)
+            toggle.setChecked(on)
+            toggle.blockSignals(False)
+        if toggles.get("session_log"):
+            QTimer.singleShot(0, lambda: self.set_session_logging(True))
+        self.split_orientation = state.get("split_orientation", self.split_orientation)
+        self.split_view_enabled = bool(state.get("split_view"))
+        self.split_container.setVisible(self.split_view_enabled)
+        sizes = state.get("splitter_sizes", {})
+        if sizes.get("main"):
+            self.main_splitter.setSizes(sizes["main"])
+        if sizes.get("terminal"):
+            self.terminal_splitter.setSizes(sizes["terminal"])
+        self._load_scrollback_async(state.get("saved"))
+        return True
+
+    def _load_scrollback_async(self, saved):
+        result = {}
+
+        def load():
+            try:
+                result["data"] = self.session_store.load_scrollback()
+            except Exception as e:
+                result["error"] = e
 
-    # ---------------- Filesystem / commands ----------------
-    def change_directory(self, path):
+        def poll():
+            if "data" in result:
+                timer.stop()
+                main, secondary = result["data"]
+                self.secondary_output.setPlainText(secondary)
+                stamp = time.strftime("%Y-%m-%d %H:%M", time.localtime(saved)) if saved else "earlier"
+                main.append(("gray", f"\n── restored session from {stamp} ──\n\n"))
+                self._insert_scrollback(main)
+            elif "error" in result:
+                timer.stop()
+
+        timer = QTimer(self)
+        timer.timeout.connect(poll)
+        timer.start(25)
+        threading.Thread(target=load, daemon=True).start()
+
+    def _insert_scrollback(self, runs, budget=32 * 1024):
+        """Insert restored runs above the live output, a slice per event-loop turn."""
+        cursor = QTextCursor(self.output.document())
+        cursor.setPosition(0)
+        runs = collections.deque(runs)
+        bar = self.output.verticalScrollBar()
+
+        def step():
+            at_bottom = bar.value() >= bar.maximum() - 4
+            done = 0
+            while runs and done < budget:
+                color, text = runs.popleft()
+                fmt = QTextCharFormat()
+                fmt.setForeground(QColor(self.COLORS.get(color, self.COLORS["default"])))
+                cursor.insertText(text, fmt)
+                done += len(text)
+            if at_bottom:
+                bar.setValue(bar.maximum())
+            if runs:
+                QTimer.singleShot(0, step)
+
+        step()
+
+    def session_command(self, args):
+        """session | session save | session forget."""
+        action = args[0].lower() if args else ""
+        if self.session_store is None:
+            self.append_text("This window does not save its session (only the first window does).\n", color="yellow")
+        elif action == "save":
+            try:
+                self.save_session(wait=True)
+                self.append_text(f"✓ Session saved to {self.session_store.path}\n", color="green")
+            except Exception as e:
+                self.append_text(f"Session save error: {e}\n", color="red")
+        elif action == "forget":
+            self.session_store.clear()
+            self.session_store = None
+            self._session_timer.stop()
+            self.append_text("✓ Saved session deleted; this session will not be saved.\n", color="green")
+        else:
+            exists = os.path.exists(self.session_store.path)
+            self.append_text(f"Session file: {self.session_store.path} ({'saved' if exists else 'not saved yet'}; "
+                             f"autosaves every 30s and on exit)\n", color="cyan")
+
+    def attach_session(self, spec):
+        """attach ADDRESS [SESSION]: send commands to a served session and show its output."""
+        words = spec.split()
+        if not words:
+            self.append_text("Usage: attach <socket path | localhost:PORT> [session]\n", color="yellow")
+            return
+        if self.remote is not None:
+            self.detach_session()
+        # A fresh queue so nothing left over from an earlier session is replayed
+        self._remote_queue = queue.Queue()
         try:
-            full_path = os.path.join(self.current_dir, path) if not os.path.isabs(path) else path
-            os.chdir(full_path)
-            self.current_dir = os.getcwd()
-            self.append_text(f"{self.current_dir}\n", color="cyan")
-            self.update_dir_label()
-        except FileNotFoundError:
-            self.append_text(f"Error: directory is as real as my girlfriend {path}\n", color="red")
-        except Exception as e:
-            self.append_text(f"Error: {e}\n", color="red")
-        finally:
-            self.update_completer_model()
+            self.remote = EngineClient(words[0], session=words[1] if len(words) > 1 else "main",
+                                       on_message=self._remote_queue.put)
+        except (OSError, ValueError) as e:
+            self.append_text(f"attach error: {e}\n", color="red")
+            return
+        self.remote_spec = words[0]
+        self._remote_timer.start()
 
-    def execute_command(self, cmd):
+    def detach_session(self):
+        if self.remote is None:
+            self.append_text("Not attached to a session.\n", color="yellow")
+            return
+        self._poll_remote()
+        self._drop_remote()
+
+    def _drop_remote(self):
+        """Forget the session connection at once, so nothing more is sent on it."""
+        if self.remote is None:
+            return
+        self.remote.close()
+        self.remote = None
+        self._remote_timer.stop()
+        self.append_text(f"Detached from {self.remote_spec}.\n", color="gray", animate=False)
+
+    def _poll_remote(self):
+        while True:
+            try:
+                message = self._remote_queue.get_nowait()
+            except queue.Empty:
+                return
+            kind = message.get("type")
+            if kind == "output":
+                color = message.get("color") if message.get("color") in self.COLORS else "white"
+                text = f"\n{message['text']}" if message.get("stream") == "echo" else message["text"]
+                self.append_text(text, color=color, animate=False, stream="remote")
+            elif kind == "attached":
+                self.append_text(f"Attached to session '{message['session']}' on {self.remote_spec} "
+                                 f"({message['clients']} client(s), cwd {message['cwd']}); commands now run there, "
+                                 f"'detach' returns\n", color="gray", animate=False)
+            elif kind == "error":
+                self.append_text(f"Session error: {message.get('message')}\n", color="red", animate=False)
+            elif kind == "closed":
+                self._drop_remote()
+                return
+
+    def closeEvent(self, event):
         try:
-            powershell_keywords = ["get-", "set-", "$", "select-object", "where-object", "foreach-object", "invoke-", "test-path", "|"]
-            use_powershell = any(k in cmd.lower() for k in powershell_keywords)
-            if use_powershell:
-                process = subprocess.Popen(["powershell", "-NoProfile", "-Command", cmd], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, cwd=self.current_dir)
-            else:
-                process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, shell=True, cwd=self.current_dir)
-            stdout, stderr = process.communicate()
-            if stdout:
-                for line in stdout.splitlines():
-                    low = line.lower()
-                    if "error" in low or "failed" in low:
-                        self.append_text(line + "\n", color="red", animate=False)
-                    elif "warning" in low:
-                        self.append_text(line + "\n", color="yellow", animate=False)
-                    else:
-                        self.append_text(line + "\n", color="white", animate=False)
-            if stderr:
-                self.append_text(stderr, color="red", animate=False)
-            if not stdout and not stderr:
-                self.append_text("[Command executed]\n", color="gray", animate=False)
-        except Exception as e:
-            self.append_text(f"Execution error: {e}\n", color="red", animate=False)
+            self.save_session(wait=True)
+        except Exception:
+            pass
+        if self.remote is not None:
+            self.remote.close()
+        self.watchdog.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.session_log is not None:
+            self.session_log.close()
+        self.engine.close()
+        super().closeEvent(event)
 
     # ---------------- Help ----------------
     def show_help(self, animated=False):
@@ -933,19 +7795,41 @@ ipconfig
   Show network configuration
 tasklist
   List running processes
+top [-n SECONDS] [filter]
+  Live process monitor (sort, filter, kill selected with Delete)
 
 FILE OPERATIONS
 ───────────────
-copy [src] [dst]
-  Copy files
+copy [-j N] [src...] [dst]
+  Copy files/directories in parallel ('src/' copies the contents); 'kill %N' cancels
+move [-j N] [src...] [dst]
+  Rename, or copy then delete across drives
 del [file]
   Delete files
 mkdir [dir]
   Create directory
 type [file]
-  Show file content
+  Show file content (files over 1 MB open in the pager)
+view [file] / less [file]
+  Page through a file of any size (search, go to line, follow)
+follow [-n N] [--split] [file...]
+  Stream lines appended to files (tail -f); 'kill %N' stops it
 tree [path]
   Show directory tree
+hash [--algo A] [--manifest] [files/dirs]
+  Checksums in parallel (sha256, sha1, md5, blake2b); --manifest writes DIR/SHA256SUMS
+hash --check [file]
+  Verify files against a checksum file
+find [--dirs] [pattern]
+  Find files by name (substring, *glob* or fuzzy) in the path index
+find --roots | --add-root PATH | --remove-root PATH | --refresh
+  Manage the indexed roots (default: home directory)
+find PATH... / find -OPTION ...
+  Paths, single-dash options and multi-word forms run the system find
+cd @N / cd ?NAME
+  Jump to find result N / to the best matching indexed directory
+du [path] [--depth N] [--top K] [--fresh]
+  Largest directories, scanned in parallel; unchanged directories come from cache (--fresh rescans)
 
 UTILITIES
 ─────────
@@ -953,6 +7837,8 @@ search [pattern]
   Search text in files under current directory
 mkcd [dir]
   Make directory (with parents) and change into it
+compress [out.zip|.tar.gz|.tar] [inputs...]
+  Create an archive, compressing on all cores; 'kill %N' cancels
 extract [archive]
   Extract zip/tar archives into current directory
 serve [port]
@@ -961,21 +7847,82 @@ stopserve
   Stop running server
 mops install [pkg]
   Install Python package using pip
-wifcode [--show]
-  List saved Wi-Fi profiles (password hidden by default)
+wifcode [--show] [--refresh]
+  List saved Wi-Fi profiles (password hidden by default; Windows and Linux)
 calc [expr]
-  Evaluate math expressions
+  Evaluate math expressions (sqrt, log, hex, sum(range(...)), [1,2,3]*2, 26.2*mi/km)
+calc x = [expr]
+  Store a variable for later calcs ('calc vars', 'calc clear'; last result is 'ans')
+calc mode float|decimal|fraction
+  Switch number type; 'calc funcs' lists functions, constants and units
+py [code]
+  Run Python in a warm kernel that keeps variables and imports (one per pane)
+py interrupt | py restart
+  Stop the running snippet, or start a fresh kernel
+perf on|off | perf | perf stats
+  Time each command's phases; show recent breakdowns or p50/p90/p99
+perf export FILE
+  Save recorded timings as a Chrome trace (chrome://tracing, Perfetto)
+diag [N]
+  Show event-loop stalls and memory stats; 'diag N' prints stall N's stack
+
+JOB CONTROL
+───────────
+[command] &
+  Run a command in the background
+jobs
+  List jobs with status, runtime and CPU time
+jobs --limit N
+  Set how many background jobs may run at once (default 4)
+fg [N]
+  Attach job N's output to the terminal
+watch [-n SECONDS] CMD
+  Re-run CMD in the secondary pane, highlighting changed lines
+watch stop
+  Stop watching
+kill %N
+  Terminate job N and its child processes. As in a shell, a bare number is a PID
+  for the system kill (kill PID, kill -9 PID); on Windows, kill N also means job N
+parallel [-j N] [--tag] CMD ::: A B C
+  Run CMD once per argument ({} is replaced), N at a time
+parallel [-j N] CMD < listfile
+  Same, taking one argument per line from a file
+
+TABLES
+──────
+[command] | table
+  Show command output (tasklist, Get-Process, ls -l, CSV) as a sortable table
+table [file.csv]
+  Open a CSV/TSV file in the table view (handles millions of rows)
 
 TERMINAL FEATURES
 ──────────────────
 newwindow
   Open a new terminal window
+attach [socket|localhost:PORT] [session] / detach
+  Drive a session served by 'mops_terminal.py --serve-socket'
 splitview
   Toggle split view (dual pane with draggable resize)
 favorite [command]
   Add command to favorites
 favorites
-  List all favorite commands
+  List favorite commands, most used recently first
+fav run NAME
+  Run a favorite by name
+fav add NAME COMMAND | fav rm NAME
+  Save a favorite under a chosen name, or remove one
+sessionlog on|off
+  Archive the session transcript to ~/.mops_logs (rotated, gzip-compressed)
+session [save|forget]
+  Show, save or delete the session restored on the next launch
+cache on|off|clear
+  Reuse recent output of slow info commands (systeminfo, ipconfig, whoami...)
+cache policy PATTERN SECONDS
+  Set how long matching commands are cached (0 = never); add --fresh to rerun
+record start FILE | record stop
+  Record this session's output to a compact, seekable file
+replay FILE [--speed N] [--from [H:]MM:SS]
+  Play a recording back in the terminal ('replay stop' to end)
 
 POWER USER MODE
 ────────────────
@@ -1009,7 +7956,13 @@ exit
 
     # ---------------- Completer ----------------
     def update_completer_model(self):
-        items = list(self.base_commands)
+        items = []
+        favorites = getattr(self, "favorites", None)
+        if favorites is not None:
+            # Favorites first, most frecent at the top of the popup
+            for name, command, _, _, _ in favorites.ranked():
+                items.extend((command, f"fav run {name}"))
+        items.extend(self.base_commands)
         items.extend(self.command_history[-50:])
         try:
             items.extend(os.listdir(self.current_dir))
@@ -1023,183 +7976,11 @@ exit
                 out.append(it)
         self.completer_model.setStringList(out)
 
-    def list_dir(self):
-        try:
-            entries = os.listdir(self.current_dir)
-            for name in sorted(entries):
-                path = os.path.join(self.current_dir, name)
-                if os.path.isdir(path):
-                    self.append_text(f"{name}/\n", color="cyan")
-                else:
-                    self.append_text(f"{name}\n", color="white")
-        except Exception as e:
-            self.append_text(f"List error: {e}\n", color="red")
-
-    def calc_expr(self, expr):
-        try:
-            result = eval(expr, {"__builtins__": {}}, {})
-            self.append_text(f"{result}\n", color="green")
-        except Exception as e:
-            self.append_text(f"Calc error: {e}\n", color="red")
-
-    def print_tree(self, root, prefix="", max_depth=4, _depth=0):
-        try:
-            if _depth > max_depth:
-                return
-            entries = sorted(os.listdir(root))
-            for i, name in enumerate(entries):
-                path = os.path.join(root, name)
-                connector = "└── " if i == len(entries)-1 else "├── "
-                if os.path.isdir(path):
-                    self.append_text(f"{prefix}{connector}{name}/\n", color="cyan")
-                    self.print_tree(path, prefix + ("    " if i == len(entries)-1 else "│   "), max_depth, _depth+1)
-                else:
-                    self.append_text(f"{prefix}{connector}{name}\n", color="white")
-        except Exception as e:
-            self.append_text(f"Tree error: {e}\n", color="red")
-
-    def show_wifi_passwords(self, show=False):
-        if os.name != "nt":
-            self.append_text("wifcode is only supported on Windows.\n", color="red", animate=False)
-            return
-        try:
-            cmd = "netsh wlan show profiles"
-            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, text=True)
-            out, err = proc.communicate()
-            if err:
-                self.append_text(f"Error fetching Wi-Fi profiles: {err}\n", color="red", animate=False)
-                return
-            profiles = []
-            for line in out.splitlines():
-                line = line.strip()
-                if line.startswith("All User Profile") or line.startswith("User Profile"):
-                    parts = line.split(":", 1)
-                    if len(parts) == 2:
-                        name = parts[1].strip()
-                        if name:
-                            profiles.append(name)
-            if not profiles:
-                self.append_text("No saved Wi-Fi profiles found.\n", color="yellow", animate=False)
-                return
-            for profile in profiles:
-                prof_cmd = f"netsh wlan show profile name=\"{profile}\" key=clear"
-                p = subprocess.Popen(prof_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, text=True)
-                pout, perr = p.communicate()
-                if perr:
-                    self.append_text(f"{profile}: Error reading profile ({perr.strip()})\n", color="red", animate=False)
-                    continue
-                password = None
-                for pline in pout.splitlines():
-                    pl = pline.strip()
-                    if pl.lower().startswith("key content"):
-                        parts = pl.split(":", 1)
-                        if len(parts) == 2:
-                            password = parts[1].strip()
-                            break
-                if password:
-                    if show:
-                        self.append_text(f"{profile}: {password}\n", color="green", animate=False)
-                    else:
-                        self.append_text(f"{profile}: <hidden> (use 'wifcode --show')\n", color="yellow", animate=False)
-                else:
-                    self.append_text(f"{profile}: <no password or open network>\n", color="yellow", animate=False)
-        except Exception as e:
-            self.append_text(f"wifcode failed: {e}\n", color="red", animate=False)
-
-    def search_files(self, pattern):
-        try:
-            count = 0
-            for root, dirs, files in os.walk(self.current_dir):
-                for fname in files:
-                    fpath = os.path.join(root, fname)
-                    try:
-                        with open(fpath, 'r', errors='ignore') as fh:
-                            for i, line in enumerate(fh, 1):
-                                if pattern.lower() in line.lower():
-                                    rel = os.path.relpath(fpath, self.current_dir)
-                                    self.append_text(f"{rel}:{i}: {line.strip()}\n", color="white")
-                                    count += 1
-                    except Exception:
-                        continue
-            if count == 0:
-                self.append_text("No matches found.\n", color="gray")
-        except Exception as e:
-            self.append_text(f"Search error: {e}\n", color="red")
-
-    def make_and_cd(self, path):
-        try:
-            os.makedirs(path, exist_ok=True)
-            self.change_directory(path)
-        except Exception as e:
-            self.append_text(f"mkcd error: {e}\n", color="red")
-
-    def extract_archive(self, path):
-        try:
-            if not os.path.isabs(path):
-                path = os.path.join(self.current_dir, path)
-            if not os.path.exists(path):
-                self.append_text("File is not real.\n", color="red")
-                return
-            if path.endswith('.zip'):
-                import zipfile
-                with zipfile.ZipFile(path, 'r') as z:
-                    z.extractall(self.current_dir)
-                self.append_text("Extracted zip archive.\n", color="green")
-            elif any(path.endswith(ext) for ext in ('.tar', '.tar.gz', '.tgz', '.tar.bz2')):
-                import tarfile
-                with tarfile.open(path, 'r:*') as t:
-                    t.extractall(self.current_dir)
-                self.append_text("Extracted tar archive.\n", color="green")
-            else:
-                self.append_text("Unsupported archive type.\n", color="yellow")
-        except Exception as e:
-            self.append_text(f"Extract error: {e}\n", color="red")
-
-    def start_server(self, port=8000):
-        if self.server_process and self.server_process.poll() is None:
-            self.append_text(f"Server already running (pid {self.server_process.pid}).\n", color="yellow")
-            return
-        try:
-            cmd = [sys.executable, "-m", "http.server", str(port)]
-            self.server_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=self.current_dir)
-            self.append_text(f"Serving {self.current_dir} at http://localhost:{port}/ (pid {self.server_process.pid})\n", color="green")
-        except Exception as e:
-            self.append_text(f"Serve error: {e}\n", color="red")
-
-    def stop_server(self):
-        if not self.server_process:
-            self.append_text("No server running.\n", color="gray")
-            return
-        try:
-            if self.server_process.poll() is None:
-                self.server_process.terminate()
-                self.server_process.wait(timeout=5)
-            self.append_text("Server stopped.\n", color="green")
-        except Exception as e:
-            self.append_text(f"Stop server error: {e}\n", color="red")
-        finally:
-            self.server_process = None
-
-    def mops_install(self, package):
-        try:
-            self.append_text(f"Installing {package}...\n", color="cyan")
-            cmd = [sys.executable, "-m", "pip", "install", package]
-            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-            for line in proc.stdout:
-                self.append_text(line, color="white")
-            proc.wait()
-            if proc.returncode == 0:
-                self.append_text(f"Installed {package}.\n", color="green")
-            else:
-                self.append_text(f"Installation failed (exit {proc.returncode}).\n", color="red")
-        except Exception as e:
-            self.append_text(f"mops install error: {e}\n", color="red")
-    
     # ──────────────────  Multi-Window & Features ──────────────────
     def open_new_window(self):
         """Open a new independent terminal window."""
         try:
-            new_window = MopsTerminal()
+            new_window = MopsTerminal(restore_session=False)
             new_window.show()
             self.append_text("✓ New terminal window opened.\n", color="green")
         except Exception as e:
@@ -1215,6 +7996,9 @@ exit
             self.secondary_output.clear()
             self.secondary_output.setPlainText("Secondary pane ready for input.\n")
         else:
+            if self.watch_session is not None:
+                self.watch_session.stop()
+                self.watch_session = None
             self.append_text("✓ Split view disabled.\n", color="green")
             self.split_container.setVisible(False)
 
@@ -1224,13 +8008,19 @@ exit
         if not cmd:
             return
         self.secondary_output.append(f"\n$ {cmd}")
+        self._secondary_echo_open = False
         self.secondary_input.clear()
+        if self.session_log is not None:
+            self.session_log.log("command", pane="secondary", cmd=cmd, cwd=self.current_dir)
 
         # Handle command in secondary pane
         low = cmd.lower()
         
         if low in ("help", "?"):
-            self.secondary_output.append("\nAvailable commands: pwd, cd, ls, dir, tree, calc, whoami\n")
+            self.secondary_output.append("\nAvailable commands: pwd, cd, ls, dir, tree, calc, whoami, py\n")
+        elif low == "py" or low.startswith("py "):
+            self._secondary_echo_open = True
+            self.engine.py_command(cmd[2:].strip(), "secondary", sink=self._secondary_sink)
         elif low in ("clear", "cls"):
             self.secondary_output.clear()
         elif low.startswith("cd "):
@@ -1247,15 +8037,32 @@ exit
         else:
             # Try to execute in secondary pane
             try:
-                process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, shell=True, cwd=self.current_dir)
-                stdout, stderr = process.communicate()
-                if stdout:
-                    self.secondary_output.append(stdout)
-                if stderr:
-                    self.secondary_output.append(f"[Error] {stderr}")
+                self._secondary_echo_open = True
+                self.job_manager.submit(cmd, self.current_dir, sink=self._secondary_sink, background=False, listed=False)
             except Exception as e:
                 self.secondary_output.append(f"Error: {e}\n")
 
+    def _secondary_sink(self, job, chunks):
+        """Stream job output into the secondary pane."""
+        pane = self.secondary_output
+        pane.moveCursor(QTextCursor.End)
+        if self._secondary_echo_open:
+            # The '$ cmd' echo was append()ed without a line break after it
+            pane.insertPlainText("\n")
+            self._secondary_echo_open = False
+        for stream, text in chunks:
+            if self.session_log is not None:
+                self.session_log.log("output", pane="secondary", stream=stream, text=text)
+            pane.insertPlainText(f"[Error] {text}" if stream == "stderr" else text)
+        pane.verticalScrollBar().setValue(pane.verticalScrollBar().maximum())
+
+    def open_find_bar(self):
+        """Open the find bar on whichever pane has focus."""
+        if self.split_view_enabled and (self.secondary_output.hasFocus() or self.secondary_input.hasFocus()):
+            self.find_bar.open_for(self.secondary_output, self.secondary_index)
+        else:
+            self.find_bar.open_for(self.output, self.output_index)
+
     def add_panel(self, panel_type="output"):
         """Panels are now integrated as split view."""
         pass
@@ -1308,45 +8115,68 @@ exit
             self.toggle_advanced_mode("advancedmode off")
     
     def load_favorites(self):
-        """Load favorite commands from file."""
-        fav_file = os.path.expanduser("~/.mops_favorites.json")
+        """Open the favorites database, importing the old JSON file once."""
         try:
-            if os.path.exists(fav_file):
-                with open(fav_file, 'r') as f:
-                    return json.load(f)
-        except Exception:
-            pass
-        return {}
-    
-    def save_favorites(self):
-        """Save favorite commands to file."""
-        fav_file = os.path.expanduser("~/.mops_favorites.json")
+            return FavoritesStore(self.FAVORITES_DB, legacy_json=os.path.expanduser("~/.mops_favorites.json"))
+        except Exception as e:
+            self.append_text(f"Error opening favorites: {e}\n", color="red")
+            return None
+
+    def add_favorite(self, command, name=None):
+        """Add a command to favorites under a stable, unique name."""
+        command = command.strip()
+        if not command:
+            self.append_text("Please provide a command.\n", color="red")
+            return
+        if self.favorites is None:
+            self.append_text("Favorites are unavailable.\n", color="red")
+            return
         try:
-            with open(fav_file, 'w') as f:
-                json.dump(self.favorites, f, indent=2)
+            name = self.favorites.add(command, name=name)
+            self.update_completer_model()
+            self.append_text(f"✓ Added to favorites as '{name}': {command}\n", color="green")
         except Exception as e:
             self.append_text(f"Error saving favorites: {e}\n", color="red")
-    
-    def add_favorite(self, command):
-        """Add a command to favorites."""
-        if command.strip():
-            key = command.split()[0] if command else "fav"
-            self.favorites[key] = command
-            self.save_favorites()
-            self.append_text(f"✓ Added to favorites: {command}\n", color="green")
-        else:
-            self.append_text("Please provide a command.\n", color="red")
-    
+
     def list_favorites(self):
-        """List all favorite commands."""
-        if not self.favorites:
+        """List favorite commands, most frecent first."""
+        ranked = self.favorites.ranked() if self.favorites is not None else []
+        if not ranked:
             self.append_text("No favorites yet. Use 'favorite [command]' to add one.\n", color="yellow")
             return
-        
+
         self.append_text("\n━━━━━━━━━━ Favorite Commands ━━━━━━━━━━\n", color="cyan")
-        for key, cmd in self.favorites.items():
-            self.append_text(f"  {key:20} → {cmd}\n", color="white")
+        for name, cmd, uses, last_used, _ in ranked:
+            when = time.strftime("%Y-%m-%d", time.localtime(last_used)) if last_used else "never"
+            self.append_text(f"  {name:20} → {cmd}  ", color="white")
+            self.append_text(f"({uses} uses, last {when})\n", color="gray")
         self.append_text("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n", color="cyan")
+
+    def favorite_command(self, arg):
+        """fav run NAME | fav add NAME COMMAND | fav rm NAME."""
+        parts = arg.split(None, 2)
+        action = parts[0].lower()
+        if self.favorites is None:
+            self.append_text("Favorites are unavailable.\n", color="red")
+        elif action == "run" and len(parts) > 1:
+            command = self.favorites.get(parts[1])
+            if command is None:
+                self.append_text(f"No favorite named '{parts[1]}'.\n", color="red")
+                return
+            # Run it directly: handle_command has already logged and recorded 'fav run'
+            self.favorites.touch(command)
+            self.append_text(f"→ {command}\n", color="gray", animate=False)
+            self.engine.dispatch(command)
+        elif action == "add" and len(parts) > 2:
+            self.add_favorite(parts[2], name=parts[1])
+        elif action in ("rm", "remove", "del") and len(parts) > 1:
+            if self.favorites.remove(parts[1]):
+                self.update_completer_model()
+                self.append_text(f"✓ Removed favorite '{parts[1]}'.\n", color="green")
+            else:
+                self.append_text(f"No favorite named '{parts[1]}'.\n", color="red")
+        else:
+            self.append_text("Usage: fav run <name> | fav add <name> <command> | fav rm <name>\n", color="yellow")
     
     def toggle_advanced_mode(self, cmd):
         """Toggle advanced mode with powerful features."""
@@ -1464,6 +8294,10 @@ Type 'help' to see all commands.
 
 
 if __name__ == "__main__":
+    # Needed for the calc worker process in frozen (PyInstaller) builds
+    multiprocessing.freeze_support()
+    if "--serve-socket" in sys.argv[1:-1]:
+        sys.exit(serve_sessions(sys.argv[sys.argv.index("--serve-socket") + 1]))
     app = QApplication(sys.argv)
     terminal = MopsTerminal()
     terminal.show()